@@ -3,7 +3,7 @@
 
 import io
 
-import agate
+from actionnetwork_activist_sync.export_diff import ExportDiff
 
 class ActionKitExport:
     """ActionKitExport converts two ActionKit Excel spreadsheets.
@@ -11,6 +11,9 @@ class ActionKitExport:
     The reason there are two is so we can calculate who is missing in
     the new sheet and who are new members.
 
+    diff() streams both files and doesn't need load(). The agate tables
+    are still available through load() for ad hoc analysis.
+
     Args:
         previous_file (io.IOBase): The last spreadsheet that was synced
         current_file (io.IOBase): The newest spreadsheet to be synced
@@ -39,6 +42,9 @@ class ActionKitExport:
         if not isinstance(self.current_file, io.IOBase):
             raise TypeError
 
+        # Only the tables need agate, diff() works without it
+        import agate # pylint: disable=import-outside-toplevel
+
         self.previous = agate.Table.from_csv(self.previous_file)
         self.current = agate.Table.from_csv(self.current_file)
 
@@ -48,8 +54,19 @@ class ActionKitExport:
         self.previous = self.previous.where(lambda row: row['email'] is not None)
         self.current = self.current.where(lambda row: row['email'] is not None)
 
-    def get_previous_not_in_current(self) -> agate.Table:
+    def get_previous_not_in_current(self) -> 'agate.Table':
         """Finds rows that were missing in the current spreadsheet"""
         return self.previous.select(['email']) \
             .join(self.current, 'email', 'email', columns=['email']) \
             .where(lambda row: row['email2'] is None)
+
+    def diff(self) -> ExportDiff:
+        """Classifies every row as new, changed, unchanged, lapsed or missing email"""
+
+        if not isinstance(self.previous_file, io.IOBase):
+            raise TypeError
+
+        if not isinstance(self.current_file, io.IOBase):
+            raise TypeError
+
+        return ExportDiff(self.previous_file, self.current_file)
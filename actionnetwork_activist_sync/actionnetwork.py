@@ -4,16 +4,224 @@
 https://actionnetwork.org/docs
 """
 
-import time
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from urllib.parse import quote, urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
 
 from pyactionnetwork import ActionNetworkApi
-from tenacity import Retrying, stop_after_attempt, wait_fixed
 
+from actionnetwork_activist_sync.metrics import metrics
 from actionnetwork_activist_sync.osdi import Person
+from actionnetwork_activist_sync.rate_limit import ACTIONNETWORK_RATE, RETRY_STATUSES, get_limiter
+
+# Can point at a local stand-in like benchmarks/simulator.py
+API_URL = os.environ.get('ACTIONNETWORK_API_URL', 'https://actionnetwork.org/api/v2/')
+# Largest page size the API accepts for collections
+MAX_PER_PAGE = 25
+
+def get_operation(method, url):
+    """Names a request for the metrics, with the IDs left out
+
+    Args:
+        method (str): HTTP method
+        url (str): Full URL
+
+    Returns:
+        str, e.g. 'PUT people/{id}' or 'GET lists/{id}/items'
+    """
+
+    path = urlsplit(url).path
+    # Collections and IDs take turns after the API root
+    parts = [part for part in path.partition('/api/v2')[2].split('/') if part]
+    parts = [part if i % 2 == 0 else '{id}' for i, part in enumerate(parts)]
+    return f"{method} {'/'.join(parts) or 'api'}"
+
+class PersonNotFoundError(Exception):
+    """The ActionNetwork person ID doesn't exist, e.g. after a merge"""
 
 class ActionNetwork(ActionNetworkApi):
-    """Helper class to interact with the ActionNetwork API"""
+    """Helper class to interact with the ActionNetwork API
+
+    All requests, including the ones made by the methods inherited from
+    ActionNetworkApi, go through one pooled requests.Session so TCP and
+    TLS connections get reused. They are scheduled by the RateLimiter
+    shared by everything using the same API key.
+
+    Args:
+        api_key (str): ActionNetwork API key
+        pool_size (int): Max connections kept open, should be at least
+            the number of threads sharing this object
+        timeout (tuple): (connect, read) timeout in seconds
+        keep_alive (bool): Reuse connections between requests
+        gzip (bool): Ask for compressed responses
+        limiter (RateLimiter): Defaults to the shared limiter for api_key
+    """
+
+    def __init__(self, api_key, pool_size=10, timeout=(5, 30), keep_alive=True, gzip=True,
+                 limiter=None, **kwargs):
+        self.timeout = timeout
+        self.limiter = limiter or get_limiter(api_key, ACTIONNETWORK_RATE)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Connection': 'keep-alive' if keep_alive else 'close',
+            'Accept-Encoding': 'gzip, deflate' if gzip else 'identity'
+        })
+
+        super().__init__(api_key, **kwargs)
+        # The parent falls back to the public API rather than API_URL
+        self.base_url = self.config.get('links', {}).get('self', API_URL)
+
+    def request(self, method, url, **kwargs):
+        """Sends a request through the pooled session once the rate limiter
+        allows it. Throttled and failed requests are retried with backoff.
+
+        Args:
+            method (str): HTTP method
+            url (str): Full URL
+
+        Returns:
+            requests.Response
+
+        Raises:
+            requests.HTTPError: Still throttled or failing after the last retry
+        """
+
+        kwargs.setdefault('timeout', self.timeout)
+        # Every attempt is recorded, throttled ones count as errors
+        response = self.limiter.call(
+            metrics.call, 'actionnetwork', get_operation(method, url),
+            self.session.request, method, url, headers=self.headers, **kwargs)
+        # Otherwise the error body would be read as if the request succeeded
+        if response.status_code in RETRY_STATUSES:
+            raise requests.HTTPError(
+                f'{response.status_code} from {method} {url} after retries', response=response)
+        return response
+
+    def refresh_config(self):
+        """Get a new version of the base_url config."""
+
+        self.config = self.request('GET', API_URL).json()
+
+    def get_resource(self, resource):
+        """Get a resource endpoint by name.
+
+        Args:
+            resource (str): Resource endpoint, e.g. 'people' or 'lists'
+
+        Returns:
+            dict
+        """
+
+        return self.request('GET', self.resource_to_url(resource)).json()
+
+    def get_person(self, person_id=None, search_by='email', search_string=None):
+        """Get a person by ID or search for one.
+
+        Args:
+            person_id (str): ActionNetwork ID
+            search_by (str): Field to filter on when there is no ID
+            search_string (str): Value to filter for
+
+        Returns:
+            dict
+        """
+
+        if person_id:
+            url = "{0}people/{1}".format(self.base_url, person_id)
+        else:
+            url = "{0}people/?filter={1} eq '{2}'".format(
+                self.base_url,
+                search_by,
+                quote(search_string))
+
+        return self.request('GET', url).json()
+
+    def create_person(self, email=None, given_name='', family_name='', address=(),
+                      city='', state='', country='', postal_code='', tags=(),
+                      custom_fields=None):
+        """Create a person with the person signup helper.
+
+        See: https://actionnetwork.org/docs/v2/person_signup_helper
+
+        Returns:
+            dict
+        """
+
+        url = "{0}people/".format(self.base_url)
+        payload = {
+            'person': {
+                'family_name': family_name,
+                'given_name': given_name,
+                'postal_addresses': [{
+                    'address_lines': list(address),
+                    'locality': city,
+                    'region': state,
+                    'country': country,
+                    'postal_code': postal_code
+                }],
+                'email_addresses': [{
+                    'address': email
+                }],
+                'custom_fields': custom_fields or {},
+            },
+            'add_tags': list(tags)
+        }
+
+        return self.request('POST', url, json=payload).json()
+
+    def upsert_person(self, person_id=None, **person):
+        """Create or update a person with a single POST to the person
+        signup helper, which matches existing people on email.
+
+        The fields are the same as create_person. person_id is accepted so a
+        FieldMapper payload can be passed as is, but the helper ignores it.
+
+        Returns:
+            Person object
+        """
+
+        return Person.from_json(self.create_person(**person))
+
+    def update_person(self, person_id=None, email=None, given_name=None, family_name=None,
+                      address=(), city=None, state=None, country=None, postal_code=None,
+                      tags=(), custom_fields=None):
+        """Update a person by ActionNetwork ID.
+
+        See: https://actionnetwork.org/docs/v2/people
+
+        Returns:
+            dict
+
+        Raises:
+            PersonNotFoundError: The ID doesn't exist (anymore)
+        """
+
+        url = "{0}people/{1}".format(self.base_url, person_id)
+        payload = {
+            'family_name': family_name,
+            'given_name': given_name,
+            'postal_addresses': [{
+                'address_lines': list(address),
+                'locality': city,
+                'region': state,
+                'country': country,
+                'postal_code': postal_code
+            }],
+            'email_addresses': [{
+                'address': email
+            }],
+            'add_tags': list(tags),
+            'custom_fields': custom_fields or {},
+        }
+
+        return self.put_person(url, payload)
 
     def remove_member_by_email(self, email):
         """Update custom field that flags membership (is_member)
@@ -25,22 +233,49 @@ class ActionNetwork(ActionNetworkApi):
             list of Person objects with updated data
         """
 
-        updated_people = []
-        people = self.get_people_by_email(email)
-        for person in people:
-            for attempt in Retrying(stop=stop_after_attempt(3), wait=wait_fixed(5)):
-                with attempt:
-                    url = "{0}people/{1}".format(self.base_url, person.get_actionnetwork_id())
-                    payload = {
-                        'email_addresses': [{
-                            'address': email
-                        }],
-                        'custom_fields': {'is_member': 'False'}
-                    }
-                    response = requests.put(url, json=payload, headers=self.headers).json()
+        return [
+            self.remove_member_by_id(person.get_actionnetwork_id(), email)
+            for person in self.get_people_by_email(email)
+        ]
+
+    def remove_member_by_id(self, person_id, email):
+        """Update custom field that flags membership (is_member) without
+        searching for the person first.
+
+        Args:
+            person_id (str): ActionNetwork ID
+            email (str): email address to update
+
+        Returns:
+            Person object with updated data
+
+        Raises:
+            PersonNotFoundError: The ID doesn't exist (anymore)
+        """
+
+        url = "{0}people/{1}".format(self.base_url, person_id)
+        payload = {
+            'email_addresses': [{
+                'address': email
+            }],
+            'custom_fields': {'is_member': 'False'}
+        }
+        return Person.from_json(self.put_person(url, payload))
+
+    def put_person(self, url, payload):
+        """Sends a PUT to a person URL.
+
+        Returns:
+            dict
+
+        Raises:
+            PersonNotFoundError: The person doesn't exist (anymore)
+        """
 
-            updated_people.append(Person(**response))
-        return updated_people
+        response = self.request('PUT', url, json=payload)
+        if response.status_code == 404:
+            raise PersonNotFoundError(url)
+        return response.json()
 
     def get_people_by_email(self, email):
         """Search for people by email
@@ -52,11 +287,9 @@ class ActionNetwork(ActionNetworkApi):
             list of Person objects with updated data
         """
 
-        for attempt in Retrying(stop=stop_after_attempt(3), wait=wait_fixed(5)):
-            with attempt:
-                response = self.get_person(search_by='email_address', search_string=email)
+        response = self.get_person(search_by='email_address', search_string=email)
 
-        return [Person(**p) for p in response['_embedded']['osdi:people']]
+        return [Person.from_json(p) for p in response['_embedded']['osdi:people']]
 
     def get_person_by_id(self, person_id):
         """Get a person by the ActionNetwork ID
@@ -68,18 +301,12 @@ class ActionNetwork(ActionNetworkApi):
             Person object
         """
 
-        for _ in range(0, 3):
-            try:
-                response = self.get_person(person_id=person_id)
-            except requests.exceptions.ConnectionError:
-                time.sleep(5)
-            if response:
-                break
+        response = self.get_person(person_id=person_id)
 
         if not response:
             raise Exception('Failed to contact ActionNetwork API to get person')
 
-        return Person(**response)
+        return Person.from_json(response)
 
     def subscribe_person(self, person):
         """Subscribe a person to ActionNetwork.
@@ -97,7 +324,7 @@ class ActionNetwork(ActionNetworkApi):
 
         url = "{0}people/".format(self.base_url)
         payload = {'person': {'email_addresses': person['email_addresses']}}
-        requests.post(url, json=payload, headers=self.headers)
+        return self.request('POST', url, json=payload)
 
     def get_neighborhood_reports(self):
         """Returns all reports based on the naming convetion defined
@@ -109,17 +336,20 @@ class ActionNetwork(ActionNetworkApi):
             list of reports.
         """
 
-        page = 1
-        reports = []
+        return list(filter(self.is_neighborhood_report, self.iter_reports()))
+
+    def iter_reports(self):
+        """Streams every OSDI List (report), one page at a time.
+
+        See: https://actionnetwork.org/docs/v2/lists
 
-        while True:
-            batch = self.get_reports(page)
-            if not batch:
-                break
-            reports.extend(batch)
-            page += 1
+        Yields:
+            OSDI List
+        """
 
-        return list(filter(self.is_neighborhood_report, reports))
+        url = f"{self.resource_to_url('lists')}?per_page={MAX_PER_PAGE}"
+        for page in self.iter_pages(url):
+            yield from page.get('_embedded', {}).get('osdi:lists', [])
 
     def get_reports(self, page=1):
         """Used for the Lists endpoint.
@@ -134,8 +364,8 @@ class ActionNetwork(ActionNetworkApi):
         """
 
         base = self.resource_to_url('lists')
-        url = f'{base}?page={page}'
-        resp = requests.get(url, headers=self.headers).json()
+        url = f'{base}?page={page}&per_page={MAX_PER_PAGE}'
+        resp = self.request('GET', url).json()
         return resp['_embedded']['osdi:lists']
 
     def is_neighborhood_report(self, report):
@@ -166,10 +396,25 @@ class ActionNetwork(ActionNetworkApi):
         """
 
         list_url = report['_links']['self']['href']
-        url = f'{list_url}/items?page={page}'
-        resp = requests.get(url, headers=self.headers).json()
+        url = f'{list_url}/items?page={page}&per_page={MAX_PER_PAGE}'
+        resp = self.request('GET', url).json()
         return resp['_embedded']['osdi:items']
 
+    def iter_people_from_report(self, report):
+        """Streams the OSDI Items (people) of a report, one page at a time.
+
+        Args:
+            report (dict): Report from lists endpoint
+
+        Yields:
+            OSDI item
+        """
+
+        list_url = report['_links']['self']['href']
+        url = f'{list_url}/items?per_page={MAX_PER_PAGE}'
+        for page in self.iter_pages(url):
+            yield from page.get('_embedded', {}).get('osdi:items', [])
+
     def get_all_people_from_report(self, report):
         """Handles pagination for fetching all people from a report.
 
@@ -180,14 +425,58 @@ class ActionNetwork(ActionNetworkApi):
             list of People
         """
 
-        page = 1
-        people = []
+        return list(self.iter_people_from_report(report))
 
-        while True:
-            batch = self.get_people_from_report(report, page)
-            if not batch:
-                break
-            people.extend(batch)
-            page += 1
+    def iter_pages(self, url):
+        """Follows a HAL collection from its first page to the last.
+
+        The next page is fetched in the background while the caller works
+        on the current one. Paging stops at the last page according to
+        _links.next and total_pages, so no empty page is requested.
+
+        Args:
+            url (str): URL of the first page
+
+        Yields:
+            dict for each page
+        """
 
-        return people
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self._get_json, url)
+            while future is not None:
+                page = future.result()
+
+                next_url = page.get('_links', {}).get('next', {}).get('href')
+                if next_url and 'per_page=' not in next_url:
+                    # Keep the page size if the next link dropped it
+                    next_url += ('&' if '?' in next_url else '?') + f'per_page={MAX_PER_PAGE}'
+                is_last = 'total_pages' in page and page.get('page', 1) >= page['total_pages']
+                future = None
+                if next_url and not is_last:
+                    future = executor.submit(self._get_json, next_url)
+
+                yield page
+
+    def _get_json(self, url):
+        return self.request('GET', url).json()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_actionnetwork_client(api_key, **kwargs):
+    """
+    Gets the shared ActionNetwork client for an API key, creating it on
+    first use. Clients are kept for warm invocations.
+
+    Args:
+        api_key (str): ActionNetwork API key
+        kwargs: Passed to ActionNetwork when creating the client
+
+    Returns:
+        ActionNetwork
+    """
+
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = ActionNetwork(api_key, **kwargs)
+        return _clients[api_key]
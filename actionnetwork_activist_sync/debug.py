@@ -37,7 +37,7 @@ class PersonCompare:
             'person_id'
         ]
 
-        for difference in diff(self.existing.__dict__, self.updated, ignore=ignore):
+        for difference in diff(self.existing.to_dict(), self.updated, ignore=ignore):
             if difference[0] == 'add':
                 fmt_str = '{}{:>50}{} | {}{:<50}{}'
                 left = ''
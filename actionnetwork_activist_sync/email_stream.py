@@ -0,0 +1,171 @@
+"""
+Helpers for reading MIME emails from a byte stream without holding
+the whole message in memory
+"""
+
+import binascii
+import email.parser
+import email.policy
+
+CHUNK_SIZE = 64 * 1024
+
+def iter_lines(stream, chunk_size=CHUNK_SIZE):
+    """
+    Splits a byte stream into lines, keeping the line endings.
+
+    Args:
+        stream: Anything with a read(size) method, e.g. an S3 StreamingBody
+        chunk_size (int): Number of bytes to read at a time
+
+    Yields:
+        bytes
+    """
+
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+
+    if pending:
+        yield pending
+
+def parse_headers(lines):
+    """
+    Consumes lines up to and including the blank line that ends a header block.
+
+    Returns:
+        email.message.EmailMessage with only headers set
+    """
+
+    block = []
+    for line in lines:
+        if not line.strip():
+            break
+        block.append(line)
+
+    parser = email.parser.BytesParser(policy=email.policy.default)
+    return parser.parsebytes(b''.join(block), headersonly=True)
+
+class StreamingAttachment:
+    """
+    A single attachment of a StreamingEmail. The content can only be read once.
+
+    Args:
+        headers (email.message.EmailMessage): The MIME part headers
+        lines (iterator): The email lines, positioned at the start of the part body
+        boundary (bytes): The boundary of the enclosing multipart
+    """
+
+    def __init__(self, headers, lines, boundary):
+        self.headers = headers
+        self._lines = lines
+        self._boundary = boundary
+
+    def get_content_type(self):
+        return self.headers.get_content_type()
+
+    def get_filename(self):
+        return self.headers.get_filename()
+
+    def iter_content(self):
+        """
+        Decodes the attachment body as it is read.
+
+        Yields:
+            bytes
+        """
+
+        encoding = self.headers.get('Content-Transfer-Encoding', '7bit').lower()
+
+        if encoding == 'base64':
+            leftover = b''
+            for line in _iter_part_lines(self._lines, self._boundary):
+                leftover += b''.join(line.split())
+                usable = len(leftover) - len(leftover) % 4
+                if usable:
+                    yield binascii.a2b_base64(leftover[:usable])
+                    leftover = leftover[usable:]
+        elif encoding in ('7bit', '8bit', 'binary'):
+            # The line break before a boundary belongs to the boundary
+            previous = None
+            for line in _iter_part_lines(self._lines, self._boundary):
+                if previous is not None:
+                    yield previous
+                previous = line
+            if previous is not None:
+                yield previous.rstrip(b'\r\n')
+        else:
+            raise ValueError(f'Unsupported transfer encoding: {encoding}')
+
+class StreamingEmail:
+    """
+    Reads a MIME email from a byte stream. Headers are parsed up front,
+    parts are only read when asked for.
+
+    Args:
+        stream: Anything with a read(size) method, e.g. an S3 StreamingBody
+
+    Attributes:
+        headers (email.message.EmailMessage): The top level headers
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self._lines = iter_lines(stream, chunk_size)
+        self.headers = parse_headers(self._lines)
+
+    def get(self, name, failobj=None):
+        return self.headers.get(name, failobj)
+
+    def get_attachment(self):
+        """
+        Finds the first attachment in a multipart email.
+
+        Parts marked as attachments are preferred. Otherwise the first
+        part that isn't text or multipart is used.
+
+        Returns:
+            StreamingAttachment
+        """
+
+        if self.headers.get_content_maintype() != 'multipart':
+            raise ValueError('Email has no attachment')
+
+        boundary = self.headers.get_param('boundary').encode()
+
+        # Skip the preamble
+        for _ in _iter_part_lines(self._lines, boundary):
+            pass
+
+        while True:
+            headers = parse_headers(self._lines)
+            if not headers.keys():
+                raise ValueError('Email has no attachment')
+
+            is_attachment = headers.get_content_disposition() == 'attachment'
+            maintype = headers.get_content_maintype()
+            if is_attachment or maintype not in ('text', 'multipart'):
+                return StreamingAttachment(headers, self._lines, boundary)
+
+            for _ in _iter_part_lines(self._lines, boundary):
+                pass
+
+def _iter_part_lines(lines, boundary):
+    """Yields lines until the next boundary delimiter, which is consumed"""
+
+    delimiter = b'--' + boundary
+    for line in lines:
+        stripped = line.rstrip()
+        if stripped == delimiter:
+            return
+        if stripped == delimiter + b'--':
+            # Close delimiter, drain the epilogue
+            for _ in lines:
+                pass
+            return
+        yield line
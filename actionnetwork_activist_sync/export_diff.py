@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming comparison of two ActionKit export CSVs keyed on email
+"""
+
+from collections import Counter, namedtuple
+import csv
+import hashlib
+import json
+
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+LAPSED = 'lapsed'
+MISSING_EMAIL = 'missing_email'
+
+DiffRow = namedtuple('DiffRow', ['status', 'email', 'row'])
+
+def get_row_digest(row):
+    """
+    Creates a stable hash of a CSV row. Column order, key case and
+    surrounding whitespace don't change the result.
+
+    Args:
+        row (dict): A single row from an ActionKit export
+
+    Returns:
+        bytes (SHA-256 digest)
+    """
+
+    normalized = {
+        k.strip().lower(): v.strip() if isinstance(v, str) else v
+        for k, v in row.items() if k is not None
+    }
+    encoded = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).digest()
+
+def normalize_email(email):
+    """Lowercases and strips an email, returns None when it is empty"""
+
+    if not email:
+        return None
+    return email.strip().lower() or None
+
+def read_rows(csv_file):
+    """
+    Reads an export one row at a time.
+
+    Yields:
+        dict
+    """
+
+    reader = csv.DictReader(csv_file)
+    if reader.fieldnames:
+        # Excel puts a byte order mark in front of the header
+        reader.fieldnames[0] = reader.fieldnames[0].lstrip('\ufeff')
+    yield from reader
+
+class ExportDiff:
+    """Compares the previous and current export in one pass over each file.
+
+    Only the previous export is held in memory, and only as an email to
+    digest map. The current export is streamed and every row is classified
+    as it is read. Previous emails that were never matched are lapsed.
+
+    Args:
+        previous_file (io.IOBase): The last spreadsheet that was synced
+        current_file (io.IOBase): The newest spreadsheet to be synced
+
+    Attributes:
+        counts (collections.Counter): Number of rows per status, complete
+            once the diff has been iterated
+    """
+
+    def __init__(self, previous_file, current_file):
+        self.previous_file = previous_file
+        self.current_file = current_file
+        self.counts = Counter()
+
+    def __iter__(self):
+        """
+        Yields:
+            DiffRow for every current row, then one for every lapsed email.
+            Lapsed rows only have the email column.
+        """
+
+        previous = {}
+        for row in read_rows(self.previous_file):
+            email = normalize_email(row.get('email'))
+            if email:
+                previous[email] = (row['email'], get_row_digest(row))
+
+        matched = set()
+        for row in read_rows(self.current_file):
+            email = normalize_email(row.get('email'))
+
+            if email is None:
+                status = MISSING_EMAIL
+            elif email in previous:
+                matched.add(email)
+                unchanged = previous[email][1] == get_row_digest(row)
+                status = UNCHANGED if unchanged else CHANGED
+            else:
+                status = NEW
+
+            self.counts[status] += 1
+            yield DiffRow(status, email, row)
+
+        for email, (original, _) in previous.items():
+            if email not in matched:
+                self.counts[LAPSED] += 1
+                yield DiffRow(LAPSED, email, {'email': original})
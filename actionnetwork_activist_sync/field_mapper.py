@@ -1,10 +1,48 @@
 # -*- coding: utf-8 -*-
 """Logic to convert people data from ActionKit to ActionNetwork"""
 
+import csv
 from datetime import datetime
 from decimal import Decimal
+from operator import itemgetter
 import random
 
+# Custom field name -> export column
+CUSTOM_FIELD_COLUMNS = (
+    ('Middle Name', 'middle_name'),
+    # Suffix: not used
+    ('Address Line 2', 'mailing_address2'),
+    # Mailing_Address1,Mailing_Address2,Mailing_City,Mailing_State,Mailing_Zip: not used
+    ('Mail Preference', 'mailing_preference'),
+    ('Do Not Call', 'do_not_call'),
+    ('Do Not Text', 'p2ptext_optout'),
+
+    ('monthly_dues_status', 'monthly_dues_status'),
+    ('annual_recurring_dues_status', 'annual_recurring_dues_status'),
+
+    ('union_member', 'union_member'),
+    ('union_name', 'union_name'),
+    ('union_local', 'union_local'),
+    ('student_yes_no', 'student_yes_no'),
+    ('student_school_name', 'student_school_name'),
+    ('YDSA Chapter', 'ydsa_chapter')
+)
+
+# Columns of the basic ActionNetwork fields
+PERSON_COLUMNS = (
+    'email',
+    'first_name',
+    'last_name',
+    'mailing_address1',
+    'mailing_city',
+    'mailing_state',
+    'mailing_zip',
+    'memb_status_letter'
+)
+
+# In order of preference
+PHONE_COLUMNS = ('best_phone', 'mobile_phone', 'home_phone', 'work_phone')
+
 class FieldMapper:
     """Map fields from ActionKit to ActionNetwork
 
@@ -43,43 +81,13 @@ class FieldMapper:
             'custom_fields': self.get_custom_fields()
         }
 
-        if self.person_id:
-            person['person_id'] = self.person_id
-
-        for field, value in self.overrides.items():
-            if field in person:
-                person[field] = value
-
-            if field in person['custom_fields']:
-                person['custom_fields'][field] = value
-
-        return person
+        return apply_overrides(person, self.person_id, self.overrides)
 
     def get_phone(self):
         """Normalizes phone data"""
 
-        # prefer best_phone
-        phone = self.exported_person.get('best_phone')
-
-        # fallback to mobile
-        if not phone:
-            phone = self.exported_person.get('mobile_phone')
-
-        # fallback to home
-        if not phone:
-            phone = self.exported_person.get('home_phone')
-
-        if not phone:
-            phone = self.exported_person.get('work_phone')
-
-        # clean phone data
-        if phone:
-            phone = phone.replace('-', '')
-            phone = phone.replace(' ', '')
-            multi_phone = phone.split(',')
-            phone = multi_phone[0]
-
-        return phone
+        # prefer best_phone, then fallback to mobile, home and work
+        return clean_phone([self.exported_person.get(column) for column in PHONE_COLUMNS])
 
     def get_email(self):
         return self.exported_person.get('email')
@@ -93,61 +101,33 @@ class FieldMapper:
     def get_postal_code(self):
         """Normalizes postal code data"""
 
-        postal_code = self.exported_person.get('mailing_zip', default='')
-        if postal_code and len(postal_code) < 5 and postal_code.isnumeric():
-            postal_code = f'{postal_code:0>5}'
-
-        return postal_code
+        return clean_postal_code(self.exported_person.get('mailing_zip', default=''))
 
     def get_is_member(self):
         """Calculates membership status"""
 
-        is_member = False
-
-        memb_status = self.exported_person.get('memb_status_letter')
-        if memb_status == 'M':
-            is_member = True
-
-        return is_member
+        return self.exported_person.get('memb_status_letter') == 'M'
 
     def get_custom_fields(self):
         """Formats custom fields"""
 
         custom_fields = {
-            'Middle Name': self.exported_person.get('middle_name'),
-            # Suffix: not used
-            'Address Line 2': self.exported_person.get('mailing_address2'),
-            # Mailing_Address1,Mailing_Address2,Mailing_City,Mailing_State,Mailing_Zip: not used
-            'Mail Preference': self.exported_person.get('mailing_preference'),
-            'Do Not Call': self.exported_person.get('do_not_call'),
-            'Do Not Text': self.exported_person.get('p2ptext_optout'),
-
-            'monthly_dues_status': self.exported_person.get('monthly_dues_status'),
-            'annual_recurring_dues_status': self.exported_person.get('annual_recurring_dues_status'),
-
-            'union_member': self.exported_person.get('union_member'),
-            'union_name': self.exported_person.get('union_name'),
-            'union_local': self.exported_person.get('union_local'),
-            'student_yes_no': self.exported_person.get('student_yes_no'),
-            'student_school_name': self.exported_person.get('student_school_name'),
-            'YDSA Chapter': self.exported_person.get('ydsa_chapter'),
-
-            'Phone': self.get_phone(),
-            'is_member': self.is_member
+            field: self.exported_person.get(column)
+            for field, column in CUSTOM_FIELD_COLUMNS
         }
+        custom_fields['Phone'] = self.get_phone()
+        custom_fields['is_member'] = self.is_member
 
-        # filter None
-        custom_fields = {k:v for k,v in custom_fields.items() if v is not None}
+        return clean_custom_fields(custom_fields)
 
-        for k,v in custom_fields.items():
-            if isinstance(v, Decimal):
-                custom_fields[k] = str(v)
-            elif isinstance(v, datetime):
-                custom_fields[k] = str(v)
-            elif isinstance(v, bool):
-                custom_fields[k] = 'True' if v else 'False'
+    def get_keycloak_user(self):
+        """Keycloak user fields, without the username"""
 
-        return custom_fields
+        return {
+            'email': self.get_email(),
+            'firstName': self.get_first_name(),
+            'lastName': self.get_last_name()
+        }
 
     def generate_username(self):
         """
@@ -160,13 +140,251 @@ class FieldMapper:
         # Fall back to Rose as a default first name.
         # Agate default covers case where first_name doesn't exist,
         # but not when it's None or empty.
-        first_name = self.exported_person.get('first_name', default='Rose')
-        if not first_name:
-            first_name = 'Rose'
+        return generate_username(
+            self.exported_person.get('first_name', default='Rose'),
+            self.exported_person.get('last_name', default=''))
+
+class BatchFieldMapper:
+    """Map a whole ActionKit export to ActionNetwork and Keycloak payloads
+
+    Which columns exist and where the fields come from is worked out
+    once from the export header. Each row is then read with a single
+    itemgetter call. The output matches FieldMapper for the same row.
+
+    Args:
+        columns (iterable): Column names of the export
+
+    Attributes:
+        columns (tuple): The export columns the mapping reads
+    """
+
+    def __init__(self, columns):
+        present = set(columns)
+        used = PERSON_COLUMNS + PHONE_COLUMNS + tuple(c for _, c in CUSTOM_FIELD_COLUMNS)
+        self.columns = tuple(dict.fromkeys(c for c in used if c in present))
+
+        # Position of each column in the itemgetter tuple, None when missing
+        index = {column: i for i, column in enumerate(self.columns)}
+        self._person = tuple(index.get(c) for c in PERSON_COLUMNS)
+        self._phones = tuple(index.get(c) for c in PHONE_COLUMNS)
+        self._custom = tuple(
+            (field, index[column]) for field, column in CUSTOM_FIELD_COLUMNS if column in index)
+
+        if len(self.columns) > 1:
+            self._getter = itemgetter(*self.columns)
+        elif self.columns:
+            single = itemgetter(self.columns[0])
+            self._getter = lambda row: (single(row),)
+        else:
+            self._getter = lambda row: ()
+
+    @classmethod
+    def map_all(cls, rows):
+        """Maps rows that share a header, e.g. the raw dicts of one export
+
+        Returns:
+            list of MappedPerson
+        """
+
+        rows = list(rows)
+        if not rows:
+            return []
+        return cls(rows[0].keys()).map_rows(rows)
+
+    @classmethod
+    def map_csv(cls, csv_file):
+        """Maps every row of an export CSV
+
+        Args:
+            csv_file: Open text file
+
+        Returns:
+            list of MappedPerson
+        """
+
+        reader = csv.DictReader(csv_file)
+        return cls(reader.fieldnames or ()).map_rows(reader)
+
+    def map_rows(self, rows):
+        """
+        Returns:
+            list of MappedPerson
+        """
+
+        return [self.map_row(row) for row in rows]
+
+    def map_row(self, row):
+        """
+        Args:
+            row (dict or agate.Row): Single person record from the export
+
+        Returns:
+            MappedPerson
+        """
+
+        try:
+            values = self._getter(row)
+        except KeyError:
+            # This row doesn't have the export header
+            return BatchFieldMapper(row.keys()).map_row(row)
+
+        # Like agate.Row.get, a missing column reads as None
+        email, first, last, address1, city, state, postal_code, memb_status = (
+            None if i is None else values[i] for i in self._person)
+
+        is_member = memb_status == 'M'
+
+        custom_fields = {field: values[i] for field, i in self._custom}
+        phones = [None if i is None else values[i] for i in self._phones]
+        custom_fields['Phone'] = clean_phone(phones)
+        custom_fields['is_member'] = is_member
+
+        person = {
+            'email': email,
+            'given_name': first,
+            'family_name': last,
+            'address': [address1] if address1 else [],
+            'city': city,
+            'state': state,
+            'country': 'US', # no country field in export
+            'postal_code': clean_postal_code(postal_code),
+            'custom_fields': clean_custom_fields(custom_fields)
+        }
+
+        return MappedPerson(person, is_member)
+
+class MappedPerson:
+    """One row mapped by BatchFieldMapper
+
+    It has the same interface as FieldMapper, so it can be used
+    wherever a FieldMapper is expected (e.g. KeycloakService).
+
+    Args:
+        person (dict): ActionNetwork person without person_id and overrides
+        is_member (bool): Membership status
+
+    Attributes:
+        person_id (int): ActionNetwork ID (optional)
+        overrides (dict): fields to override
+        is_member (bool): Membership status
+    """
+
+    __slots__ = ('person_id', 'overrides', 'is_member', '_person')
+
+    def __init__(self, person, is_member):
+        self.person_id = None
+        self.overrides = {}
+        self.is_member = is_member
+        self._person = person
+
+    def get_actionnetwork_person(self):
+        person = dict(self._person)
+        person['address'] = list(person['address'])
+        person['custom_fields'] = dict(person['custom_fields'])
+        return apply_overrides(person, self.person_id, self.overrides)
+
+    def get_keycloak_user(self):
+        """Keycloak user fields, without the username"""
+
+        return {
+            'email': self.get_email(),
+            'firstName': self.get_first_name(),
+            'lastName': self.get_last_name()
+        }
+
+    def get_email(self):
+        return self._person['email']
+
+    def get_first_name(self):
+        return self._person['given_name']
+
+    def get_last_name(self):
+        return self._person['family_name']
+
+    def get_phone(self):
+        return self._person['custom_fields'].get('Phone')
+
+    def get_postal_code(self):
+        return self._person['postal_code']
+
+    def get_is_member(self):
+        return self.is_member
+
+    def get_custom_fields(self):
+        return dict(self._person['custom_fields'])
+
+    def generate_username(self):
+        return generate_username(self._person['given_name'], self._person['family_name'])
+
+def apply_overrides(person, person_id, overrides):
+    """Sets the ActionNetwork ID and applies override fields to a person"""
+
+    if person_id:
+        person['person_id'] = person_id
+
+    for field, value in overrides.items():
+        if field in person:
+            person[field] = value
+
+        if field in person['custom_fields']:
+            person['custom_fields'][field] = value
+
+    return person
+
+def clean_phone(phones):
+    """Picks the first phone number and normalizes it"""
+
+    phone = None
+    for phone in phones:
+        if phone:
+            break
+
+    # clean phone data
+    if phone:
+        phone = phone.replace('-', '')
+        phone = phone.replace(' ', '')
+        multi_phone = phone.split(',')
+        phone = multi_phone[0]
+
+    return phone
+
+def clean_postal_code(postal_code):
+    """Pads numeric zip codes that lost their leading zeros"""
+
+    if postal_code and len(postal_code) < 5 and postal_code.isnumeric():
+        postal_code = f'{postal_code:0>5}'
+
+    return postal_code
+
+def clean_custom_fields(custom_fields):
+    """Drops empty custom fields and converts values to API strings"""
+
+    # filter None
+    custom_fields = {k:v for k,v in custom_fields.items() if v is not None}
+
+    for k,v in custom_fields.items():
+        if isinstance(v, Decimal):
+            custom_fields[k] = str(v)
+        elif isinstance(v, datetime):
+            custom_fields[k] = str(v)
+        elif isinstance(v, bool):
+            custom_fields[k] = 'True' if v else 'False'
+
+    return custom_fields
+
+def generate_username(first_name, last_name):
+    """
+    Generates a username of the format:
+        FirstNameLastInitialFourRandomNumbers
+    """
+
+    # Fall back to Rose as a default first name.
+    if not first_name:
+        first_name = 'Rose'
 
-        last_initial = self.exported_person.get('last_name', default='')[:1]
+    last_initial = (last_name or '')[:1]
 
-        # Add some randomness since FirstName LastIntial has collision potential
-        rnd = str(random.randint(10, 9999)).zfill(4)
+    # Add some randomness since FirstName LastIntial has collision potential
+    rnd = str(random.randint(10, 9999)).zfill(4)
 
-        return f"{first_name}{last_initial}{rnd}"
\ No newline at end of file
+    return f"{first_name}{last_initial}{rnd}"
\ No newline at end of file
@@ -1,16 +1,130 @@
+import threading
+import time
+
 from keycloak import KeycloakAdmin
-from tenacity import Retrying, stop_after_attempt, wait_fixed
+from keycloak.exceptions import KeycloakGetError, raise_error_from_response
+from keycloak.urls_patterns import URL_ADMIN_USERS
 
 from actionnetwork_activist_sync.field_mapper import FieldMapper
+from actionnetwork_activist_sync.metrics import metrics
+from actionnetwork_activist_sync.rate_limit import KEYCLOAK_RATE, RateLimiter, get_limiter
+
+# Users per request when prefetching the realm
+USERS_PAGE_SIZE = 100
+# Seconds before expiry when the admin token gets replaced
+TOKEN_REFRESH_MARGIN = 30
 
 class KeycloakService:
     """
     A service class that interacts with the lower level keycloak API
     and provides the actions necessary for the sync.
+
+    Every API call is scheduled by a RateLimiter, which retries throttled
+    and failed calls with backoff.
+
+    With prefetch the realm's users are paged through once, on the first
+    lookup, into maps by email and by username. Lookups and username checks
+    are then answered from memory. The maps are updated as users get
+    created and updated.
+
+    The service can be kept across warm Lambda invocations. The admin
+    token is only replaced shortly before it expires.
     """
 
-    def __init__(self, keycloak: KeycloakAdmin):
+    def __init__(self, keycloak: KeycloakAdmin, limiter: RateLimiter = None,
+                 prefetch: bool = False, page_size: int = USERS_PAGE_SIZE,
+                 clock=time.monotonic):
         self.keycloak = keycloak
+        self.limiter = limiter or get_limiter('keycloak', KEYCLOAK_RATE)
+        self.prefetch = prefetch
+        self.page_size = page_size
+        self.clock = clock
+
+        self._by_email = None
+        self._by_username = None
+        self._lock = threading.RLock()
+
+        self._token_lock = threading.Lock()
+        self._token_expires = self._get_token_expiry()
+
+    def ensure_token(self):
+        """Gets a new admin token when the current one is about to expire"""
+
+        if self.clock() < self._token_expires - TOKEN_REFRESH_MARGIN:
+            return
+
+        with self._token_lock:
+            if self.clock() < self._token_expires - TOKEN_REFRESH_MARGIN:
+                return
+            # Client credentials tokens don't come with a refresh token
+            if self.keycloak.token.get('refresh_token'):
+                with metrics.timed('keycloak', 'refresh_token'):
+                    self.keycloak.refresh_token()
+            else:
+                with metrics.timed('keycloak', 'get_token'):
+                    self.keycloak.get_token()
+            self._token_expires = self._get_token_expiry()
+
+    def _get_token_expiry(self) -> float:
+        token = getattr(self.keycloak, 'token', None)
+        if not isinstance(token, dict) or 'expires_in' not in token:
+            return float('inf')
+        return self.clock() + token['expires_in']
+
+    def _call(self, func, *args, **kwargs):
+        """Calls the API with a fresh token, scheduled by the rate limiter"""
+
+        self.ensure_token()
+        return self.limiter.call(
+            metrics.call, 'keycloak', getattr(func, '__name__', 'call'), func, *args, **kwargs)
+
+    def clear_users(self):
+        """Drops the prefetched maps, they get loaded again on the next lookup"""
+
+        with self._lock:
+            self._by_email = None
+            self._by_username = None
+
+    def load_users(self):
+        """Pages through every user of the realm with first/max into the maps"""
+
+        by_email = {}
+        by_username = {}
+        first = 0
+
+        while True:
+            users = self._call(self.get_users_page, first, self.page_size)
+            for user in users:
+                if user.get('email'):
+                    by_email[user['email'].lower()] = user
+                by_username[user['username'].lower()] = user
+            if len(users) < self.page_size:
+                break
+            first += self.page_size
+
+        with self._lock:
+            self._by_email = by_email
+            self._by_username = by_username
+
+    def get_users_page(self, first: int, max_results: int) -> list:
+        """Gets one page of users.
+
+        KeycloakAdmin.get_users always fetches every page itself, so this
+        calls the endpoint directly.
+        """
+        url = URL_ADMIN_USERS.format(**{'realm-name': self.keycloak.realm_name})
+        response = self.keycloak.raw_get(url, first=first, max=max_results)
+        return raise_error_from_response(response, KeycloakGetError)
+
+    def is_loaded(self) -> bool:
+        """Loads the maps on first use when prefetching is on"""
+
+        if not self.prefetch:
+            return False
+        with self._lock:
+            if self._by_email is None:
+                self.load_users()
+        return True
 
     def get_user_by_username(self, username: str) -> dict:
         """Searches the API for a user with an username.
@@ -21,12 +135,11 @@ class KeycloakService:
         Returns:
             A dict representing a user if found, None otherwise
         """
-        for attempt in Retrying(stop=stop_after_attempt(3), wait=wait_fixed(5)):
-            with attempt:
-                users = self.keycloak.get_users({'username': username})
-                keycloak_user = next(iter(users), None)
+        if self.is_loaded():
+            return self._by_username.get(username.lower())
 
-        return keycloak_user
+        users = self._call(self.keycloak.get_users, {'username': username})
+        return next(iter(users), None)
 
     def get_user_by_email(self, email: str) -> dict:
         """Searches the API for a user with an email.
@@ -37,12 +150,11 @@ class KeycloakService:
         Returns:
             A dict representing a user if found, None otherwise
         """
-        for attempt in Retrying(stop=stop_after_attempt(3), wait=wait_fixed(5)):
-            with attempt:
-                users = self.keycloak.get_users({'email': email})
-                keycloak_user = next(iter(users), None)
+        if self.is_loaded():
+            return self._by_email.get(email.lower())
 
-        return keycloak_user
+        users = self._call(self.keycloak.get_users, {'email': email})
+        return next(iter(users), None)
 
     def check_username(self, username: str):
         """Checks if a username is in use.
@@ -58,46 +170,106 @@ class KeycloakService:
         """Updates an existing user.
 
         Args:
-            field_mapper: the raw user data from a CSV
+            field_mapper: the raw user data from a CSV, a FieldMapper or MappedPerson
             keycloak_user: the already found user in keycloak
         """
         keycloak_user_id = keycloak_user['id']
         username = keycloak_user['username']
 
+        payload = {
+            "username": username,
+            **field_mapper.get_keycloak_user(),
+            "enabled": True,
+            "emailVerified": True
+        }
+
         # This is the legacy style username. Migrate user to non-email username.
         if keycloak_user['username'].lower() == keycloak_user['email'].lower():
-            username = field_mapper.generate_username()
-            self.check_username(username)
-
-        self.keycloak.update_user(
-            user_id=keycloak_user_id,
-            payload={
-                "username": username,
-                "email": field_mapper.get_email(),
-                "firstName": field_mapper.get_first_name(),
-                "lastName": field_mapper.get_last_name(),
-                "enabled": True,
-                "emailVerified": True
-            }
-        )
+            payload['username'] = field_mapper.generate_username()
+
+        updated_user = {**keycloak_user, **payload}
+        if payload['username'] != username:
+            self._claim_username(updated_user)
+
+        try:
+            self._call(
+                self.keycloak.update_user,
+                user_id=keycloak_user_id,
+                payload=payload
+            )
+        except Exception:
+            with self._lock:
+                self._forget(updated_user)
+                self._remember(keycloak_user)
+            raise
+
+        with self._lock:
+            self._remember(updated_user, previous=keycloak_user)
 
     def create_user(self, field_mapper: FieldMapper):
         """Creates a new user.
 
         Args:
-            field_mapper: the raw user data from a CSV
-        """
-        username = field_mapper.generate_username()
-
-        self.check_username(username)
+            field_mapper: the raw user data from a CSV, a FieldMapper or MappedPerson
 
-        self.keycloak.create_user(payload={
-            "username": username,
-            "email": field_mapper.get_email(),
-            "firstName": field_mapper.get_first_name(),
-            "lastName": field_mapper.get_last_name(),
+        Raises:
+            ValueError if username is already taken
+        """
+        payload = {
+            "username": field_mapper.generate_username(),
+            **field_mapper.get_keycloak_user(),
             "enabled": True,
             "requiredActions": [
                 "UPDATE_PASSWORD"
             ]
-        })
+        }
+
+        self._claim_username(payload)
+
+        try:
+            # The username was checked already, exist_ok would look it up again
+            user_id = self._call(self.keycloak.create_user, payload=payload, exist_ok=False)
+        except Exception as error:
+            with self._lock:
+                self._forget(payload)
+            if isinstance(error, KeycloakGetError) and error.response_code == 409:
+                # Taken since the users were loaded, the caller retries with a new username
+                raise ValueError('Username exists') from error
+            raise
+
+        with self._lock:
+            self._remember({**payload, 'id': user_id}, previous=payload)
+
+    def _claim_username(self, user: dict):
+        """Checks that the username is free. With the maps loaded, the user
+        is put in them right away so other threads can't claim it too.
+
+        Raises:
+            ValueError if username is already taken
+        """
+        if not self.is_loaded():
+            self.check_username(user['username'])
+            return
+
+        with self._lock:
+            self.check_username(user['username'])
+            self._remember(user)
+
+    def _remember(self, user: dict, previous: dict = None):
+        """Puts a user in the maps, replacing its previous version"""
+
+        if self._by_email is None:
+            return
+        if previous:
+            self._forget(previous)
+        if user.get('email'):
+            self._by_email[user['email'].lower()] = user
+        self._by_username[user['username'].lower()] = user
+
+    def _forget(self, user: dict):
+        if self._by_email is None:
+            return
+        if user.get('email') and self._by_email.get(user['email'].lower()) is user:
+            del self._by_email[user['email'].lower()]
+        if self._by_username.get(user['username'].lower()) is user:
+            del self._by_username[user['username'].lower()]
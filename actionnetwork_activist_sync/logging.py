@@ -8,6 +8,11 @@ import sys
 
 from pythonjsonlogger import jsonlogger
 
+# Extra field of a record that holds the CloudWatch Embedded Metric Format
+# metadata. The formatter drops fields starting with _, so it gets renamed
+# to _aws in the output.
+EMF_METADATA = 'aws_emf'
+
 def get_logger(name):
     """
     Get a preconfigured logger
@@ -23,7 +28,9 @@ def get_logger(name):
 
     logger.setLevel(os.environ.get('ROOT_LOG_LEVEL', logging.ERROR))
 
-    formatter = jsonlogger.JsonFormatter(fmt='%(asctime)s %(levelname)s %(name)s %(message)s')
+    formatter = jsonlogger.JsonFormatter(
+        fmt='%(asctime)s %(levelname)s %(name)s %(message)s',
+        rename_fields={EMF_METADATA: '_aws'})
 
     json_handler = logging.StreamHandler()
     json_handler.setFormatter(formatter)
@@ -0,0 +1,269 @@
+"""
+Count, errors and latency of every call to the APIs the sync depends on
+
+Calls are recorded per dependency and operation, e.g. ('actionnetwork',
+'PUT people/{id}') or ('dynamodb', 'BatchWriteItem'). Once per invocation
+the lambdas flush them to the JSON log in CloudWatch Embedded Metric
+Format, which CloudWatch turns into metrics without any API calls:
+
+https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+"""
+
+import bisect
+from contextlib import contextmanager
+import functools
+import logging
+import math
+import os
+import threading
+import time
+import weakref
+
+from actionnetwork_activist_sync.logging import EMF_METADATA
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ActionNetworkActivistSync')
+
+# Upper bounds in ms of the latency histogram buckets
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+PERCENTILES = (50, 95, 99)
+
+logger = logging.getLogger(__name__)
+# Metrics are written whatever the lambda's LOG_LEVEL is
+logger.setLevel(os.environ.get('METRICS_LOG_LEVEL', logging.INFO))
+
+class OperationStats:
+    """
+    Calls of one operation since the last flush.
+
+    Attributes:
+        count (int): Calls made, including failed ones
+        errors (int): Calls that raised or got an HTTP error status
+        latencies (list): Milliseconds each call took
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latencies = []
+
+    def add(self, milliseconds, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.latencies.append(milliseconds)
+
+    def percentile(self, percent):
+        """Nearest rank percentile of the latencies"""
+
+        ordered = sorted(self.latencies)
+        rank = max(1, math.ceil(percent / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def histogram(self):
+        """
+        Returns:
+            dict of bucket label to number of calls, e.g. {'<=100': 3, '>10000': 1}
+        """
+
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        for latency in self.latencies:
+            counts[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+        labels = [f'<={bound}' for bound in LATENCY_BUCKETS] + [f'>{LATENCY_BUCKETS[-1]}']
+        return {label: count for label, count in zip(labels, counts) if count}
+
+class Metrics:
+    """
+    Thread safe registry of OperationStats. Worker threads record into
+    the same registry, the handler flushes it when it is done.
+
+    Args:
+        namespace (str): CloudWatch namespace of the metrics
+        clock (callable): Injected for tests
+    """
+
+    def __init__(self, namespace=NAMESPACE, clock=time.perf_counter):
+        self.namespace = namespace
+        self.clock = clock
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, dependency, operation, seconds, error=False):
+        """Adds one call"""
+
+        with self._lock:
+            stats = self._stats.setdefault((dependency, operation), OperationStats())
+            stats.add(seconds * 1000, error)
+
+    @contextmanager
+    def timed(self, dependency, operation):
+        """Records the time the block takes, as an error when it raises"""
+
+        start = self.clock()
+        try:
+            yield
+        except Exception:
+            self.record(dependency, operation, self.clock() - start, error=True)
+            raise
+        self.record(dependency, operation, self.clock() - start)
+
+    def call(self, dependency, operation, func, *args, **kwargs):
+        """
+        Calls func and records it. A requests.Response with an error
+        status counts as an error.
+
+        Returns:
+            Whatever func returns
+        """
+
+        start = self.clock()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record(dependency, operation, self.clock() - start, error=True)
+            raise
+        # Not an isinstance check, importing requests would slow down the ingester's cold start
+        status_code = getattr(result, 'status_code', None)
+        self.record(
+            dependency, operation, self.clock() - start,
+            error=isinstance(status_code, int) and status_code >= 400)
+        return result
+
+    def get_stats(self, dependency, operation):
+        """
+        Returns:
+            OperationStats, None when there was no call
+        """
+
+        with self._lock:
+            return self._stats.get((dependency, operation))
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def get_documents(self, function, timestamp=None):
+        """
+        Builds one EMF document per operation and resets the registry.
+        The metadata is under logging.EMF_METADATA, which the JSON log
+        writes as _aws.
+
+        Args:
+            function (str): Value of the Function dimension
+            timestamp (int): Milliseconds since the epoch, defaults to now
+
+        Returns:
+            list of dict
+        """
+
+        with self._lock:
+            stats, self._stats = self._stats, {}
+
+        timestamp = timestamp or int(time.time() * 1000)
+        definitions = [
+            {'Name': 'Count', 'Unit': 'Count'},
+            {'Name': 'Errors', 'Unit': 'Count'},
+            {'Name': 'Time', 'Unit': 'Milliseconds'},
+        ] + [
+            {'Name': f'LatencyP{percent}', 'Unit': 'Milliseconds'} for percent in PERCENTILES
+        ]
+
+        documents = []
+        for (dependency, operation), operation_stats in sorted(stats.items()):
+            document = {
+                EMF_METADATA: {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [['Function', 'Dependency', 'Operation']],
+                        'Metrics': definitions
+                    }]
+                },
+                'Function': function,
+                'Dependency': dependency,
+                'Operation': operation,
+                'Count': operation_stats.count,
+                'Errors': operation_stats.errors,
+                # Total time spent waiting on the dependency
+                'Time': round(sum(operation_stats.latencies), 1),
+                # Not a metric, but searchable with Logs Insights
+                'LatencyHistogram': operation_stats.histogram()
+            }
+            for percent in PERCENTILES:
+                document[f'LatencyP{percent}'] = round(operation_stats.percentile(percent), 1)
+            documents.append(document)
+
+        return documents
+
+    def flush(self, function, log=None):
+        """
+        Writes the calls since the last flush to the JSON log and resets
+        the registry.
+
+        Args:
+            function (str): Value of the Function dimension
+            log (logging.Logger): Defaults to this module's logger
+
+        Returns:
+            list of the EMF documents written
+        """
+
+        documents = self.get_documents(function)
+        for document in documents:
+            # The JSON formatter puts extra fields at the top level, where
+            # CloudWatch looks for the metadata
+            (log or logger).info('metrics', extra=document)
+        return documents
+
+metrics = Metrics()
+
+# boto3 clients that already report to the registry
+_instrumented = weakref.WeakSet()
+
+def instrument_client(client, registry=None):
+    """
+    Records every API call of a boto3 or botocore client, by service and
+    operation name. Retries botocore does on its own are part of one call.
+    Instrumenting the same client again does nothing.
+
+    Returns:
+        The client
+    """
+
+    registry = registry or metrics
+    if client in _instrumented:
+        return client
+    _instrumented.add(client)
+
+    def before_call(model, context, **kwargs):
+        context['metrics_call'] = (
+            model.service_model.service_name, model.name, registry.clock())
+
+    def after_call(context, http_response=None, **kwargs):
+        if 'metrics_call' not in context:
+            return
+        dependency, operation, start = context.pop('metrics_call')
+        registry.record(
+            dependency, operation, registry.clock() - start,
+            error=http_response is None or http_response.status_code >= 300)
+
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('after-call-error', after_call)
+    return client
+
+def flush_metrics(handler):
+    """
+    Decorates a lambda handler so the metrics get flushed once per
+    invocation, also when it raises.
+    """
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        try:
+            return handler(event, context)
+        finally:
+            function = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', handler.__module__)
+            metrics.flush(function)
+
+    return wrapper
@@ -4,6 +4,9 @@ Partial implementation of http://opensupporter.github.io/osdi-docs/
 as used by ActionNetwork
 """
 
+# Marks a cached value that hasn't been parsed yet
+_UNSET = object()
+
 class Person:
     """
     People are individual users who are stored in the OSDI system’s
@@ -55,70 +58,154 @@ class Person:
             vendor.
     """
 
+    # The OSDI fields we keep, anything else in the API JSON is dropped
+    FIELDS = (
+        'given_name',
+        'family_name',
+        'identifiers',
+        'email_addresses',
+        'phone_numbers',
+        'postal_addresses',
+        '_links',
+        'custom_fields',
+        'created_date',
+        'modified_date',
+        'languages_spoken'
+    )
+
+    # Derived from the fields above on first access
+    MERGED = ('email', 'address', 'city', 'state', 'postal_code')
+
+    __slots__ = FIELDS + (
+        '_actionnetwork_id',
+        '_overrides',
+        '_email',
+        '_address'
+    )
+
     def __init__(
             self,
             given_name='',
             family_name='',
-            identifiers=[],
-            email_addresses=[],
-            phone_numbers=[],
-            postal_addresses=[],
-            _links=[],
-            custom_fields={},
+            identifiers=None,
+            email_addresses=None,
+            phone_numbers=None,
+            postal_addresses=None,
+            _links=None,
+            custom_fields=None,
             created_date='',
             modified_date='',
-            languages_spoken=[]
+            languages_spoken=None
     ):
         self.given_name = given_name
         self.family_name = family_name
-        self.identifiers = identifiers
-        self.email_addresses = email_addresses
-        self.phone_numbers = phone_numbers
-        self.postal_addresses = postal_addresses
-        self._links = _links
-        self.custom_fields = custom_fields
+        self.identifiers = identifiers if identifiers is not None else []
+        self.email_addresses = email_addresses if email_addresses is not None else []
+        self.phone_numbers = phone_numbers if phone_numbers is not None else []
+        self.postal_addresses = postal_addresses if postal_addresses is not None else []
+        self._links = _links if _links is not None else {}
+        self.custom_fields = custom_fields if custom_fields is not None else {}
         self.created_date = created_date
         self.modified_date = modified_date
-        self.languages_spoken = languages_spoken
-
-        # Gets set with merge methods
-        self.email = None
-        self.address = None
-        self.city = None
-        self.state = None
-        self.postal_code = None
+        self.languages_spoken = languages_spoken if languages_spoken is not None else []
+
+        self._actionnetwork_id = _UNSET
+        self._overrides = None
+        self._email = _UNSET
+        self._address = None
+
+    @classmethod
+    def from_json(cls, dct):
+        """Builds a Person from an API response, ignoring unknown keys"""
+
+        get = dct.get
+        return cls(
+            get('given_name', ''),
+            get('family_name', ''),
+            get('identifiers'),
+            get('email_addresses'),
+            get('phone_numbers'),
+            get('postal_addresses'),
+            get('_links'),
+            get('custom_fields'),
+            get('created_date', ''),
+            get('modified_date', ''),
+            get('languages_spoken')
+        )
 
     def get_actionnetwork_id(self):
         """Returns the ActionNetwork ID"""
 
-        for i in self.identifiers:
-            if i.startswith('action_network'):
-                return i[len('action_network:'):]
+        if self._actionnetwork_id is _UNSET:
+            self._actionnetwork_id = None
+            for i in self.identifiers:
+                if i.startswith('action_network:'):
+                    self._actionnetwork_id = i[len('action_network:'):]
+                    break
+        return self._actionnetwork_id
 
     def get_overrides(self):
         """Return any special override custom fields"""
 
-        overrides = {}
-
-        for field, value in self.custom_fields.items():
-            if field.startswith("override_"):
-                overrides[field[9:]] = value
-
-        return overrides
+        if self._overrides is None:
+            self._overrides = {
+                field[len('override_'):]: value
+                for field, value in self.custom_fields.items()
+                if field.startswith('override_')
+            }
+        return dict(self._overrides)
+
+    @property
+    def email(self):
+        """The primary email address"""
+
+        if self._email is _UNSET:
+            self._email = next(
+                (e['address'] for e in self.email_addresses if e.get('primary')), None)
+        return self._email
+
+    @property
+    def address(self):
+        return self._get_address()[0]
+
+    @property
+    def city(self):
+        return self._get_address()[1]
+
+    @property
+    def state(self):
+        return self._get_address()[2]
+
+    @property
+    def postal_code(self):
+        return self._get_address()[3]
+
+    def _get_address(self):
+        """Parses the primary postal address into (address, city, state, postal_code)"""
+
+        if self._address is None:
+            primary = next((a for a in self.postal_addresses if a.get('primary')), {})
+            lines = primary.get('address_lines')
+            self._address = (
+                [lines[0]] if lines else None,
+                primary.get('locality'),
+                primary.get('region'),
+                primary.get('postal_code')
+            )
+        return self._address
 
     def merge_primary_email(self):
-        primary = [e['address'] for e in self.email_addresses if e['primary']]
-        self.email = primary[0] if primary else None
+        """Parses the primary email, kept for callers that expect it up front"""
+        return self.email
 
     def merge_primary_address(self):
-        primary = [a for a in self.postal_addresses if a['primary']][0]
-        if 'address_lines' in primary:
-            self.address = [primary['address_lines'][0]]
-        else:
-            self.address = None
-        self.city = primary['locality'] if 'locality' in primary else None
-        self.state = primary['region'] if 'region' in primary else None
-        self.postal_code = primary['postal_code'] if 'postal_code' in primary else None
+        """Parses the primary address, kept for callers that expect it up front"""
+        return self._get_address()
+
+    def to_dict(self):
+        """Returns the fields and the merged primary email and address"""
+
+        return {name: getattr(self, name) for name in self.FIELDS + self.MERGED}
 
     @staticmethod
     def load_json(dct):
@@ -126,8 +213,8 @@ class Person:
 
         # This gets called recursively for all objects so we need
         # to filter out any objects that don't match the constructor
+        if dct and dct.keys() <= _FIELD_SET:
+            return Person.from_json(dct)
+        return dct
 
-        for k in dct.keys():
-            if k not in Person.__init__.__code__.co_varnames:
-                return dct
-        return Person(**dct)
+_FIELD_SET = frozenset(Person.FIELDS)
@@ -0,0 +1,214 @@
+"""
+Client side rate limiting for the APIs we call.
+
+Each API key gets one RateLimiter that is shared by every client and
+thread using that key. It combines:
+
+- a token bucket that caps the request rate
+- AIMD (additive increase, multiplicative decrease) on the number of
+  requests in flight
+- Retry-After support and jittered exponential backoff when the server
+  throttles us or has a temporary error
+"""
+
+from email.utils import parsedate_to_datetime
+import datetime
+import random
+import threading
+import time
+
+import requests
+
+# ActionNetwork allows about 4 requests per second per API key
+ACTIONNETWORK_RATE = 4
+KEYCLOAK_RATE = 20
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class RateLimiter:
+    """
+    Schedules calls to one API key.
+
+    Args:
+        rate (float): Requests per second
+        burst (int): Bucket size, defaults to one second worth of requests
+        max_concurrency (int): Upper bound for requests in flight
+        max_attempts (int): Tries per call before giving up
+        base_delay (float): First backoff delay in seconds
+        max_delay (float): Cap for a single backoff delay in seconds
+        sleep (callable): Injected for tests
+        clock (callable): Injected for tests
+
+    Attributes:
+        concurrency (float): Current AIMD limit for requests in flight
+        throttled (int): Number of throttled or failed responses seen
+    """
+
+    def __init__(self, rate, burst=None, max_concurrency=8, max_attempts=5,
+                 base_delay=0.5, max_delay=30, sleep=time.sleep, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.clock = clock
+
+        self.concurrency = float(max_concurrency)
+        self.throttled = 0
+
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._blocked_until = 0
+        self._in_flight = 0
+        self._lock = threading.Condition()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Runs func once there is budget for it and retries it when it gets
+        throttled, hits a server error or can't connect.
+
+        func can either return a requests.Response or raise an exception
+        with a response_code attribute (like the Keycloak errors).
+
+        Returns:
+            Whatever func returns. When the last attempt is throttled or
+            fails too, its response is returned as is and its exception
+            is raised, callers decide how to fail on a response.
+        """
+
+        for attempt in range(self.max_attempts):
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as err: # pylint: disable=broad-except
+                if not self.is_retryable_error(err):
+                    self.release(success=True)
+                    raise
+                self.release(success=False)
+                if attempt == self.max_attempts - 1:
+                    raise
+                self.backoff(attempt)
+                continue
+
+            if isinstance(result, requests.Response) and result.status_code in RETRY_STATUSES:
+                self.release(success=False)
+                if attempt == self.max_attempts - 1:
+                    return result
+                self.backoff(attempt, get_retry_after(result))
+                continue
+
+            self.release(success=True)
+            return result
+
+    def acquire(self):
+        """Blocks until a token and a concurrency slot are free"""
+
+        with self._lock:
+            while True:
+                now = self.clock()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._in_flight >= int(self.concurrency):
+                    # Woken up by release()
+                    self._lock.wait()
+                    continue
+                elif self._tokens < 1:
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return
+
+                self._lock.release()
+                try:
+                    self.sleep(wait)
+                finally:
+                    self._lock.acquire()
+
+    def release(self, success):
+        """
+        Frees a concurrency slot and adjusts the limit: +1 per window of
+        successful requests, halved on throttling.
+        """
+
+        with self._lock:
+            self._in_flight -= 1
+            if success:
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            else:
+                self.throttled += 1
+                self.concurrency = max(1.0, self.concurrency / 2)
+            self._lock.notify_all()
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Waits before the next attempt. Retry-After wins when the server
+        sends it and pauses every caller sharing this limiter.
+        """
+
+        if retry_after is not None:
+            with self._lock:
+                self._blocked_until = max(self._blocked_until, self.clock() + retry_after)
+            return
+
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        self.sleep(random.uniform(delay / 2, delay))
+
+    @staticmethod
+    def is_retryable_error(err):
+        if isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        return getattr(err, 'response_code', None) in RETRY_STATUSES
+
+def get_retry_after(response):
+    """
+    Parses the Retry-After header, which is either seconds or an HTTP date.
+
+    Returns:
+        float seconds or None
+    """
+
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        # Dates with -0000 come back naive, they are UTC as well
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(key, rate, **kwargs):
+    """
+    Gets the shared RateLimiter for an API key, creating it on first use.
+
+    Args:
+        key (str): API key or other identifier of the rate budget
+        rate (float): Requests per second, used when creating the limiter
+
+    Returns:
+        RateLimiter
+    """
+
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(rate, **kwargs)
+        return _limiters[key]
@@ -2,14 +2,124 @@
 pynamodb model
 """
 
+import datetime
 import os
-from pynamodb.models import Model
+import time
+
+from pynamodb.indexes import AllProjection, GlobalSecondaryIndex
+from pynamodb.models import BatchWrite, Model
 from pynamodb.attributes import (
-    UnicodeAttribute, NumberAttribute, JSONAttribute
+    BooleanAttribute, UnicodeAttribute, NumberAttribute, JSONAttribute, ListAttribute,
+    TTLAttribute
+)
+from pynamodb.constants import (
+    DELETE_REQUEST, ITEM, KEY, PUT, PUT_REQUEST, UNPROCESSED_ITEMS
 )
+from pynamodb.exceptions import PutError
 from pynamodb.settings import get_settings_value
 
-class State(Model):
+from actionnetwork_activist_sync.export_diff import get_row_digest
+from actionnetwork_activist_sync.metrics import instrument_client
+
+class InstrumentedModel(Model):
+    """
+    Base of the models whose DynamoDB calls get recorded in the metrics.
+    """
+
+    @classmethod
+    def _get_connection(cls):
+        connection = super()._get_connection()
+        # The botocore client is created on first use and may be replaced
+        instrument_client(connection.connection.client)
+        return connection
+
+class StateBatchWrite(BatchWrite):
+    """
+    BatchWrite that backs off exponentially when DynamoDB hands back
+    unprocessed items and counts the requests it sends.
+
+    Attributes:
+        write_requests (int): BatchWriteItem calls made, including retries
+        retries (int): BatchWriteItem calls made only to resend unprocessed items
+    """
+
+    MAX_RETRIES = 8
+    BASE_DELAY = 0.05
+    MAX_DELAY = 5
+
+    def __init__(self, model, auto_commit=True):
+        super().__init__(model, auto_commit=auto_commit)
+        self.write_requests = 0
+        self.retries = 0
+        # Index in pending_operations of the put for each key
+        self._pending_puts = {}
+
+    def save(self, put_item):
+        """
+        Queues a put. DynamoDB rejects a whole BatchWriteItem when two of
+        its puts have the same key, so a put replaces the pending one with
+        its key and the last one wins, like saving row by row.
+        """
+        keys = put_item._get_serialized_keys()
+        if keys in self._pending_puts:
+            self.pending_operations[self._pending_puts[keys]] = {'action': PUT, 'item': put_item}
+            return
+
+        super().save(put_item)
+        self._pending_puts[keys] = len(self.pending_operations) - 1
+
+    def commit(self):
+        """
+        Writes all pending operations, resending unprocessed items with
+        exponential backoff until they are accepted.
+        """
+        put_items = []
+        delete_items = []
+        for item in self.pending_operations:
+            if item['action'] == PUT:
+                put_items.append(item['item'].serialize())
+            else:
+                delete_items.append(item['item']._get_keys())
+        self.pending_operations = []
+        self._pending_puts = {}
+
+        attempt = 0
+        while put_items or delete_items:
+            if attempt:
+                if attempt > self.MAX_RETRIES:
+                    raise PutError('Failed to batch write items: retries exhausted')
+                time.sleep(min(self.MAX_DELAY, self.BASE_DELAY * 2 ** (attempt - 1)))
+                self.retries += 1
+
+            data = self.model._get_connection().batch_write_item(
+                put_items=put_items,
+                delete_items=delete_items,
+            )
+            self.write_requests += 1
+            attempt += 1
+
+            unprocessed = (data or {}).get(UNPROCESSED_ITEMS, {}).get(self.model.Meta.table_name, [])
+            put_items = [i[PUT_REQUEST][ITEM] for i in unprocessed if PUT_REQUEST in i]
+            delete_items = [i[DELETE_REQUEST][KEY] for i in unprocessed if DELETE_REQUEST in i]
+
+class StatusIndex(GlobalSecondaryIndex):
+    """
+    Index on (batch, status) so items of one status can be queried
+    without reading the rest of the batch.
+    """
+
+    class Meta:
+        """
+        Inner class that let's us set some customizations
+        """
+        # set via Terraform
+        index_name = 'batch-status-index'
+        projection = AllProjection()
+
+    batch = UnicodeAttribute(hash_key=True)
+    status = NumberAttribute(range_key=True)
+
+class State(InstrumentedModel):
     """
     This is a DynamoDB model for keeping state in the cloud.
     """
@@ -27,8 +137,90 @@ class State(Model):
     email = UnicodeAttribute(range_key=True)
     raw = JSONAttribute()
     status = NumberAttribute(default=0)
+    checksum = UnicodeAttribute(null=True)
+    # ActionNetwork IDs of the people with this email. None when they were
+    # never looked up, empty when no one was found.
+    person_ids = ListAttribute(of=UnicodeAttribute, null=True)
+    # Whether any of those people has override_ custom fields, None when unknown
+    has_overrides = BooleanAttribute(null=True)
+
+    status_index = StatusIndex()
 
     UNPROCESSED = 0
     PROCESSING = 1
     PROCESSED = 2
     FAILED = 3
+    # Same data as the previous batch, nothing to sync
+    UNCHANGED = 4
+
+    # Statuses of members who are present in a batch
+    SYNCED = (PROCESSED, UNCHANGED)
+
+    @staticmethod
+    def get_checksum(row):
+        """
+        Creates a stable hash of a CSV row. Column order, key case and
+        surrounding whitespace don't change the result.
+
+        Args:
+            row (dict): A single row from an ActionKit export
+
+        Returns:
+            str
+        """
+
+        return get_row_digest(row).hex()
+
+    @classmethod
+    def batch_write(cls, auto_commit=True):
+        """
+        Returns a StateBatchWrite context manager that writes 25 items per
+        request and retries unprocessed items with backoff.
+        """
+        return StateBatchWrite(cls, auto_commit=auto_commit)
+
+class NeighborhoodMember(InstrumentedModel):
+    """
+    Index of the ActionNetwork people that are known to be subscribed to a
+    neighborhood group. Entries expire so membership gets re-checked
+    against the API now and then.
+    """
+
+    class Meta:
+        """
+        Inner class that let's us set some customizations
+        """
+        # set via Terraform
+        table_name = 'actionnetwork_activist_sync_neighborhoods'
+
+    neighborhood = UnicodeAttribute(hash_key=True)
+    person_id = UnicodeAttribute(range_key=True)
+    expires = TTLAttribute()
+
+    MAX_AGE = datetime.timedelta(days=30)
+
+    @classmethod
+    def get_person_ids(cls, neighborhood):
+        """
+        Loads the people known to be in a neighborhood group.
+
+        Only the person_id and expires attributes are read.
+
+        Returns:
+            set of ActionNetwork person IDs
+        """
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        items = cls.query(
+            neighborhood,
+            # DynamoDB can take a while to delete expired items
+            filter_condition=cls.expires > now,
+            attributes_to_get=['person_id', 'expires']
+        )
+        return {item.person_id for item in items}
+
+    @classmethod
+    def add(cls, neighborhood, person_id):
+        """Records that a person is subscribed to a neighborhood group"""
+
+        cls(neighborhood, str(person_id), expires=cls.MAX_AGE).save()
@@ -6,7 +6,8 @@
 from actionnetwork_activist_sync.actionkit_export import ActionKitExport
 from actionnetwork_activist_sync.actionnetwork import ActionNetwork
 from actionnetwork_activist_sync.debug import PersonCompare
-from actionnetwork_activist_sync.field_mapper import FieldMapper
+from actionnetwork_activist_sync.export_diff import LAPSED, MISSING_EMAIL, UNCHANGED
+from actionnetwork_activist_sync.field_mapper import BatchFieldMapper
 
 dry_run = False
 
@@ -17,7 +18,7 @@ def sync(api_key):
     Performs three main tasks:
 
     - Deactivate people who were on the old list, but not the new list
-    - Update people who are on both lists
+    - Update people who are on both lists and changed
     - Create people who were not on the old list, but are on the new list
     """
 
@@ -27,29 +28,42 @@ def sync(api_key):
     current_file = open('newer.csv', 'r')
 
     actionkit_export = ActionKitExport(previous_file, current_file)
-    actionkit_export.load()
-    actionkit_export.filter_missing_email()
 
     no_email = 0
     lapsed = 0
     new_member = 0
     existing_member = 0
+    unchanged_member = 0
 
-    for row in actionkit_export.missing_email.rows:
-        print('Missing email: {} {}'.format(row['first_name'], row['last_name']))
-        no_email += 1
+    # Both files are read once. Rows come in as they are classified,
+    # current ones first and then the lapsed emails.
+    field_mappers = None
 
-    # People where are no longer in the current spreadsheet, but were
-    # in the previous one have had their membership lapse.
+    for diff_row in actionkit_export.diff():
+        row = diff_row.row
 
-    for row in actionkit_export.get_previous_not_in_current().rows:
-        print('Toggle membership flag: {}'.format(row['email']))
-        lapsed += 1
-        if not dry_run:
-            actionnetwork.remove_member_by_email(row['email'])
+        if diff_row.status == MISSING_EMAIL:
+            print('Missing email: {} {}'.format(row['first_name'], row['last_name']))
+            no_email += 1
+            continue
 
-    for row in actionkit_export.current.rows:
-        field_mapper = FieldMapper(row)
+        # People where are no longer in the current spreadsheet, but were
+        # in the previous one have had their membership lapse.
+        if diff_row.status == LAPSED:
+            print('Toggle membership flag: {}'.format(row['email']))
+            lapsed += 1
+            if not dry_run:
+                actionnetwork.remove_member_by_email(row['email'])
+            continue
+
+        # Already synced with the previous spreadsheet
+        if diff_row.status == UNCHANGED:
+            unchanged_member += 1
+            continue
+
+        if field_mappers is None:
+            field_mappers = BatchFieldMapper(row.keys())
+        field_mapper = field_mappers.map_row(row)
 
         people = actionnetwork.get_people_by_email(row['email'])
         if len(people) == 0:
@@ -79,5 +93,6 @@ def sync(api_key):
         'no_email': no_email,
         'lapsed': lapsed,
         'new_member': new_member,
-        'existing_member': existing_member
+        'existing_member': existing_member,
+        'unchanged_member': unchanged_member
     }
@@ -0,0 +1,111 @@
+"""
+Sizes the rounds of work of a Lambda invocation to the time it has left
+"""
+
+import threading
+import time
+
+# Seconds kept free at the end of an invocation, for the last writes and
+# handing the event back to the step function
+RESERVE = 15
+# Share of the time kept free instead when that's less, for short timeouts
+RESERVE_SHARE = 0.1
+# The margin also covers this many times the slowest item seen so far,
+# the last item of a round may take that long
+SLOWEST_ITEMS = 2
+
+class TimeBudget:
+    """
+    Decides how many items the next round of work gets, so an invocation
+    does as much as it can and still returns before its timeout.
+
+    The first round is one item per worker, to see how long items take.
+    Every later round gets as many items as fit in the time left, minus
+    a margin, at the slower of the average and the last round's wall
+    time per item. Rounds don't get larger than max_items, so the
+    estimate gets checked now and then.
+
+    Args:
+        remaining (float): Seconds left, e.g. from
+            context.get_remaining_time_in_millis() / 1000
+        workers (int): Items processed at the same time
+        max_items (int): Largest round
+        clock (callable): Injected for tests
+    """
+
+    def __init__(self, remaining, workers=1, max_items=200, clock=time.monotonic):
+        self.clock = clock
+        self.deadline = clock() + remaining
+        self.reserve = min(RESERVE, remaining * RESERVE_SHARE)
+        self.workers = workers
+        self.max_items = max_items
+
+        self.rounds = 0
+        self.items = 0
+        self.elapsed = 0.0
+        self.slowest = 0.0
+        self._last_item_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_context(cls, context, **kwargs):
+        """Budget of a Lambda invocation"""
+
+        return cls(context.get_remaining_time_in_millis() / 1000, **kwargs)
+
+    def get_remaining(self) -> float:
+        return self.deadline - self.clock()
+
+    def get_margin(self) -> float:
+        return max(self.reserve, SLOWEST_ITEMS * self.slowest)
+
+    def get_item_seconds(self) -> float:
+        """Wall time per item to plan with, None before the first round"""
+
+        if not self.items:
+            return None
+        return max(self.elapsed / self.items, self._last_item_seconds)
+
+    def next_round(self) -> int:
+        """
+        Returns:
+            int, number of items for the next round, 0 when time is up
+        """
+
+        available = self.get_remaining() - self.get_margin()
+        if available <= 0:
+            return 0
+
+        item_seconds = self.get_item_seconds()
+        if item_seconds is None:
+            return min(self.workers, self.max_items)
+        if item_seconds == 0:
+            return self.max_items
+        return min(int(available / item_seconds), self.max_items)
+
+    def add_round(self, items: int, seconds: float):
+        """Records how long a round took"""
+
+        self.rounds += 1
+        if not items:
+            return
+        self.items += items
+        self.elapsed += seconds
+        self._last_item_seconds = seconds / items
+
+    def run_item(self, func, *args, **kwargs):
+        """
+        Runs one item and remembers how long the slowest took. This is
+        safe to call from worker threads.
+
+        Returns:
+            Whatever func returns
+        """
+
+        start = self.clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = self.clock() - start
+            with self._lock:
+                self.slowest = max(self.slowest, seconds)
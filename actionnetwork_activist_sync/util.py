@@ -1,6 +1,17 @@
-import boto3
 import json
 import os
+import threading
+import time
+
+import boto3
+
+from actionnetwork_activist_sync.metrics import instrument_client
+
+# Seconds a secret fetched from Secrets Manager is reused
+SECRETS_TTL = 300
+
+_clients = {}
+_clients_lock = threading.Lock()
 
 def get_aws_session():
     if os.environ.get('ENVIRONMENT') == 'local':
@@ -10,22 +21,71 @@ def get_aws_session():
         session = boto3.session.Session()
     return session
 
-def get_secret(name):
-    secret = os.environ.get(name)
+def get_client(service):
+    """
+    Gets the shared boto3 client for a service, creating it on first use.
+    Clients are thread safe and are kept for warm invocations. Their
+    calls get recorded in the metrics.
+    """
+
+    with _clients_lock:
+        if service not in _clients:
+            _clients[service] = instrument_client(get_aws_session().client(service))
+        return _clients[service]
+
+class SecretsProvider:
+    """
+    Looks up secrets in the environment first, then in a Secrets Manager
+    secret. The whole secret JSON is fetched once and cached for ttl
+    seconds, so warm invocations don't call Secrets Manager.
+
+    The secret is the one named by AWS_SECRET_ARN, or an environment
+    variable can hold the ARN of the secret that has its value.
 
-    if not secret:
-        secret_id = os.environ.get('AWS_SECRET_ARN')
+    Args:
+        ttl (float): Seconds before a cached secret is fetched again
+        clock (callable): Injected for tests
+    """
+
+    def __init__(self, ttl=SECRETS_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        value = os.environ.get(name)
+        if value and not value.startswith('arn:aws:secretsmanager:'):
+            return value
+
+        secret_id = value or os.environ.get('AWS_SECRET_ARN')
         if not secret_id:
             raise ValueError('Secrets cannot be loaded from AWS SecretManager because AWS_SECRET_ARN is not set')
 
-        session = get_aws_session()
-        secrets_client = session.client('secretsmanager')
-        secret_value = secrets_client.get_secret_value(SecretId=secret_id)
-        secret_dict = json.loads(secret_value['SecretString'])
-
+        secret_dict = self.get_secret_dict(secret_id)
         if name not in secret_dict:
             raise ValueError('Secret not found in AWS SecretManager')
 
-        secret = secret_dict[name]
-    return secret
+        return secret_dict[name]
+
+    def get_secret_dict(self, secret_id):
+        """Fetches the secret JSON unless a fresh copy is cached"""
 
+        with self._lock:
+            cached = self._cache.get(secret_id)
+            if cached and self.clock() < cached[0]:
+                return cached[1]
+
+            secret_value = get_client('secretsmanager').get_secret_value(SecretId=secret_id)
+            secret_dict = json.loads(secret_value['SecretString'])
+            self._cache[secret_id] = (self.clock() + self.ttl, secret_dict)
+            return secret_dict
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+secrets = SecretsProvider()
+
+def get_secret(name):
+    return secrets.get(name)
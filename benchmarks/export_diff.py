@@ -0,0 +1,52 @@
+"""
+Compares the agate based ActionKitExport diff with the streaming ExportDiff.
+
+Usage:
+    python benchmarks/export_diff.py [rows]
+"""
+
+import io
+import pathlib
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from actionnetwork_activist_sync.actionkit_export import ActionKitExport # pylint: disable=wrong-import-position
+from actionnetwork_activist_sync.export_diff import LAPSED, ExportDiff # pylint: disable=wrong-import-position
+from synthetic_export import make_exports # pylint: disable=wrong-import-position
+
+def run_agate(previous, current):
+    export = ActionKitExport(io.StringIO(previous), io.StringIO(current))
+    export.load()
+    export.filter_missing_email()
+    lapsed = export.get_previous_not_in_current()
+    return len(lapsed.rows)
+
+def run_streaming(previous, current):
+    diff = ExportDiff(io.StringIO(previous), io.StringIO(current))
+    for _ in diff:
+        pass
+    return diff.counts[LAPSED]
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    previous, current = make_exports(rows)
+
+    print(f'{rows} rows per export')
+    for name, func in (('agate', run_agate), ('streaming', run_streaming)):
+        lapsed, elapsed, peak = measure(func, previous, current)
+        print(f'{name:>10}: {elapsed:6.2f}s  peak {peak / 2 ** 20:7.1f} MiB  lapsed {lapsed}')
+
+if __name__ == '__main__':
+    main()
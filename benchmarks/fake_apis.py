@@ -0,0 +1,393 @@
+"""
+In-process stand-ins for the ActionNetwork and Keycloak APIs.
+
+FakeTransport takes the place of the requests transport adapter, so every
+requests.Session, the ActionNetwork client's as well as python-keycloak's,
+talks to the fakes without opening a socket. simulator.py serves the same
+fakes over HTTP. The fakes keep just enough state to answer like the real
+APIs do for the sync: people are matched on email by the signup helper
+and belong to the groups whose API keys subscribed them, reports page
+through their items, Keycloak users get IDs and usernames must be unique.
+Every request is counted per API and method.
+"""
+
+from collections import Counter, defaultdict
+import itertools
+import json
+import math
+import threading
+from unittest.mock import patch
+from urllib.parse import parse_qs, unquote, urlsplit
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+ACTIONNETWORK_HOST = 'actionnetwork.org'
+KEYCLOAK_HOST = 'auth.bostondsa.org'
+
+NOT_FOUND = (404, {'error': 'Not found'}, {})
+
+class FakeAPI:
+    """
+    Base for the fakes. Requests are handled one at a time and answered
+    with the JSON encoded while the lock is held, so concurrent workers
+    never see half updated state.
+    """
+
+    name = None
+    key_header = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def get_key(self, headers):
+        """The credential a request was made with"""
+
+        return (headers or {}).get(self.key_header)
+
+    def handle(self, method, path, query, body, headers=None):
+        """
+        Returns:
+            tuple of (status code, encoded JSON body, headers)
+        """
+
+        with self._lock:
+            status, payload, response_headers = self.route(
+                method, path, query, body, self.get_key(headers))
+            content = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        return status, content, response_headers
+
+    def route(self, method, path, query, body, key):
+        """
+        Returns:
+            tuple of (status code, JSON payload, headers)
+        """
+
+        raise NotImplementedError
+
+class FakeActionNetwork(FakeAPI):
+    """
+    People, lists and list items of ActionNetwork v2.
+
+    Every API key is a group. People are shared between groups, but a
+    group only sees the people it subscribed.
+
+    Args:
+        base_url (str): Root of the API in the links the fake hands out
+
+    Attributes:
+        people (dict): ActionNetwork ID to OSDI person
+    """
+
+    name = 'actionnetwork'
+    key_header = 'OSDI-API-Token'
+
+    def __init__(self, base_url=f'https://{ACTIONNETWORK_HOST}/api/v2/'):
+        super().__init__()
+        self.base_url = base_url
+        self.people = {}
+        self._by_email = defaultdict(list)
+        self._members = defaultdict(set)
+        self._lists = {}
+
+    def route(self, method, path, query, body, key):
+        prefix = urlsplit(self.base_url).path
+        if not path.startswith(prefix):
+            return NOT_FOUND
+        parts = [part for part in path[len(prefix):].split('/') if part]
+
+        if not parts:
+            return (200, self.get_config(), {}) if method == 'GET' else NOT_FOUND
+
+        if parts[0] == 'people':
+            if len(parts) == 1 and method == 'GET':
+                return 200, self.search(query.get('filter', [''])[0], key), {}
+            if len(parts) == 1 and method == 'POST':
+                return 200, self.signup(body['person'], key), {}
+            if len(parts) == 2 and method in ('GET', 'PUT'):
+                person = self.people.get(parts[1])
+                if person is None or parts[1] not in self._members[key]:
+                    return 404, {'error': 'Couldn\'t find person'}, {}
+                if method == 'PUT':
+                    self.update(person, body)
+                return 200, person, {}
+
+        if parts[0] == 'lists' and method == 'GET':
+            lists = {
+                list_id: found for list_id, found in self._lists.items() if found['key'] == key
+            }
+            if len(parts) == 1:
+                return 200, self.get_page(
+                    'osdi:lists', [found['list'] for found in lists.values()], query, 'lists'), {}
+            if parts[1] not in lists:
+                return 404, {'error': 'Couldn\'t find list'}, {}
+            if len(parts) == 3 and parts[2] == 'items':
+                return 200, self.get_page(
+                    'osdi:items', lists[parts[1]]['items'], query, f'lists/{parts[1]}/items'), {}
+            return 200, lists[parts[1]]['list'], {}
+
+        return NOT_FOUND
+
+    def get_config(self):
+        links = {
+            f'osdi:{resource}': {'href': f'{self.base_url}{resource}'}
+            for resource in ('people', 'lists', 'tags', 'events')
+        }
+        return {'motd': 'Fake ActionNetwork', '_links': links}
+
+    def get_page(self, key, items, query, resource):
+        """A page of a HAL collection with a link to the next one"""
+
+        page = int(query.get('page', ['1'])[0])
+        per_page = int(query.get('per_page', ['25'])[0])
+        total_pages = max(1, math.ceil(len(items) / per_page))
+        links = {'self': {'href': f'{self.base_url}{resource}?page={page}'}}
+        if page < total_pages:
+            links['next'] = {'href': f'{self.base_url}{resource}?page={page + 1}'}
+        return {
+            'total_pages': total_pages,
+            'per_page': per_page,
+            'page': page,
+            'total_records': len(items),
+            '_links': links,
+            '_embedded': {key: items[(page - 1) * per_page:page * per_page]}
+        }
+
+    def search(self, odata_filter, key):
+        # filter=email_address eq 'someone@example.com'
+        email = unquote(odata_filter).partition(' eq ')[2].strip("'").lower()
+        people = [
+            self.people[person_id] for person_id in self._by_email.get(email, [])
+            if person_id in self._members[key]
+        ]
+        return {'_embedded': {'osdi:people': people}}
+
+    def signup(self, fields, key):
+        """The person signup helper updates the person with the email or creates one"""
+
+        email = fields['email_addresses'][0]['address'].lower()
+        if self._by_email.get(email):
+            person_id = self._by_email[email][0]
+            person = self.people[person_id]
+        else:
+            person_id = str(uuid.uuid4())
+            person = {
+                'identifiers': [f'action_network:{person_id}'],
+                'email_addresses': [{'primary': True, 'address': email, 'status': 'subscribed'}],
+                'postal_addresses': [],
+                'custom_fields': {},
+                '_links': {'self': {'href': f'{self.base_url}people/{person_id}'}}
+            }
+            self.people[person_id] = person
+            self._by_email[email].append(person_id)
+
+        self._members[key].add(person_id)
+        self.update(person, fields)
+        return person
+
+    def update(self, person, fields):
+        for field in ('given_name', 'family_name', 'postal_addresses'):
+            if fields.get(field) is not None:
+                person[field] = fields[field]
+        person['custom_fields'].update(fields.get('custom_fields') or {})
+
+    def add_list(self, key, name, person_ids, description='Report'):
+        """
+        Adds a report listing people to the group of an API key.
+
+        Returns:
+            OSDI list
+        """
+
+        with self._lock:
+            list_id = str(uuid.uuid4())
+            osdi_list = {
+                'identifiers': [f'action_network:{list_id}'],
+                'name': name,
+                'description': description,
+                '_links': {'self': {'href': f'{self.base_url}lists/{list_id}'}}
+            }
+            items = [{
+                'action_network:person_id': person_id,
+                '_links': {'osdi:person': {'href': f'{self.base_url}people/{person_id}'}}
+            } for person_id in person_ids]
+            self._lists[list_id] = {'key': key, 'list': osdi_list, 'items': items}
+            return osdi_list
+
+class FakeKeycloak(FakeAPI):
+    """
+    Token endpoint and users admin API of a Keycloak realm.
+
+    Attributes:
+        users (dict): User ID to user representation
+    """
+
+    name = 'keycloak'
+    key_header = 'Authorization'
+    token_lifetime = 300
+
+    def __init__(self):
+        super().__init__()
+        self.users = {}
+        self._ids = itertools.count(1)
+        self._by_username = {}
+        self._by_email = {}
+
+    def get_key(self, headers):
+        # Token requests aren't authorized yet, they share one budget
+        return super().get_key(headers) or 'token'
+
+    def route(self, method, path, query, body, key):
+        parts = [part for part in path.split('/') if part]
+
+        if parts[-2:] == ['openid-connect', 'token'] and method == 'POST':
+            return 200, {
+                'access_token': f"token-{(body or {}).get('client_id', ['admin'])[0]}",
+                'expires_in': self.token_lifetime,
+                'token_type': 'bearer'
+            }, {}
+
+        if parts[:1] == ['admin'] and parts[-1] == 'users':
+            if method == 'GET':
+                return 200, self.search(query), {}
+            if method == 'POST':
+                return self.create(body, path)
+
+        if parts[:1] == ['admin'] and parts[-2] == 'users' and method == 'PUT':
+            user = self.users.get(parts[-1])
+            if user is None:
+                return 404, {'errorMessage': 'User not found'}, {}
+            self.index(user, remove=True)
+            user.update(body)
+            user['username'] = user['username'].lower()
+            self.index(user)
+            return 204, None, {}
+
+        return NOT_FOUND
+
+    def search(self, query):
+        """
+        Lists users a page at a time. Unlike Keycloak, search only matches
+        whole usernames and emails, which is all the sync looks for and
+        keeps lookups fast in large realms.
+        """
+
+        users = self.users.values()
+        for field in ('username', 'email', 'search'):
+            if field in query:
+                value = query[field][0].lower()
+                matches = {self._by_username.get(value), self._by_email.get(value)}
+                users = [self.users[user_id] for user_id in matches if user_id]
+                break
+
+        first = int(query.get('first', ['0'])[0])
+        max_results = int(query.get('max', ['100'])[0])
+        return list(itertools.islice(users, first, first + max_results))
+
+    def create(self, user, path):
+        if user['username'].lower() in self._by_username:
+            return 409, {'errorMessage': 'User exists with same username'}, {}
+
+        user_id = str(next(self._ids))
+        user = {**user, 'id': user_id, 'username': user['username'].lower()}
+        self.users[user_id] = user
+        self.index(user)
+        return 201, None, {'Location': f'{path}/{user_id}'}
+
+    def index(self, user, remove=False):
+        for index, field in ((self._by_username, 'username'), (self._by_email, 'email')):
+            value = (user.get(field) or '').lower()
+            if not value:
+                continue
+            if remove:
+                index.pop(value, None)
+            else:
+                index[value] = user['id']
+
+class FakeTransport:
+    """
+    Answers requests from the fakes instead of the network.
+
+    Use it as a context manager, which routes every requests.Session in
+    the process to it.
+
+    Args:
+        backends (dict): Host name to fake API
+
+    Attributes:
+        calls (collections.Counter): Requests per (API name, method)
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._patch = None
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        url = urlsplit(request.url)
+        backend = self.backends.get(url.hostname)
+        if backend is None:
+            raise requests.exceptions.ConnectionError(f'No fake for {url.hostname}')
+
+        with self._lock:
+            self.calls[(backend.name, request.method)] += 1
+
+        status, content, headers = backend.handle(
+            request.method, url.path, parse_qs(url.query),
+            parse_body(request.body, request.headers.get('Content-Type')), request.headers)
+        return build_response(request, status, content, headers)
+
+    def count(self, name):
+        """Number of requests sent to one API"""
+
+        return sum(n for (backend, _), n in self.calls.items() if backend == name)
+
+    def __enter__(self):
+        transport = self
+
+        def send(adapter, request, **kwargs):
+            return transport.send(request, **kwargs)
+
+        self._patch = patch.object(HTTPAdapter, 'send', send)
+        self._patch.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._patch.stop()
+
+def parse_body(body, content_type):
+    """Decodes a JSON or form encoded request body"""
+
+    if not body:
+        return None
+    body = body.decode('utf-8') if isinstance(body, bytes) else body
+    if (content_type or '').startswith('application/x-www-form-urlencoded'):
+        return parse_qs(body)
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body
+
+def build_response(request, status, content, headers):
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict({'Content-Type': 'application/json', **headers})
+    response._content = content # pylint: disable=protected-access
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    return response
+
+def get_fake_apis():
+    """
+    Returns:
+        tuple of (FakeTransport, FakeActionNetwork, FakeKeycloak)
+    """
+
+    actionnetwork = FakeActionNetwork()
+    keycloak = FakeKeycloak()
+    transport = FakeTransport({ACTIONNETWORK_HOST: actionnetwork, KEYCLOAK_HOST: keycloak})
+    return transport, actionnetwork, keycloak
@@ -0,0 +1,157 @@
+"""
+Measures how long each lambda takes to import and fails when it got slower.
+
+Every sample runs in a fresh interpreter, like a Lambda cold start:
+
+- import: cumulative time of the lambda module from `python -X importtime`
+- cold init: wall time of a process that starts Python and imports the
+  lambda, which is what the init phase of a cold start pays for
+
+It also checks that modules a handler loads lazily aren't imported at init.
+
+Usage:
+    python benchmarks/import_time.py [--runs N] [--tolerance 0.3] [--update]
+
+Absolute times depend on the machine, so each lambda is measured against
+the startup of a bare interpreter (`python -c pass`) sampled in the same
+run. The medians of these ratios are compared with
+benchmarks/import_time.json, run with --update to record a new baseline.
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+BASELINE = pathlib.Path(__file__).resolve().parent / 'import_time.json'
+
+# Modules each lambda only imports when a handler needs them
+DEFERRED = {
+    'lambda_ingester': ('agate', 'keycloak', 'pyactionnetwork', 'requests', 'tenacity'),
+    'lambda_processor': ('agate', 'keycloak'),
+    'lambda_lapsed': ('agate', 'keycloak', 'tenacity'),
+    'lambda_neighborhoods': ('agate', 'keycloak', 'tenacity'),
+}
+
+def get_env():
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    return env
+
+def run_importtime(module):
+    """
+    Returns:
+        tuple of (cumulative import ms, set of imported top level packages)
+    """
+
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=get_env(), capture_output=True, text=True, check=True)
+
+    cumulative = None
+    packages = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumul, name = line.split('|')
+        name = name.strip()
+        packages.add(name.split('.')[0])
+        if name == module:
+            cumulative = int(cumul) / 1000
+
+    return cumulative, packages
+
+def run_cold_init(module=None):
+    """
+    Returns the wall time in ms of a new interpreter importing the module,
+    or only starting up without one
+    """
+
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-c', f'import {module}' if module else 'pass'],
+        cwd=ROOT, env=get_env(), check=True)
+    return (time.perf_counter() - start) * 1000
+
+def measure(module, runs):
+    """
+    Returns:
+        tuple of (dict of medians in ms, dict of medians relative to the
+        interpreter startup, set of imported top level packages)
+    """
+
+    startups = []
+    imports = []
+    cold_inits = []
+    packages = set()
+
+    # The first run may still write .pyc files, it isn't counted
+    run_cold_init(module)
+
+    # The startup is sampled between the lambda's samples, so both see
+    # the same load on the machine
+    for _ in range(runs):
+        startups.append(run_cold_init())
+        cumulative, imported = run_importtime(module)
+        imports.append(cumulative)
+        packages |= imported
+        cold_inits.append(run_cold_init(module))
+
+    startup = statistics.median(startups)
+    absolute = {
+        'startup_ms': startup,
+        'import_ms': statistics.median(imports),
+        'cold_init_ms': statistics.median(cold_inits),
+    }
+    relative = {
+        'import_ratio': round(absolute['import_ms'] / startup, 2),
+        'cold_init_ratio': round(absolute['cold_init_ms'] / startup, 2),
+    }
+    return absolute, relative, packages
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='Samples per lambda')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='Allowed slowdown against the baseline, 0.3 is 30%%')
+    parser.add_argument('--update', action='store_true', help='Write a new baseline')
+    args = parser.parse_args()
+
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    results = {}
+    failures = []
+
+    for module, deferred in DEFERRED.items():
+        absolute, results[module], packages = measure(module, args.runs)
+
+        eager = sorted(packages.intersection(deferred))
+        if eager:
+            failures.append(f'{module} imports {", ".join(eager)} at init')
+
+        print(f'{module:>22} {"startup_ms":>15}: {absolute["startup_ms"]:8.1f}')
+        for metric, value in results[module].items():
+            milliseconds = absolute[metric.replace('_ratio', '_ms')]
+            expected = baseline.get(module, {}).get(metric)
+            limit = expected * (1 + args.tolerance) if expected else None
+            status = ''
+            if limit and value > limit and not args.update:
+                status = 'REGRESSION'
+                failures.append(f'{module} {metric} {value} > {limit:.2f}')
+            print(f'{module:>22} {metric:>15}: {value:8.2f}  baseline {expected or "-":>8}  '
+                  f'({milliseconds:.1f} ms)  {status}')
+
+    if args.update:
+        BASELINE.write_text(json.dumps(results, indent=4) + '\n')
+        print(f'Wrote {BASELINE.name}')
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
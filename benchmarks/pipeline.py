@@ -0,0 +1,366 @@
+"""
+End-to-end benchmark of the weekly sync.
+
+Generates two weekly exports and runs ingester -> processor loop -> lapsed
+for each week, the way the step function does. DynamoDB and S3 are moto's
+in-process stand-ins, ActionNetwork and Keycloak are the fakes from
+fake_apis.py. The rate limiters are lifted, so the numbers show what the
+code costs and not the API budgets.
+
+With --simulate the APIs are served over HTTP by simulator.py instead,
+with its latency, rate limit and failure options, to load test how the
+sync copes with a real network. --client-limits keeps the production
+rate limiters of the clients.
+
+For every stage it reports rows/sec, API calls per row, DynamoDB read and
+write units per row and the peak RSS. Capacity units are estimated from
+the item sizes the way DynamoDB bills on-demand tables, moto doesn't
+track them. moto's own work is part of the measured time, compare runs
+with each other rather than with production.
+
+Usage:
+    python benchmarks/pipeline.py [rows] [--workers N] [--upsert] [--json FILE]
+    python benchmarks/pipeline.py [rows] --simulate --latency 0.1 --client-limits ...
+"""
+
+import argparse
+from email.message import EmailMessage
+import importlib
+import io
+import json
+import math
+import os
+import pathlib
+import resource
+import sys
+import time
+from unittest.mock import patch
+
+import botocore.client
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from fake_apis import get_fake_apis # pylint: disable=wrong-import-position
+from simulator import Simulator, add_conditions_arguments, get_conditions # pylint: disable=wrong-import-position
+from synthetic_export import write_zip # pylint: disable=wrong-import-position
+
+API_KEY = 'benchmark'
+BUCKET = 'actionnetworkactivistsync'
+# Requests per second that never throttle
+UNLIMITED = 1e6
+# The State table's partition and sort key and the keys of its index
+TABLE_KEYS = ('batch', 'email')
+INDEX_KEYS = (('batch', 'status'),)
+
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'ENVIRONMENT': 'benchmark',
+    'LOG_LEVEL': 'CRITICAL',
+    'METRICS_LOG_LEVEL': 'CRITICAL',
+    'DRY_RUN': '0',
+    'EMAIL_SUBJECT': 'SYNC',
+    'EMAIL_FROM': 'sync@example.com',
+    'ACTIONNETWORK_API_KEY': API_KEY,
+    'KEYCLOAK_CLIENT_ID': 'sync',
+    'KEYCLOAK_CLIENT_SECRET_KEY': 'benchmark',
+    'KEYCLOAK_REALM': 'members',
+}
+
+def get_value_size(value):
+    """Size of a DynamoDB attribute value in bytes, as DynamoDB counts it"""
+
+    (kind, data), = value.items()
+    if kind == 'S':
+        return len(data.encode('utf-8'))
+    if kind == 'N':
+        return len(data.lstrip('-').replace('.', '')) // 2 + 1
+    if kind == 'B':
+        return len(data)
+    if kind in ('BOOL', 'NULL'):
+        return 1
+    if kind == 'L':
+        return 3 + sum(1 + get_value_size(v) for v in data)
+    if kind == 'M':
+        return 3 + sum(len(k.encode('utf-8')) + 1 + get_value_size(v) for k, v in data.items())
+    return sum(len(str(v)) for v in data)
+
+def get_item_size(item):
+    return sum(len(name.encode('utf-8')) + get_value_size(v) for name, v in item.items())
+
+def get_units(size, unit_size):
+    return max(1, math.ceil(size / unit_size))
+
+class DynamoMeter:
+    """
+    Counts DynamoDB requests and estimates the capacity units they use.
+
+    Writes cost a unit per started KB for the table and for every index
+    the item is in. Reads cost a unit per started 4 KB of items read,
+    half of that when eventually consistent. Queries are billed for the
+    items they read before filters and projections, which is estimated
+    with the mean size of the stored items.
+
+    Attributes:
+        requests (int): DynamoDB API calls
+        read_units (float)
+        write_units (float)
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.read_units = 0.0
+        self.write_units = 0.0
+        self._sizes = {}
+        self._total_size = 0
+        self._patch = None
+
+    def __enter__(self):
+        meter = self
+        make_api_call = botocore.client.BaseClient._make_api_call # pylint: disable=protected-access
+
+        def metered(client, operation_name, api_params):
+            response = make_api_call(client, operation_name, api_params)
+            if client.meta.service_model.service_name == 'dynamodb':
+                meter.record(operation_name, api_params, response)
+            return response
+
+        self._patch = patch.object(botocore.client.BaseClient, '_make_api_call', metered)
+        self._patch.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._patch.stop()
+
+    def record(self, operation, params, response):
+        self.requests += 1
+        read_factor = 1 if params.get('ConsistentRead') else 0.5
+
+        if operation == 'PutItem':
+            self.write(params['Item'])
+        elif operation == 'BatchWriteItem':
+            for requests in params['RequestItems'].values():
+                for request in requests:
+                    if 'PutRequest' in request:
+                        self.write(request['PutRequest']['Item'])
+                    else:
+                        self.write_units += 1 + len(INDEX_KEYS)
+        elif operation in ('UpdateItem', 'DeleteItem'):
+            self.write_units += 1 + len(INDEX_KEYS)
+        elif operation == 'GetItem' and 'Item' in response:
+            self.read_units += get_units(get_item_size(response['Item']), 4096) * read_factor
+        elif operation in ('Query', 'Scan'):
+            scanned = response.get('ScannedCount', response.get('Count', 0))
+            self.read_units += get_units(scanned * self.get_mean_size(), 4096) * read_factor
+
+    def write(self, item):
+        size = get_item_size(item)
+        indexes = sum(all(key in item for key in keys) for keys in INDEX_KEYS)
+        self.write_units += get_units(size, 1024) * (1 + indexes)
+
+        key = tuple(json.dumps(item.get(name), sort_keys=True) for name in TABLE_KEYS)
+        self._total_size += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def get_mean_size(self):
+        return self._total_size / len(self._sizes) if self._sizes else 0
+
+def reset_peak_rss():
+    """Lets the peak RSS of the next stage be measured on its own (Linux only)"""
+
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+def get_peak_rss():
+    """Returns the peak resident set size in bytes"""
+
+    try:
+        with open('/proc/self/status', encoding='ascii') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class Stage:
+    """Measures one stage of the pipeline"""
+
+    def __init__(self, name, rows, apis, meter, results):
+        self.name = name
+        self.rows = rows
+        self.apis = apis
+        self.meter = meter
+        self.results = results
+
+    def __enter__(self):
+        reset_peak_rss()
+        self.calls = dict(self.apis.calls)
+        self.dynamo = (self.meter.requests, self.meter.read_units, self.meter.write_units)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        calls = {
+            name: self.apis.count(name) - sum(
+                n for (backend, _), n in self.calls.items() if backend == name)
+            for name in ('actionnetwork', 'keycloak')
+        }
+        requests, read_units, write_units = self.dynamo
+        self.results.append({
+            'stage': self.name,
+            'rows': self.rows,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(self.rows / elapsed, 1),
+            'actionnetwork_calls_per_row': round(calls['actionnetwork'] / self.rows, 3),
+            'keycloak_calls_per_row': round(calls['keycloak'] / self.rows, 3),
+            'dynamodb_requests': self.meter.requests - requests,
+            'read_units_per_row': round((self.meter.read_units - read_units) / self.rows, 3),
+            'write_units_per_row': round((self.meter.write_units - write_units) / self.rows, 3),
+            'peak_rss_mib': round(get_peak_rss() / 2 ** 20, 1),
+        })
+
+def upload_export(s3_client, key, rows, week):
+    """Mails a generated export to the bucket like SES does"""
+
+    zip_data = io.BytesIO()
+    write_zip(zip_data, rows, week=week)
+
+    email = EmailMessage()
+    email['Subject'] = ENVIRONMENT['EMAIL_SUBJECT']
+    email['From'] = ENVIRONMENT['EMAIL_FROM']
+    email['To'] = 'sync@example.com'
+    email.add_attachment(zip_data.getvalue(), maintype='application', subtype='zip')
+    s3_client.put_object(Bucket=BUCKET, Key=key, Body=email.as_bytes())
+
+def get_apis(args):
+    """
+    Returns:
+        tuple of (FakeTransport or Simulator, FakeActionNetwork, FakeKeycloak)
+    """
+
+    if not args.simulate:
+        return get_fake_apis()
+
+    actionnetwork, keycloak = get_conditions(args)
+    simulator = Simulator(actionnetwork=actionnetwork, keycloak=keycloak)
+    # Read by the clients when they are imported
+    os.environ.update(simulator.get_environment())
+    return simulator, simulator.actionnetwork, simulator.keycloak
+
+def run(args):
+    # pylint: disable=import-outside-toplevel
+    from moto import mock_aws
+    from lambda_local.context import Context
+
+    apis, actionnetwork, keycloak = get_apis(args)
+
+    lambda_ingester = importlib.import_module('lambda_ingester')
+    lambda_processor = importlib.import_module('lambda_processor')
+    lambda_lapsed = importlib.import_module('lambda_lapsed')
+    from actionnetwork_activist_sync.rate_limit import get_limiter
+    from actionnetwork_activist_sync.state_model import State
+    from actionnetwork_activist_sync.util import get_client
+
+    if not args.client_limits:
+        # Limiters are shared per key, the clients pick these up
+        get_limiter(API_KEY, UNLIMITED)
+        get_limiter('keycloak', UNLIMITED)
+
+    results = []
+
+    with mock_aws(), apis, DynamoMeter() as meter:
+        State.create_table(billing_mode='PAY_PER_REQUEST', wait=True)
+        s3_client = get_client('s3')
+        s3_client.create_bucket(Bucket=BUCKET)
+
+        for week in range(args.weeks):
+            batch = f'2021{week + 1:02}'
+            previous_batch = f'2021{week:02}'
+            key = f'export-{week}.eml'
+            upload_export(s3_client, key, args.rows, week)
+
+            with patch.object(lambda_ingester, 'get_batch', return_value=batch), \
+                    patch.object(lambda_ingester, 'get_previous_batch', return_value=previous_batch), \
+                    patch.object(lambda_lapsed, 'get_batch', return_value=batch), \
+                    patch.object(lambda_lapsed, 'get_previous_batch', return_value=previous_batch):
+
+                with Stage(f'week {week + 1} ingester', args.rows, apis, meter, results):
+                    event = lambda_ingester.lambda_handler(
+                        {'bucketName': BUCKET, 'key': key}, Context(900))
+
+                with Stage(f'week {week + 1} processor', args.rows, apis, meter, results):
+                    event['hasMore'] = True
+                    invocations = 0
+                    while event['hasMore']:
+                        # The processor sizes its work to the time left
+                        context = Context(args.processor_timeout)._activate() # pylint: disable=protected-access
+                        event = lambda_processor.lambda_handler(event, context)
+                        invocations += 1
+
+                with Stage(f'week {week + 1} lapsed', args.rows, apis, meter, results):
+                    event = lambda_lapsed.lambda_handler(event, Context(900))
+
+            print(
+                f"week {week + 1}: ingested {event['ingested_rows']} "
+                f"(unchanged {event['unchanged_rows']}), new {event['new_members']}, "
+                f"updated {event['updated_members']}, removed {event['removed']} "
+                f"in {invocations} processor invocations", file=sys.stderr)
+
+    print(
+        f'ActionNetwork has {len(actionnetwork.people)} people, '
+        f'Keycloak has {len(keycloak.users)} users', file=sys.stderr)
+    if args.simulate:
+        print(f'Responses: {dict(apis.statuses)}', file=sys.stderr)
+    return results
+
+def print_results(results):
+    columns = (
+        ('stage', 'stage', '<18'),
+        ('rows/s', 'rows_per_second', '>9'),
+        ('AN/row', 'actionnetwork_calls_per_row', '>7'),
+        ('KC/row', 'keycloak_calls_per_row', '>7'),
+        ('DDB req', 'dynamodb_requests', '>8'),
+        ('RCU/row', 'read_units_per_row', '>8'),
+        ('WCU/row', 'write_units_per_row', '>8'),
+        ('RSS MiB', 'peak_rss_mib', '>8'),
+    )
+    print('  '.join(f'{title:{fmt}}' for title, _, fmt in columns))
+    for result in results:
+        print('  '.join(f'{result[key]:{fmt}}' for _, key, fmt in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('rows', type=int, nargs='?', default=10000)
+    parser.add_argument('--weeks', type=int, default=2, help='Weekly exports to sync')
+    parser.add_argument('--workers', type=int, default=1, help='PROCESSOR_WORKERS')
+    parser.add_argument('--upsert', action='store_true', help='PROCESSOR_UPSERT=1')
+    parser.add_argument('--processor-timeout', type=float, default=600,
+                        help='Seconds each processor invocation has, like the Lambda timeout')
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--simulate', action='store_true',
+                        help='Serve the APIs over HTTP with the network conditions below')
+    parser.add_argument('--client-limits', action='store_true',
+                        help='Keep the rate limits of the clients')
+    add_conditions_arguments(parser)
+    args = parser.parse_args()
+
+    # Read by the lambdas when they are imported
+    os.environ.update(ENVIRONMENT)
+    os.environ['PROCESSOR_WORKERS'] = str(args.workers)
+    os.environ['PROCESSOR_UPSERT'] = '1' if args.upsert else '0'
+
+    results = run(args)
+    print_results(results)
+
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps(results, indent=4) + '\n', encoding='utf-8')
+
+if __name__ == '__main__':
+    main()
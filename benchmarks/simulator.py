@@ -0,0 +1,278 @@
+"""
+Local HTTP simulator of the ActionNetwork and Keycloak APIs for load tests.
+
+Serves the fakes from fake_apis.py on one port, ActionNetwork under
+/api/v2/ and Keycloak under /realms/ and /admin/, and puts network
+conditions in front of them:
+
+- latency: every response waits latency +/- jitter seconds
+- per key rate limits: a token bucket for every ActionNetwork API key or
+  Keycloak token, requests over the budget get a 429 with Retry-After
+- throttling: a share of the requests get a 429 with Retry-After anyway
+- 5xx bursts: a share of the requests start a run of 503s
+
+The injected failures come from a seeded generator, so a run with the
+same seed and request order fails the same requests.
+
+Point the sync at it with
+    ACTIONNETWORK_API_URL=http://127.0.0.1:8080/api/v2/
+    KEYCLOAK_SERVER_URL=http://127.0.0.1:8080/
+
+Usage:
+    python benchmarks/simulator.py [--port 8080] [--latency 0.1] [--rate 4] ...
+"""
+
+import argparse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+import random
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from fake_apis import FakeActionNetwork, FakeKeycloak, parse_body
+
+class Conditions:
+    """
+    Network conditions of one API.
+
+    Args:
+        latency (float): Seconds every response takes
+        jitter (float): Latency varies by up to this many seconds
+        rate (float): Requests per second per key, None for no limit
+        burst (int): Bucket size per key, defaults to one second of requests
+        throttle_rate (float): Share of requests throttled regardless of the rate
+        retry_after (int): Retry-After seconds of those random 429s
+        error_rate (float): Share of requests that start a 5xx burst
+        error_burst (int): Consecutive 503s in a burst
+        seed (int): Seed of the generator for jitter and injected failures
+        clock (callable): Injected for tests
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate=None, burst=None, throttle_rate=0.0,
+                 retry_after=1, error_rate=0.0, error_burst=3, seed=None, clock=time.monotonic):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst or (max(1, int(rate)) if rate else None)
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.error_burst = error_burst
+        self.clock = clock
+
+        self._random = random.Random(seed)
+        self._buckets = {}
+        self._errors_left = 0
+        self._lock = threading.Lock()
+
+    def get_delay(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0
+        return max(0.0, self.latency + jitter)
+
+    def check(self, key):
+        """
+        Decides if a request fails before it reaches the API.
+
+        Returns:
+            None, or a tuple of (status code, headers) to answer with
+        """
+
+        with self._lock:
+            if self._errors_left:
+                self._errors_left -= 1
+                return 503, {}
+            if self.error_rate and self._random.random() < self.error_rate:
+                self._errors_left = self.error_burst - 1
+                return 503, {}
+            if self.throttle_rate and self._random.random() < self.throttle_rate:
+                return 429, {'Retry-After': str(self.retry_after)}
+            if self.rate:
+                return self.take_token(key)
+        return None
+
+    def take_token(self, key):
+        now = self.clock()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            # Whole seconds, like the real APIs send
+            return 429, {'Retry-After': str(math.ceil((1 - tokens) / self.rate))}
+        self._buckets[key] = (tokens - 1, now)
+        return None
+
+class Simulator:
+    """
+    HTTP server in front of the fakes. Use it as a context manager, it
+    serves from a background thread.
+
+    Args:
+        host (str): Interface to listen on
+        port (int): 0 picks a free port
+        actionnetwork (Conditions): Conditions of the ActionNetwork API
+        keycloak (Conditions): Conditions of the Keycloak API
+
+    Attributes:
+        url (str): Root URL of the server
+        actionnetwork (FakeActionNetwork)
+        keycloak (FakeKeycloak)
+        calls (collections.Counter): Requests per (API name, method)
+        statuses (collections.Counter): Responses per (API name, status code)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, actionnetwork=None, keycloak=None):
+        self.server = ThreadingHTTPServer((host, port), get_handler(self))
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_port}/'
+
+        self.actionnetwork = FakeActionNetwork(base_url=f'{self.url}api/v2/')
+        self.keycloak = FakeKeycloak()
+        self.conditions = {
+            self.actionnetwork.name: actionnetwork or Conditions(),
+            self.keycloak.name: keycloak or Conditions(),
+        }
+        self.calls = Counter()
+        self.statuses = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get_environment(self):
+        """Environment variables that point the sync at the simulator"""
+
+        return {
+            'ACTIONNETWORK_API_URL': self.actionnetwork.base_url,
+            'KEYCLOAK_SERVER_URL': self.url,
+        }
+
+    def count(self, name):
+        """Number of requests sent to one API"""
+
+        return sum(n for (backend, _), n in self.calls.items() if backend == name)
+
+    def handle(self, method, target, headers, body):
+        """
+        Returns:
+            tuple of (status code, encoded body, headers)
+        """
+
+        url = urlsplit(target)
+        backend = self.actionnetwork if url.path.startswith('/api/') else self.keycloak
+        conditions = self.conditions[backend.name]
+
+        time.sleep(conditions.get_delay())
+
+        injected = conditions.check(backend.get_key(headers))
+        if injected:
+            status, response_headers = injected
+            content = b'{"error": "Simulated failure"}'
+        else:
+            status, content, response_headers = backend.handle(
+                method, url.path, parse_qs(url.query),
+                parse_body(body, headers.get('Content-Type')), headers)
+
+        with self._lock:
+            self.calls[(backend.name, method)] += 1
+            self.statuses[(backend.name, status)] += 1
+        return status, content, response_headers
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def get_handler(simulator):
+    """Builds the request handler class that answers through the simulator"""
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so connection pooling works like against the real APIs
+        protocol_version = 'HTTP/1.1'
+
+        def respond(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else None
+
+            status, content, headers = simulator.handle(self.command, self.path, self.headers, body)
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = do_PUT = do_DELETE = respond
+
+        def log_message(self, format, *args): # pylint: disable=redefined-builtin
+            pass
+
+    return Handler
+
+def add_conditions_arguments(parser):
+    """Adds the options that build Conditions to an argument parser"""
+
+    group = parser.add_argument_group('network conditions')
+    group.add_argument('--latency', type=float, default=0.0, help='Seconds per response')
+    group.add_argument('--jitter', type=float, default=0.0, help='Latency varies by +/- seconds')
+    group.add_argument('--actionnetwork-rate', type=float, default=4,
+                       help='ActionNetwork requests per second per API key, 0 for no limit')
+    group.add_argument('--keycloak-rate', type=float, default=0,
+                       help='Keycloak requests per second per token, 0 for no limit')
+    group.add_argument('--throttle-rate', type=float, default=0.0,
+                       help='Share of requests answered with a 429')
+    group.add_argument('--error-rate', type=float, default=0.0,
+                       help='Share of requests that start a burst of 503s')
+    group.add_argument('--error-burst', type=int, default=3, help='503s per burst')
+    group.add_argument('--seed', type=int, default=1)
+
+def get_conditions(args):
+    """
+    Returns:
+        tuple of (ActionNetwork Conditions, Keycloak Conditions)
+    """
+
+    def build(rate, seed):
+        return Conditions(
+            latency=args.latency, jitter=args.jitter, rate=rate or None,
+            throttle_rate=args.throttle_rate, error_rate=args.error_rate,
+            error_burst=args.error_burst, seed=seed)
+
+    return build(args.actionnetwork_rate, args.seed), build(args.keycloak_rate, args.seed + 1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    add_conditions_arguments(parser)
+    args = parser.parse_args()
+
+    actionnetwork, keycloak = get_conditions(args)
+    simulator = Simulator(args.host, args.port, actionnetwork, keycloak)
+    for name, value in simulator.get_environment().items():
+        print(f'{name}={value}')
+
+    try:
+        simulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.server.server_close()
+        print(dict(simulator.statuses), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Generates ActionKit exports of any size for benchmarks.
+
+The rows look like the real export: the columns the field mapper reads,
+family members sharing an email, rows without an email, mixed case
+emails, phone numbers in every format people type them in and zip codes
+that lost their leading zero in Excel.
+
+Two exports from the same seed describe the same membership a week
+apart. Week 1 drops the first `churn` share of the members, adds as
+many new ones at the end and changes the address or phone of about
+`changed` of the others.
+
+Usage:
+    python benchmarks/synthetic_export.py ROWS [--week N] [--seed N] [-o FILE]
+"""
+
+import argparse
+import csv
+import io
+import random
+import sys
+import zipfile
+
+COLUMNS = (
+    'ak_id', 'first_name', 'middle_name', 'last_name', 'suffix',
+    'mailing_address1', 'mailing_address2', 'mailing_city', 'mailing_state', 'mailing_zip',
+    'best_phone', 'mobile_phone', 'home_phone', 'work_phone', 'email',
+    'mailing_preference', 'do_not_call', 'p2ptext_optout', 'join_date', 'xdate',
+    'memb_status_letter', 'membership_type', 'monthly_dues_status',
+    'annual_recurring_dues_status', 'union_member', 'union_name', 'union_local',
+    'student_yes_no', 'student_school_name', 'ydsa_chapter'
+)
+
+FIRST_NAMES = (
+    'Rosa', 'Karl', 'Emma', 'Eugene', 'Lucy', 'Ella', 'Bayard', 'Fannie', 'Hubert',
+    'Dolores', 'Fred', 'Mother', 'Cesar', 'Angela', 'Joe', 'María', 'Zoë', 'Nguyen'
+)
+LAST_NAMES = (
+    'Luxemburg', 'Marx', 'Goldman', 'Debs', 'Parsons', 'Baker', 'Rustin', 'Hamer',
+    'Harrison', 'Huerta', 'Hampton', 'Jones', 'Chavez', 'Davis', 'Hill', "O'Brien",
+    'García-López', ''
+)
+STREETS = ('Tremont St', 'Congress St', 'Mass Ave', 'Blue Hill Ave', 'Centre St', 'Broadway')
+CITIES = (
+    ('Boston', '02111'), ('Cambridge', '02139'), ('Somerville', '02143'),
+    ('Dorchester', '02124'), ('Jamaica Plain', '02130'), ('Quincy', '02169')
+)
+DOMAINS = ('example.com', 'example.org', 'example.net')
+
+# Share of rows with a quirk
+DUPLICATE_EMAIL_RATE = 0.01
+BLANK_EMAIL_RATE = 0.005
+MIXED_CASE_EMAIL_RATE = 0.02
+LAPSED_RATE = 0.05
+
+def format_phone(number, rnd):
+    """Writes a 10 digit number the way someone might have typed it"""
+
+    area, prefix, line = number[:3], number[3:6], number[6:]
+    return rnd.choice((
+        number,
+        f'{area}-{prefix}-{line}',
+        f'({area}) {prefix}-{line}',
+        f'+1 {area}.{prefix}.{line}',
+        f'1{number}',
+        f'{prefix}-{line}',
+        '',
+    ))
+
+def format_zip(zip_code, rnd):
+    return rnd.choice((
+        zip_code,
+        zip_code.lstrip('0'),
+        f'{zip_code}-{rnd.randrange(10000):04}',
+        f'{zip_code}{rnd.randrange(10000):04}',
+        '',
+    ))
+
+def get_email(i):
+    return f'member{i}@{DOMAINS[i % len(DOMAINS)]}'
+
+def make_person(i, week=0, seed=1, changed=0.1):
+    """
+    Builds member number i. The same arguments always give the same row.
+
+    Args:
+        i (int): Member number, also the base of the email and ak_id
+        week (int): Rows of later weeks may have a new address or phone
+        seed (int): Varies the whole membership
+        changed (float): Chance that a row differs from the week before
+
+    Returns:
+        dict of COLUMNS
+    """
+
+    rnd = random.Random((seed << 32) + i)
+    city, zip_code = rnd.choice(CITIES)
+    first = rnd.choice(FIRST_NAMES)
+    last = rnd.choice(LAST_NAMES)
+    phone = f'617{rnd.randrange(2000000, 10000000):07}'
+    address = f'{rnd.randrange(1, 2000)} {rnd.choice(STREETS)}'
+
+    email = get_email(i)
+    quirk = rnd.random()
+    if quirk < BLANK_EMAIL_RATE:
+        email = ''
+    elif quirk < BLANK_EMAIL_RATE + DUPLICATE_EMAIL_RATE and i > 0:
+        # Someone in the same household
+        email = get_email(i - 1)
+    elif quirk < BLANK_EMAIL_RATE + DUPLICATE_EMAIL_RATE + MIXED_CASE_EMAIL_RATE:
+        email = email.capitalize()
+
+    join_year = rnd.randrange(2015, 2024)
+    monthly = rnd.random() < 0.6
+
+    person = {
+        'ak_id': str(100000 + i),
+        'first_name': first,
+        'middle_name': rnd.choice(('', '', '', 'J', 'Ann')),
+        'last_name': last,
+        'suffix': rnd.choice(('', '', '', '', 'Jr')),
+        'mailing_address1': address,
+        'mailing_address2': rnd.choice(('', '', '', 'Apt 2', '#3R')),
+        'mailing_city': city,
+        'mailing_state': 'MA',
+        'mailing_zip': format_zip(zip_code, rnd),
+        'best_phone': '',
+        'mobile_phone': format_phone(phone, rnd),
+        'home_phone': rnd.choice(('', '', format_phone(phone[::-1], rnd))),
+        'work_phone': '',
+        'email': email,
+        'mailing_preference': rnd.choice(('Yes', 'No', '')),
+        'do_not_call': rnd.choice(('FALSE', 'FALSE', 'TRUE', '')),
+        'p2ptext_optout': rnd.choice(('FALSE', 'TRUE', '')),
+        'join_date': f'{rnd.randrange(1, 13)}/{rnd.randrange(1, 29)}/{join_year}',
+        'xdate': f'{rnd.randrange(1, 13)}/{rnd.randrange(1, 29)}/{join_year + rnd.randrange(1, 5)}',
+        'memb_status_letter': 'L' if rnd.random() < LAPSED_RATE else 'M',
+        'membership_type': 'monthly' if monthly else 'annual',
+        'monthly_dues_status': 'active' if monthly else '',
+        'annual_recurring_dues_status': '' if monthly else rnd.choice(('active', 'never')),
+        'union_member': rnd.choice(('Yes, current union member', 'No', '')),
+        'union_name': rnd.choice(('', '', 'SEIU', 'MTA', 'IBEW')),
+        'union_local': rnd.choice(('', '', '509', '103')),
+        'student_yes_no': rnd.choice(('Yes', 'No', '')),
+        'student_school_name': rnd.choice(('', '', 'UMass Boston', 'Northeastern')),
+        'ydsa_chapter': ''
+    }
+
+    # Changes use their own generator so the rest of the row stays the same
+    for later in range(1, week + 1):
+        change = random.Random((((seed << 32) + i) << 8) + later)
+        if change.random() < changed:
+            if change.random() < 0.5:
+                person['mailing_address1'] = f'{change.randrange(1, 2000)} {change.choice(STREETS)}'
+            else:
+                person['mobile_phone'] = format_phone(
+                    f'617{change.randrange(2000000, 10000000):07}', change)
+
+    return person
+
+def iter_rows(rows, week=0, seed=1, churn=0.05, changed=0.1):
+    """
+    Yields the rows of one weekly export, one at a time.
+
+    Args:
+        rows (int): Rows in the export
+        week (int): 0 for the first export, 1 for the one a week later
+        churn (float): Share of the members replaced every week
+    """
+
+    start = int(rows * churn) * week
+    for i in range(start, start + rows):
+        yield make_person(i, week, seed, changed)
+
+def write_csv(csv_file, rows, **kwargs):
+    """Writes an export to a text file object"""
+
+    writer = csv.DictWriter(csv_file, COLUMNS)
+    writer.writeheader()
+    writer.writerows(iter_rows(rows, **kwargs))
+
+def make_csv(rows, **kwargs):
+    """Returns an export as a string"""
+
+    handle = io.StringIO()
+    write_csv(handle, rows, **kwargs)
+    return handle.getvalue()
+
+def make_exports(rows, churn=0.05, changed=0.1, seed=1):
+    """Builds a previous and a current export as CSV strings"""
+
+    return (
+        make_csv(rows, week=0, seed=seed, churn=churn, changed=changed),
+        make_csv(rows, week=1, seed=seed, churn=churn, changed=changed)
+    )
+
+def write_zip(zip_file, rows, name='actionkit_export.csv', **kwargs):
+    """Writes an export into a ZIP archive the way ActionKit mails it"""
+
+    with zipfile.ZipFile(zip_file, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(name, 'w') as member:
+            with io.TextIOWrapper(member, encoding='utf-8', newline='') as csv_file:
+                write_csv(csv_file, rows, **kwargs)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('rows', type=int)
+    parser.add_argument('--week', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--churn', type=float, default=0.05)
+    parser.add_argument('--changed', type=float, default=0.1)
+    parser.add_argument('-o', '--output', help='CSV or ZIP file, stdout when not set')
+    args = parser.parse_args()
+
+    kwargs = {'week': args.week, 'seed': args.seed, 'churn': args.churn, 'changed': args.changed}
+    if args.output and args.output.endswith('.zip'):
+        write_zip(args.output, args.rows, **kwargs)
+    elif args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as csv_file:
+            write_csv(csv_file, args.rows, **kwargs)
+    else:
+        write_csv(sys.stdout, args.rows, **kwargs)
+
+if __name__ == '__main__':
+    main()
@@ -7,19 +7,23 @@ is of the format that gets exported from ActionKit.
 
 import csv
 import datetime
-import email
-import email.policy
 import io
 import json
 import os
-import uuid
+import tempfile
 from urllib.parse import unquote_plus
 import zipfile
 
+from actionnetwork_activist_sync.email_stream import StreamingEmail
 from actionnetwork_activist_sync.logging import get_logger
+from actionnetwork_activist_sync.metrics import flush_metrics
 from actionnetwork_activist_sync.state_model import State
-from actionnetwork_activist_sync.util import get_secret, get_aws_session
+from actionnetwork_activist_sync.util import get_client, get_secret
 
+# Compressed attachments larger than this get spooled to disk
+ZIP_SPOOL_SIZE = 8 * 1024 * 1024
+
+@flush_metrics
 def lambda_handler(event, context):
     """
     This handler is meant to be attached to an S3 bucket and triggered
@@ -30,8 +34,7 @@ def lambda_handler(event, context):
 
     logger = get_logger('lambda_ingester')
 
-    session = get_aws_session()
-    s3_client = session.client('s3')
+    s3_client = get_client('s3')
 
     EMAIL_SUBJECT = get_secret('EMAIL_SUBJECT')
     EMAIL_FROM = get_secret('EMAIL_FROM').split(',')
@@ -39,84 +42,148 @@ def lambda_handler(event, context):
     batch = get_batch()
 
     count = 0
+    unchanged = 0
 
-    # Fetch email from bucket
+    # Fetch email from bucket. The body is read as a stream so the email,
+    # attachment and CSV never have to fit in memory all at once.
     bucket = event['bucketName']
     key = unquote_plus(event['key'])
-    tmpkey = key.replace('/', '')
-    download_path = f'/tmp/{uuid.uuid4()}{tmpkey}'
     logger.info(
-        'Downloading file from bucket',
-        extra={"bucket": bucket, "key": key, "download_path": download_path})
-    s3_client.download_file(bucket, key, download_path)
-
-    with open(download_path) as email_file:
-        # The full email gets deposited in the S3 bucket
-        msg = email.message_from_file(email_file, policy=email.policy.default)
-
-        if msg.get('Subject') != EMAIL_SUBJECT:
-            logger.error(
-                'Email subject does not match expected',
-                extra={'subject': msg.get('Subject')}
-            )
-            raise ValueError('Email subject does not match expected')
-        if msg.get('From') not in EMAIL_FROM:
-            logger.error(
-                'Email sender does not match expected',
-                extra={'from': msg.get('From'), 'expected': EMAIL_FROM}
-            )
-            raise ValueError('Email sender does not match expected')
-
-        # ActionKit mails the report as an attached ZIP file
-        attach = next(msg.iter_attachments())
-
-        if not attach.get_content_type() in ['application/zip', 'application/x-zip-compressed']:
-            logger.error(
-                'Attachment is not ZIP',
-                extra={'content_type': attach.get_content_type()})
-            raise ValueError('Attachment is not ZIP')
-
-        zip_data = io.BytesIO(attach.get_content())
-
-        with zipfile.ZipFile(zip_data) as zip:
-            names = zip.namelist()
-            if len(names) != 1:
-                raise ValueError('ZIP archive has wrong number of files')
-
-            if not names[0].endswith('.csv'):
-                raise ValueError('ZIP archive is missing CSV file')
-
-            csv_lines = io.StringIO(zip.read(names[0]).decode('utf-8'))
-
-
-        for row in csv.DictReader(csv_lines):
+        'Streaming file from bucket',
+        extra={"bucket": bucket, "key": key})
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+
+    # The full email gets deposited in the S3 bucket
+    msg = StreamingEmail(body)
+
+    if msg.get('Subject') != EMAIL_SUBJECT:
+        logger.error(
+            'Email subject does not match expected',
+            extra={'subject': msg.get('Subject')}
+        )
+        raise ValueError('Email subject does not match expected')
+    if msg.get('From') not in EMAIL_FROM:
+        logger.error(
+            'Email sender does not match expected',
+            extra={'from': msg.get('From'), 'expected': EMAIL_FROM}
+        )
+        raise ValueError('Email sender does not match expected')
+
+    # ActionKit mails the report as an attached ZIP file
+    attach = msg.get_attachment()
+
+    if not attach.get_content_type() in ['application/zip', 'application/x-zip-compressed']:
+        logger.error(
+            'Attachment is not ZIP',
+            extra={'content_type': attach.get_content_type()})
+        raise ValueError('Attachment is not ZIP')
+
+    previous = {} if 'skip_db' in event else get_previous_items()
+
+    # Items are written 25 at a time, unprocessed items get retried with backoff
+    with State.batch_write() as writer:
+        for row in iter_zipped_csv(attach):
             d_row = dict(row)
 
             if 'email' not in d_row or not d_row['email']:
                 # We can't continue processing without an email
                 continue
 
+            checksum = State.get_checksum(d_row)
+            prev_item = previous.get(d_row['email'])
+            if prev_item and prev_item.checksum == checksum:
+                # Already synced last week, the processor can skip it
+                status = State.UNCHANGED
+                unchanged += 1
+            else:
+                status = State.UNPROCESSED
+
             if not 'skip_db' in event:
-                state = State(
+                writer.save(State(
                     batch,
                     d_row['email'],
                     raw=json.dumps(d_row),
-                    status=State.UNPROCESSED
-                )
-                state.save()
+                    status=status,
+                    checksum=checksum,
+                    # Lets the processor update by ID instead of searching
+                    person_ids=prev_item.person_ids if prev_item else None,
+                    has_overrides=prev_item.has_overrides if prev_item else None
+                ))
 
             count += 1
 
-        logger.info('Finished processing CSV.', extra={'num_rows': count})
+    logger.info(
+        'Finished processing CSV.',
+        extra={
+            'num_rows': count,
+            'unchanged_rows': unchanged,
+            'write_requests': writer.write_requests,
+            'write_retries': writer.retries
+        })
 
     result = {
         'batch': batch,
-        'ingested_rows': count
+        'ingested_rows': count,
+        'unchanged_rows': unchanged,
+        'write_requests': writer.write_requests,
+        'write_retries': writer.retries
     }
     # forward the input
     event.update(result)
 
     return event
 
+def iter_zipped_csv(attach):
+    """
+    Streams the rows of the CSV file inside a zipped attachment.
+
+    The ZIP central directory sits at the end of the archive, so the
+    compressed bytes are spooled (to disk once they pass ZIP_SPOOL_SIZE).
+    The CSV itself is decompressed and parsed one line at a time.
+
+    Args:
+        attach (StreamingAttachment): The ZIP attachment
+
+    Yields:
+        dict for each CSV row
+    """
+
+    with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE) as zip_data:
+        for chunk in attach.iter_content():
+            zip_data.write(chunk)
+
+        with zipfile.ZipFile(zip_data) as zip:
+            names = zip.namelist()
+            if len(names) != 1:
+                raise ValueError('ZIP archive has wrong number of files')
+
+            if not names[0].endswith('.csv'):
+                raise ValueError('ZIP archive is missing CSV file')
+
+            with zip.open(names[0]) as csv_file:
+                csv_lines = io.TextIOWrapper(csv_file, encoding='utf-8', newline='')
+                yield from csv.DictReader(csv_lines)
+
+def get_previous_items():
+    """
+    Loads the members that were synced in last week's batch.
+
+    Only the email, checksum, person_ids and has_overrides attributes are read.
+
+    Returns:
+        dict of email to State
+    """
+
+    items = State.query(
+        hash_key=get_previous_batch(),
+        filter_condition=State.status.is_in(*State.SYNCED),
+        attributes_to_get=['email', 'checksum', 'person_ids', 'has_overrides']
+    )
+    return {item.email: item for item in items}
+
 def get_batch():
-    return datetime.date.today().strftime('%Y%U')
\ No newline at end of file
+    return datetime.date.today().strftime('%Y%U')
+
+def get_previous_batch():
+    last_week = datetime.date.today() - datetime.timedelta(weeks=1)
+    return last_week.strftime('%Y%U')
\ No newline at end of file
@@ -2,101 +2,85 @@
 This lambda handles off-boarding when members quit the organization
 """
 
+from collections import namedtuple
 import datetime
-import json
 import os
 
-import boto3
-
-from actionnetwork_activist_sync.actionnetwork import ActionNetwork
+from actionnetwork_activist_sync.actionnetwork import PersonNotFoundError, get_actionnetwork_client
 from actionnetwork_activist_sync.logging import get_logger
+from actionnetwork_activist_sync.metrics import flush_metrics
 from actionnetwork_activist_sync.state_model import State
+from actionnetwork_activist_sync.util import get_client, get_secret
 
 logger = get_logger('lambda_lapsed')
 
-dry_run = os.environ.get('DRY_RUN') != '0'
-
-if os.environ.get('ENVIRONMENT') == 'local':
-    import localstack_client.session
-    session = localstack_client.session.Session()
-else:
-    session = boto3.session.Session()
-
-dynamodb_client = session.client('dynamodb')
-secrets_client = session.client('secretsmanager')
-sns_client = session.client('sns')
-
-api_key = os.environ['ACTIONNETWORK_API_KEY']
-if api_key.startswith('arn'):
-    secret = secrets_client.get_secret_value(SecretId=api_key)
-    secret_dict = json.loads(secret['SecretString'])
-    api_key = secret_dict['ACTIONNETWORK_API_KEY']
-    logger.debug('Using API key from Secrets Manager')
-else:
-    logger.debug('Using API key from Env')
-
-cur_batch = datetime.date.today().strftime('%Y%U')
-last_week = datetime.date.today() - datetime.timedelta(weeks=1)
-prev_batch = last_week.strftime('%Y%U')
-
+@flush_metrics
 def lambda_handler(event, context):
     """
     This lambda is triggered via Step Function
     """
     removed = 0
-    cur_count = State.count(hash_key=cur_batch)
-    prev_count = State.count(hash_key=prev_batch)
 
-    cur_items = State.query(hash_key=cur_batch, filter_condition=State.status == State.PROCESSED)
+    dry_run = os.environ.get('DRY_RUN') != '0'
+
+    api_key = get_secret('ACTIONNETWORK_API_KEY')
+
+    cur_batch = get_batch()
+    prev_batch = get_previous_batch()
+
+    cur_emails, cur_count = get_batch_emails(cur_batch)
     logger.info(
         'Loaded current items.',
         extra={'cur_batch': cur_batch, 'num_items': cur_count})
 
-    prev_items = State.query(hash_key=prev_batch, filter_condition=State.status == State.PROCESSED)
+    prev_person_ids, prev_count = get_batch_person_ids(prev_batch)
+    prev_emails = set(prev_person_ids)
     logger.info(
         'Loaded previous items.',
         extra={'prev_batch': prev_batch, 'num_items': prev_count})
 
-    cur_emails = [c.email for c in cur_items]
-    prev_emails = [p.email for p in prev_items]
-
     err_msg = None
 
-    if cur_count == 0 or len(cur_emails) == 0:
+    if len(cur_emails) == 0:
         err_msg = 'No current batch, something is probably wrong.'
         logger.error(err_msg)
 
-    if prev_count == 0 or len(prev_emails) == 0:
+    if len(prev_emails) == 0:
         err_msg = 'No previous batch. If this is not the first week, then something is probably wrong.'
         logger.error(err_msg)
 
+    diff = diff_emails(cur_emails, prev_emails)
+
     logger.info(
-        'Checking previous email list against current.',
+        'Checked previous email list against current.',
         extra={
             'cur_email_count': len(cur_emails),
-            'prev_email_count': len(prev_emails)
+            'prev_email_count': len(prev_emails),
+            'lapsed_count': len(diff.lapsed),
+            'new_count': len(diff.new),
+            'retained_count': len(diff.retained)
         }
     )
 
     action_network = get_actionnetwork(api_key)
 
     if prev_emails and cur_emails:
-        for prev_email in prev_emails:
-            if prev_email not in cur_emails:
-                logger.info(
-                    'Turing is_member off for lapsed member.',
-                    extra={'email': prev_email}
-                )
-                if not dry_run:
-                    try:
-                        action_network.remove_member_by_email(prev_email)
-                    except:
-                        logger.error(
-                            'Error removing lapsed member',
-                            extra={'email': prev_email}
-                        )
-                        continue
-                removed += 1
+        for prev_email in sorted(diff.lapsed):
+            logger.info(
+                'Turing is_member off for lapsed member.',
+                extra={'email': prev_email}
+            )
+            if not dry_run:
+                try:
+                    remove_lapsed_member(
+                        action_network, prev_email, prev_person_ids[prev_email])
+                except:
+                    logger.error(
+                        'Error removing lapsed member',
+                        extra={'email': prev_email}
+                    )
+                    continue
+            removed += 1
 
     result = {
             'removed': removed,
@@ -124,16 +108,100 @@ def lambda_handler(event, context):
         )
 
     if os.environ.get('SLACK_ENABLED') == '1' and topic and chan:
-        sns_client.publish(
+        get_client('sns').publish(
             TopicArn=topic,
             Message=message
         )
 
     return event
 
+def get_batch():
+    return datetime.date.today().strftime('%Y%U')
+
+def get_previous_batch():
+    last_week = datetime.date.today() - datetime.timedelta(weeks=1)
+    return last_week.strftime('%Y%U')
+
+BatchDiff = namedtuple('BatchDiff', ['lapsed', 'new', 'retained'])
+
+def get_batch_emails(batch):
+    """
+    Loads the emails of members that were synced in a batch.
+
+    Only the email attribute is read from DynamoDB.
+
+    Returns:
+        tuple of (set of emails, number of items in the batch)
+    """
+
+    items, count = query_synced(batch, ['email'])
+    return {item.email for item in items}, count
+
+def get_batch_person_ids(batch):
+    """
+    Loads the emails and ActionNetwork IDs of members that were synced in a batch.
+
+    Returns:
+        tuple of (dict of email to list of person IDs or None when never
+        looked up, number of items in the batch)
+    """
+
+    items, count = query_synced(batch, ['email', 'person_ids'])
+    return {item.email: item.person_ids for item in items}, count
+
+def query_synced(batch, attributes):
+    """
+    Queries the synced items of a batch for some of their attributes.
+
+    Returns:
+        tuple of (list of State, number of items in the batch whatever
+        their status)
+    """
+
+    results = State.query(
+        hash_key=batch,
+        filter_condition=State.status.is_in(*State.SYNCED),
+        attributes_to_get=attributes
+    )
+    items = list(results)
+    # The filter is applied to the items read, so every item of the batch
+    # is in the scanned count and no separate count query is needed
+    return items, results.page_iter.total_scanned_count
+
+def remove_lapsed_member(action_network, email, person_ids):
+    """
+    Turns is_member off using the stored IDs. Only searches by email
+    when the IDs are unknown or no longer exist.
+    """
+
+    if person_ids:
+        try:
+            for person_id in person_ids:
+                action_network.remove_member_by_id(person_id, email)
+            return
+        except PersonNotFoundError:
+            logger.info('Stored person ID not found, searching by email', extra={'email': email})
+
+    action_network.remove_member_by_email(email)
+
+def diff_emails(cur_emails, prev_emails):
+    """
+    Compares two sets of emails in linear time.
+
+    Returns:
+        BatchDiff of lapsed (only in previous), new (only in current)
+        and retained (in both) email sets
+    """
+
+    return BatchDiff(
+        lapsed=prev_emails - cur_emails,
+        new=cur_emails - prev_emails,
+        retained=cur_emails & prev_emails
+    )
+
 def get_actionnetwork(api_k):
-    """Creates an ActionNetwork object.
+    """Gets the shared ActionNetwork object for an API key.
 
     This function is a helper for mocking in tests"""
 
-    return ActionNetwork(api_k)
+    return get_actionnetwork_client(api_k)
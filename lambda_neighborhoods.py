@@ -2,13 +2,22 @@
 This lambda syncs members from the main ActionNetwork groups to the Neighborhood groups
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 
-from actionnetwork_activist_sync.actionnetwork import ActionNetwork
+import requests
+
+from actionnetwork_activist_sync.actionnetwork import get_actionnetwork_client
 from actionnetwork_activist_sync.logging import get_logger
+from actionnetwork_activist_sync.metrics import flush_metrics
+from actionnetwork_activist_sync.state_model import NeighborhoodMember
 from actionnetwork_activist_sync.util import get_secret
 
+# Number of neighborhoods synced at the same time
+WORKERS = int(os.environ.get('NEIGHBORHOOD_WORKERS', '1'))
+
+@flush_metrics
 def lambda_handler(event, context):
     """
     This lambda is triggered via Step Function
@@ -34,73 +43,132 @@ def lambda_handler(event, context):
     total_existing = 0
     total_new = 0
 
-    for report in reports:
-        logger.info(
-            'Starting report',
+    # Each neighborhood has its own API key and rate budget, so they can
+    # all sync at the same time
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        futures = [
+            executor.submit(sync_neighborhood, report, action_network, hood_map, dry_run, logger)
+            for report in reports
+        ]
+        for future in futures:
+            existing, new = future.result()
+            total_existing += existing
+            total_new += new
+
+    logger.info(
+        'Completed neighbor sync.',
+        extra={
+            'total_existing': total_existing,
+            'total_new': total_new
+        })
+
+    return (total_existing, total_new)
+
+def sync_neighborhood(report, action_network, hood_map, dry_run, logger):
+    """
+    Subscribes the people in a neighborhood report to the neighborhood group.
+
+    This is safe to run in a worker thread.
+
+    Returns:
+        tuple of (existing, new) people counts
+    """
+
+    logger.info(
+        'Starting report',
+        extra={
+            'report_name': report['name']
+    })
+
+    if not report['name'] in hood_map:
+        logger.warning(
+            'Missing API key for neighborhood.',
             extra={
                 'report_name': report['name']
         })
+        return (0, 0)
 
-        if not report['name'] in hood_map:
-            logger.warning(
-                'Missing API key for neighborhood.',
-                extra={
-                    'report_name': report['name']
-            })
-            continue
+    hood_api = hood_map[report['name']]
+    hood_an = get_actionnetwork(hood_api)
+
+    # People we already know are subscribed don't need an API call
+    known = NeighborhoodMember.get_person_ids(report['name'])
 
-        hood_api = hood_map[report['name']]
-        hood_an = get_actionnetwork(hood_api)
+    # Pages are streamed, the next one loads while this one is worked on
+    people = action_network.iter_people_from_report(report)
 
-        people = action_network.get_all_people_from_report(report)
+    existing = 0
+    new = 0
 
-        existing = 0
-        new = 0
+    for person in people:
+        person_id = str(person['action_network:person_id'])
+        if person_id in known:
+            existing += 1
+            continue
 
-        for person in people:
-            hood_an_person = hood_an.get_person(person_id=person['action_network:person_id'])
-            if not 'error' in hood_an_person:
-                logger.debug(
-                    'Skipping person already subscribed.',
+        hood_an_person = hood_an.get_person(person_id=person['action_network:person_id'])
+        if not 'error' in hood_an_person:
+            logger.debug(
+                'Skipping person already subscribed.',
+                extra={
+                    'emails': [email['address'] for email in hood_an_person['email_addresses']]
+                })
+            NeighborhoodMember.add(report['name'], person_id)
+            existing += 1
+        else:
+            action_network_person = action_network.get_person(person_id=person['action_network:person_id'])
+            if not dry_run:
+                if not subscribe(hood_an, action_network_person, report['name'], logger):
+                    # Not cached, so it gets tried again next run
+                    continue
+                NeighborhoodMember.add(report['name'], person_id)
+            new += 1
+            logger.info(
+                'New person subscribed to neighborhood.',
                     extra={
-                        'emails': [email['address'] for email in hood_an_person['email_addresses']]
+                        'emails': [email['address'] for email in action_network_person['email_addresses']],
+                        'report': report['name']
                     })
-                existing += 1
-            else:
-                action_network_person = action_network.get_person(person_id=person['action_network:person_id'])
-                if not dry_run:
-                    hood_an.subscribe_person(action_network_person)
-                new += 1
-                logger.info(
-                    'New person subscribed to neighborhood.',
-                        extra={
-                            'emails': [email['address'] for email in action_network_person['email_addresses']],
-                            'report': report['name']
-                        })
-
-
-        logger.info(
-        'Completed neighborhood.',
-        extra={
-            'existing': existing,
-            'new': new
-        })
-
-        total_existing += existing
-        total_new += new
 
     logger.info(
-        'Completed neighbor sync.',
-        extra={
-            'total_existing': total_existing,
-            'total_new': total_new
-        })
+    'Completed neighborhood.',
+    extra={
+        'report_name': report['name'],
+        'existing': existing,
+        'new': new,
+        'known': len(known)
+    })
 
-    return (total_existing, total_new)
+    return (existing, new)
+
+def subscribe(hood_an, person, report_name, logger):
+    """
+    Subscribes a person to a neighborhood group.
+
+    Returns:
+        bool, False when ActionNetwork didn't accept the subscription
+    """
+
+    emails = [email['address'] for email in person['email_addresses']]
+    try:
+        response = hood_an.subscribe_person(person)
+    except requests.HTTPError as error:
+        logger.error(
+            'Failed to subscribe person to neighborhood.',
+            extra={'emails': emails, 'report': report_name, 'error': str(error)})
+        return False
+
+    if not 200 <= response.status_code < 300:
+        logger.error(
+            'Failed to subscribe person to neighborhood.',
+            extra={'emails': emails, 'report': report_name, 'status_code': response.status_code})
+        return False
+
+    return True
 
 def get_actionnetwork(api_k):
-    """Creates an ActionNetwork object.
+    """Gets the shared ActionNetwork object for an API key.
 
     This function is a helper for mocking in tests"""
 
-    return ActionNetwork(api_k)
+    return get_actionnetwork_client(api_k)
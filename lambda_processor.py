@@ -5,23 +5,33 @@ a single rows of an ActionKit export CSV. These rows get synced
 into ActionNetwork via API.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 import json
 import os
 
-from agate.rows import Row
-from keycloak import KeycloakAdmin
-from tenacity import Retrying, stop_after_attempt, wait_fixed
+from pynamodb.exceptions import PutError
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt
 
-from actionnetwork_activist_sync.actionnetwork import ActionNetwork
-from actionnetwork_activist_sync.field_mapper import FieldMapper
-from actionnetwork_activist_sync.keycloak import KeycloakService
+from actionnetwork_activist_sync.actionnetwork import PersonNotFoundError, get_actionnetwork_client
+from actionnetwork_activist_sync.field_mapper import BatchFieldMapper
 from actionnetwork_activist_sync.logging import get_logger
+from actionnetwork_activist_sync.metrics import flush_metrics
+from actionnetwork_activist_sync.osdi import Person
 from actionnetwork_activist_sync.state_model import State
+from actionnetwork_activist_sync.time_budget import TimeBudget
 from actionnetwork_activist_sync.util import get_secret
 
+# Most items per round. Rounds are sized to the time the invocation has left.
 BATCH_SIZE = 200
-RETRY_DELAY = 5
+# Number of items processed at the same time
+WORKERS = int(os.environ.get('PROCESSOR_WORKERS', '1'))
 
+# Created on first use and kept for warm invocations, so the step
+# function loop doesn't log in again for every batch
+_keycloak = None
+
+@flush_metrics
 def lambda_handler(event, context):
     """
     This handler gets triggered by the step function after the ingester has converted
@@ -31,35 +41,181 @@ def lambda_handler(event, context):
     logger = get_logger('lambda_processor')
 
     dry_run = os.environ.get('DRY_RUN') != '0'
+    upsert = os.environ.get('PROCESSOR_UPSERT') == '1'
 
     api_key = get_secret('ACTIONNETWORK_API_KEY')
 
     actionnetwork = get_actionnetwork(api_key)
     keycloak = get_keycloak()
 
+    if not event.get('cursor'):
+        # A new run, users may have changed since the last one
+        keycloak.clear_users()
+
     logger.info(
         'Starting to process DynamoDB items', extra={
-            'dry_run': dry_run
+            'dry_run': dry_run,
+            'upsert': upsert
         })
 
     new = event['new_members'] if 'new_members' in event else 0
     updated = event['updated_members'] if 'updated_members' in event else 0
 
-    unprocessed = State.query(
-        hash_key=event['batch'],
-        filter_condition=State.status == State.UNPROCESSED,
-        limit=BATCH_SIZE
-    )
+    # Items are processed in rounds for as long as the invocation has time,
+    # then the step function invokes it again with the cursor
+    budget = TimeBudget.from_context(context, workers=WORKERS, max_items=BATCH_SIZE)
+    cursor = event.get('cursor')
+    has_more = True
+
+    # Items are independent of each other, so several can wait on the
+    # network at once. Counters are only summed here in the main thread.
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        while True:
+            size = budget.next_round()
+            if not size:
+                break
+            start = budget.clock()
+
+            # The status index only reads pending items, not the already processed
+            # part of the batch. The cursor picks up where the last round stopped.
+            # One extra item per page tells us if there is more without another query.
+            query = State.status_index.query(
+                event['batch'],
+                State.status == State.UNPROCESSED,
+                page_size=size + 1,
+                last_evaluated_key=cursor
+            )
+            unprocessed = list(itertools.islice(query, size))
+
+            # The rows of a batch share the export header, so they are mapped
+            # together with the column lookups resolved once
+            mapped = BatchFieldMapper.map_all(json.loads(item.raw) for item in unprocessed)
+
+            futures = [
+                executor.submit(
+                    budget.run_item, process_item, item, actionnetwork, keycloak, dry_run,
+                    logger, field_mapper, upsert)
+                for item, field_mapper in zip(unprocessed, mapped)
+            ]
+            for future in futures:
+                item_new, item_updated = future.result()
+                new += item_new
+                updated += item_updated
+
+            budget.add_round(len(unprocessed), budget.clock() - start)
+
+            # Key of the last item handled, or None when the query reached the end
+            cursor = query.last_evaluated_key
+            if cursor is None:
+                has_more = False
+                break
+
+    logger.info('Finished processing batch of records', extra={
+        'new': new,
+        'update': updated,
+        'rounds': budget.rounds,
+        'items': budget.items,
+        'item_seconds': budget.get_item_seconds(),
+        'remaining_seconds': budget.get_remaining()
+    })
+
+    result = {
+        'new_members': new,
+        'updated_members': updated,
+        'cursor': cursor,
+        'hasMore': has_more
+    }
 
-    for item in unprocessed:
+    event.update(result)
+    return event
 
-        item.status = State.PROCESSING
-        item.save()
+def process_item(item, actionnetwork, keycloak, dry_run, logger, field_mapper=None,
+                 upsert=False):
+    """
+    Syncs a single State item to ActionNetwork and Keycloak.
+
+    This is safe to run in a worker thread. It only touches its own item.
+
+    Args:
+        field_mapper (MappedPerson): The mapped row, mapped here when not given
+        upsert (bool): Use a single POST for members without overrides
+
+    Returns:
+        tuple of (new, updated) member counts for this item
+    """
+
+    new = 0
+    updated = 0
+
+    # The index is eventually consistent, so it may still list an item that
+    # was just processed. Only continue if the item really is unprocessed.
+    item.status = State.PROCESSING
+    try:
+        item.save(condition=State.status == State.UNPROCESSED)
+    except PutError as err:
+        if err.cause_response_code != 'ConditionalCheckFailedException':
+            raise
+        logger.info('Skipping item that is no longer unprocessed', extra={'email': item.email})
+        return (new, updated)
+
+    if field_mapper is None:
+        field_mapper = BatchFieldMapper.map_all([json.loads(item.raw)])[0]
+    person_ids = None
+
+    if upsert and can_upsert(item):
+        # Nothing to read from the existing person, the signup helper
+        # creates or updates by email in one request
+        person = field_mapper.get_actionnetwork_person()
+
+        logger.info('Upserting member', extra={'email': item.email})
+        if item.person_ids:
+            updated += 1
+        else:
+            new += 1
+
+        person_ids = list(item.person_ids)
+        if not dry_run:
+            upserted = actionnetwork.upsert_person(**person)
+            person_ids = [upserted.get_actionnetwork_id()]
+            # Overrides may have been added in ActionNetwork since the last search
+            item.has_overrides = bool(upserted.get_overrides())
+
+    if person_ids is None and item.person_ids and item.has_overrides is False:
+        # Found last week without overrides, update by ID without searching
+        # first. Overrides are only known from the search, so members with
+        # them or without the flag go there.
+        has_overrides = False
+        try:
+            for person_id in item.person_ids:
+                field_mapper.person_id = person_id
+                updated_person = field_mapper.get_actionnetwork_person()
+
+                logger.info('Updating member', extra={
+                    'person_id': person_id,
+                    'email': item.email
+                    })
 
-        from_csv = json.loads(item.raw)
-        row = Row(from_csv.values(), from_csv.keys())
-        field_mapper = FieldMapper(row)
+                if not dry_run:
+                    person = Person.from_json(actionnetwork.update_person(**updated_person))
+                    has_overrides = has_overrides or bool(person.get_overrides())
+            person_ids = list(item.person_ids)
+            updated += len(person_ids)
+            if not dry_run:
+                # Refreshes the cached override flag used by upsert
+                item.has_overrides = has_overrides
+        except PersonNotFoundError:
+            logger.info('Stored person ID not found, searching by email', extra={
+                'person_id': field_mapper.person_id,
+                'email': item.email
+            })
+            # The search may not find anyone, then the person gets created
+            field_mapper.person_id = None
+
+    if person_ids is None:
+        person_ids = []
         people = actionnetwork.get_people_by_email(item.email)
+        # Refreshes the cached override flag used by upsert
+        item.has_overrides = any(p.get_overrides() for p in people)
 
         if len(people) == 0:
             person = field_mapper.get_actionnetwork_person()
@@ -68,88 +224,97 @@ def lambda_handler(event, context):
             new += 1
 
             if not dry_run:
-                for attempt in Retrying(stop=stop_after_attempt(3), wait=wait_fixed(RETRY_DELAY)):
-                    with attempt:
-                        actionnetwork.create_person(**person)
+                created = actionnetwork.create_person(**person)
+                person_ids.append(Person.from_json(created).get_actionnetwork_id())
         else:
             for existing_person in people:
                 field_mapper.person_id = existing_person.get_actionnetwork_id()
-                updated_person = field_mapper.get_actionnetwork_person()
                 field_mapper.overrides = existing_person.get_overrides()
+                updated_person = field_mapper.get_actionnetwork_person()
 
                 logger.info('Updating member', extra={
                     'person_id': field_mapper.person_id,
                     'email': item.email
                     })
                 updated += 1
+                person_ids.append(field_mapper.person_id)
 
                 if not dry_run:
-                    for attempt in Retrying(stop=stop_after_attempt(3), wait=wait_fixed(RETRY_DELAY)):
-                        with attempt:
-                            actionnetwork.update_person(**updated_person)
+                    actionnetwork.update_person(**updated_person)
 
-        #region keycloak
-        keycloak_user = keycloak.get_user_by_email(item.email)
+    item.person_ids = [person_id for person_id in person_ids if person_id]
 
-        if keycloak_user:
-            logger.info('Updating keycloak', extra={
-                'keycloak_user_id': keycloak_user
-            })
+    #region keycloak
+    # API errors are retried by the rate limiter. A retry here generates a
+    # new random username when the previous one was taken. Lookups and
+    # username checks are answered from the prefetched user maps.
 
-            for attempt in Retrying(stop=stop_after_attempt(3), wait=wait_fixed(RETRY_DELAY)):
-                with attempt:
-                    keycloak.update_user(field_mapper, keycloak_user)
+    keycloak_user = keycloak.get_user_by_email(item.email)
 
-        else:
-            logger.info('Creating new user in keycloak', extra={
-                'email': item.email
-            })
+    if keycloak_user:
+        logger.info('Updating keycloak', extra={
+            'keycloak_user_id': keycloak_user
+        })
+
+        for attempt in Retrying(stop=stop_after_attempt(3), retry=retry_if_exception_type(ValueError)):
+            with attempt:
+                keycloak.update_user(field_mapper, keycloak_user)
 
-            for attempt in Retrying(stop=stop_after_attempt(3), wait=wait_fixed(RETRY_DELAY)):
-                with attempt:
-                    keycloak.create_user(field_mapper)
-        #endregion keycloak
+    else:
+        logger.info('Creating new user in keycloak', extra={
+            'email': item.email
+        })
 
-        item.status = State.PROCESSED
-        item.save()
+        for attempt in Retrying(stop=stop_after_attempt(3), retry=retry_if_exception_type(ValueError)):
+            with attempt:
+                keycloak.create_user(field_mapper)
+    #endregion keycloak
 
-    logger.info('Finished processing batch of records', extra={
-        'new': new,
-        'update': updated
-    })
+    item.status = State.PROCESSED
+    item.save()
 
-    remainder = State.count(
-        hash_key=event['batch'],
-        filter_condition=State.status == State.UNPROCESSED
-        )
+    return (new, updated)
 
-    result = {
-        'new_members': new,
-        'updated_members': updated,
-        'hasMore': (remainder != 0)
-    }
+def can_upsert(item):
+    """
+    A single upsert is enough when the email belongs to at most one person
+    and the cached flag says they have no override_ custom fields.
+    """
 
-    event.update(result)
-    return event
+    return item.has_overrides is False and item.person_ids is not None \
+        and len(item.person_ids) <= 1
 
 def get_actionnetwork(api_k):
-    """Creates an ActionNetwork object.
+    """Gets the ActionNetwork object for an API key, creating it on first use.
 
     This function is a helper for mocking in tests"""
 
-    return ActionNetwork(api_k)
+    # Every worker thread may hold a connection at the same time
+    return get_actionnetwork_client(api_k, pool_size=max(10, WORKERS))
 
 def get_keycloak():
     """
-    Gets a KeycloakAdmin object to interact with the Keycloak API
+    Gets a KeycloakService to interact with the Keycloak API, creating it
+    on first use. Its admin token is refreshed when it is about to expire.
     """
 
-    return KeycloakService(
-        KeycloakAdmin(
-            server_url="https://auth.bostondsa.org/",
-            client_id=os.environ.get('KEYCLOAK_CLIENT_ID'),
-            client_secret_key=os.environ.get('KEYCLOAK_CLIENT_SECRET_KEY'),
-            realm_name=os.environ.get('KEYCLOAK_REALM'),
-            verify=True
+    global _keycloak # pylint: disable=global-statement
+
+    if _keycloak is None:
+        # python-keycloak is the largest import of this lambda, load it
+        # when the first invocation needs it rather than at init
+        from keycloak import KeycloakAdmin # pylint: disable=import-outside-toplevel
+        from actionnetwork_activist_sync.keycloak import KeycloakService # pylint: disable=import-outside-toplevel
+
+        _keycloak = KeycloakService(
+            KeycloakAdmin(
+                server_url=os.environ.get('KEYCLOAK_SERVER_URL', 'https://auth.bostondsa.org/'),
+                client_id=os.environ.get('KEYCLOAK_CLIENT_ID'),
+                client_secret_key=os.environ.get('KEYCLOAK_CLIENT_SECRET_KEY'),
+                realm_name=os.environ.get('KEYCLOAK_REALM'),
+                verify=True
+            ),
+            # Every item looks up its user, one pass over the realm is cheaper
+            prefetch=True
         )
-    )
+    return _keycloak
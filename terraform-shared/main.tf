@@ -19,6 +19,42 @@ resource "aws_dynamodb_table" "an-sync" {
     type = "S"
   }
 
+  attribute {
+    name = "status"
+    type = "N"
+  }
+
+  # Lets the processor query only unprocessed items of a batch
+  global_secondary_index {
+    name            = "batch-status-index"
+    hash_key        = "batch"
+    range_key       = "status"
+    projection_type = "ALL"
+  }
+
+}
+
+# Which ActionNetwork people are known to be subscribed to each neighborhood group
+resource "aws_dynamodb_table" "an-sync-neighborhoods" {
+  name         = "${var.project}_neighborhoods"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "neighborhood"
+  range_key    = "person_id"
+
+  attribute {
+    name = "neighborhood"
+    type = "S"
+  }
+
+  attribute {
+    name = "person_id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires"
+    enabled        = true
+  }
 }
 
 data "aws_iam_policy_document" "an-sync-lambda-policy-assume" {
@@ -56,7 +92,11 @@ data "aws_iam_policy_document" "an-sync-lambda-policy-attach" {
     actions = [
       "dynamodb:*"
     ]
-    resources = [aws_dynamodb_table.an-sync.arn]
+    resources = [
+      aws_dynamodb_table.an-sync.arn,
+      "${aws_dynamodb_table.an-sync.arn}/index/*",
+      aws_dynamodb_table.an-sync-neighborhoods.arn
+    ]
   }
   statement {
     actions = [
@@ -121,6 +161,8 @@ resource "aws_lambda_function" "an-sync-processor-lambda" {
       ACTIONNETWORK_API_KEY = aws_secretsmanager_secret.an-sync-secrets.arn
       DRY_RUN               = var.dry-run-processor
       LOG_LEVEL             = "INFO"
+      PROCESSOR_UPSERT      = var.processor-upsert
+      PROCESSOR_WORKERS     = var.processor-workers
     }
   }
 
@@ -168,6 +210,7 @@ resource "aws_lambda_function" "an-sync-neighborhoods-lambda" {
       DRY_RUN               = var.dry-run-neighborhoods
       LOG_LEVEL             = "INFO"
       NEIGHBORHOOD_MAP      = aws_secretsmanager_secret.an-sync-secrets.arn
+      NEIGHBORHOOD_WORKERS  = var.neighborhood-workers
     }
   }
 
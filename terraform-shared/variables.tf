@@ -14,6 +14,18 @@ variable "dry-run-processor" {
   default = "1"
 }
 
+variable "processor-upsert" {
+  default = "0"
+}
+
+variable "processor-workers" {
+  default = "4"
+}
+
+variable "neighborhood-workers" {
+  default = "8"
+}
+
 variable "dry-run-lapsed" {
   default = "1"
 }
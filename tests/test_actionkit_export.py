@@ -7,6 +7,7 @@ import unittest
 import agate
 
 from actionnetwork_activist_sync.actionkit_export import ActionKitExport
+from actionnetwork_activist_sync.export_diff import LAPSED
 
 def get_file(filename):
     """Helper to load Excel test data"""
@@ -71,3 +72,23 @@ class TestActionKitExport(unittest.TestCase):
 
         prev.close()
         cur.close()
+
+    def test_diff(self):
+        """Lapsed members from the streaming diff match the agate join"""
+
+        prev = get_file('01previous.csv')
+        cur = get_file('01current.csv')
+
+        export = ActionKitExport(prev, cur)
+        lapsed = [row.email for row in export.diff() if row.status == LAPSED]
+
+        self.assertEqual(['john.doe@example.com'], lapsed)
+
+        prev.close()
+        cur.close()
+
+    def test_diff_no_file_handles(self):
+        """Try to diff without files"""
+        export = ActionKitExport(None, None)
+        with self.assertRaises(TypeError):
+            export.diff()
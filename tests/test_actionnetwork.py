@@ -2,8 +2,151 @@
 """Tests for actionnetwork module"""
 
 import unittest
+from unittest.mock import Mock, patch
 
-from actionnetwork_activist_sync.actionnetwork import ActionNetwork
+import requests
+
+from actionnetwork_activist_sync import actionnetwork
+from actionnetwork_activist_sync.actionnetwork import ActionNetwork, PersonNotFoundError
+from actionnetwork_activist_sync.rate_limit import RateLimiter
+
+def get_response(body):
+    """Helper to fake a JSON response"""
+    response = Mock(requests.Response)
+    response.status_code = 200
+    response.headers = {}
+    response.json.return_value = body
+    return response
+
+class TestActionNetworkSession(unittest.TestCase):
+    """Test that all requests go through the pooled session"""
+
+    def setUp(self):
+        config = {'motd': 'Hello', '_links': {'osdi:lists': {'href': 'https://actionnetwork.org/api/v2/lists'}}}
+        with patch.object(requests.Session, 'request', return_value=get_response(config)):
+            self.actionnetwork = ActionNetwork('API_KEY', pool_size=4, timeout=(1, 2))
+
+    def test_session_is_pooled(self):
+        adapter = self.actionnetwork.session.get_adapter('https://actionnetwork.org/')
+        self.assertEqual(4, adapter._pool_maxsize)
+        self.assertEqual('keep-alive', self.actionnetwork.session.headers['Connection'])
+        self.assertIn('gzip', self.actionnetwork.session.headers['Accept-Encoding'])
+
+    @patch.object(actionnetwork, 'API_URL', 'http://127.0.0.1:8080/api/v2/')
+    def test_api_url_is_configurable(self):
+        config = {'motd': 'Hello', '_links': {}}
+        with patch.object(requests.Session, 'request', return_value=get_response(config)) as request:
+            local = ActionNetwork('LOCAL_KEY')
+
+        self.assertEqual('http://127.0.0.1:8080/api/v2/', request.call_args.args[1])
+        self.assertEqual('http://127.0.0.1:8080/api/v2/', local.base_url)
+
+    def test_operation_names_leave_out_ids(self):
+        base = 'https://actionnetwork.org/api/v2/'
+        self.assertEqual('GET api', actionnetwork.get_operation('GET', base))
+        self.assertEqual(
+            'GET people', actionnetwork.get_operation('GET', f"{base}people/?filter=email_address eq 'a'"))
+        self.assertEqual('PUT people/{id}', actionnetwork.get_operation('PUT', f'{base}people/abc-123'))
+        self.assertEqual(
+            'GET lists/{id}/items', actionnetwork.get_operation('GET', f'{base}lists/xyz/items?page=2'))
+
+    def test_inherited_methods_use_session(self):
+        person = {'identifiers': ['action_network:1']}
+        search = {'_embedded': {'osdi:people': [person]}}
+
+        with patch.object(requests, 'get') as module_get, \
+                patch.object(requests, 'put') as module_put, \
+                patch.object(self.actionnetwork.session, 'request') as request:
+            request.side_effect = [
+                get_response(search),
+                get_response(person),
+                get_response({'_embedded': {'osdi:lists': []}})
+            ]
+            self.actionnetwork.get_people_by_email('tech+fake@bostondsa.org')
+            self.actionnetwork.update_person(person_id='1', email='tech+fake@bostondsa.org')
+            self.actionnetwork.get_reports()
+
+            module_get.assert_not_called()
+            module_put.assert_not_called()
+            self.assertEqual(
+                ['GET', 'PUT', 'GET'],
+                [call.args[0] for call in request.call_args_list])
+            for call in request.call_args_list:
+                self.assertEqual((1, 2), call.kwargs['timeout'])
+                self.assertEqual('API_KEY', call.kwargs['headers']['OSDI-API-Token'])
+
+    def test_missing_person_id_raises(self):
+        not_found = get_response({'error': 'Not found'})
+        not_found.status_code = 404
+
+        with patch.object(self.actionnetwork.session, 'request', return_value=not_found):
+            with self.assertRaises(PersonNotFoundError):
+                self.actionnetwork.update_person(person_id='1', email='tech+fake@bostondsa.org')
+            with self.assertRaises(PersonNotFoundError):
+                self.actionnetwork.remove_member_by_id('1', 'tech+fake@bostondsa.org')
+
+    def test_throttled_after_retries_raises(self):
+        throttled = get_response({'error': 'throttled'})
+        throttled.status_code = 429
+        self.actionnetwork.limiter = RateLimiter(1000, max_attempts=3, sleep=lambda seconds: None)
+
+        with patch.object(self.actionnetwork.session, 'request', return_value=throttled) as request:
+            with self.assertRaises(requests.HTTPError):
+                self.actionnetwork.update_person(person_id='1', email='tech+fake@bostondsa.org')
+            with self.assertRaises(requests.HTTPError):
+                self.actionnetwork.create_person(email='tech+fake@bostondsa.org')
+
+        self.assertEqual(6, request.call_count)
+
+    def test_upsert_is_one_post(self):
+        created = {'identifiers': ['action_network:aaaaaaaa']}
+
+        with patch.object(self.actionnetwork.session, 'request',
+                          return_value=get_response(created)) as request:
+            person = self.actionnetwork.upsert_person(
+                person_id='aaaaaaaa', email='tech+fake@bostondsa.org')
+
+            self.assertEqual('aaaaaaaa', person.get_actionnetwork_id())
+            self.assertEqual(['POST'], [call.args[0] for call in request.call_args_list])
+
+class TestActionNetworkPagination(unittest.TestCase):
+    """Test the streaming collection iterators"""
+
+    def setUp(self):
+        config = {'motd': 'Hello', '_links': {'osdi:lists': {'href': 'https://actionnetwork.org/api/v2/lists'}}}
+        with patch.object(requests.Session, 'request', return_value=get_response(config)):
+            self.actionnetwork = ActionNetwork('API_KEY')
+
+    def get_page(self, page, total_pages, items):
+        body = {
+            'page': page,
+            'total_pages': total_pages,
+            '_embedded': {'osdi:items': items},
+            '_links': {}
+        }
+        if page < total_pages:
+            body['_links']['next'] = {
+                'href': f'https://actionnetwork.org/api/v2/lists/1/items?page={page + 1}'}
+        return get_response(body)
+
+    def test_iter_people_from_report(self):
+        report = {'_links': {'self': {'href': 'https://actionnetwork.org/api/v2/lists/1'}}}
+
+        with patch.object(self.actionnetwork.session, 'request') as request:
+            request.side_effect = [
+                self.get_page(1, 2, [{'id': 1}, {'id': 2}]),
+                self.get_page(2, 2, [{'id': 3}])
+            ]
+            people = self.actionnetwork.iter_people_from_report(report)
+
+            self.assertEqual({'id': 1}, next(people))
+            self.assertEqual([{'id': 2}, {'id': 3}], list(people))
+
+            # No extra request for an empty page
+            urls = [call.args[1] for call in request.call_args_list]
+            self.assertEqual(2, len(urls))
+            for url in urls:
+                self.assertIn('per_page=25', url)
 
 @unittest.skip("integration test, for dev only")
 class TestActionNetwork(unittest.TestCase):
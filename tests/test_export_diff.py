@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Tests for export_diff module"""
+
+import io
+import pathlib
+import unittest
+
+from actionnetwork_activist_sync.export_diff import (
+    CHANGED, LAPSED, MISSING_EMAIL, NEW, UNCHANGED, ExportDiff, get_row_digest
+)
+
+HEADER = 'email,first_name,last_name\n'
+
+def get_file(filename):
+    """Helper to load CSV test data"""
+    return open(pathlib.Path(__file__).parent / 'data' / filename, 'r', newline='')
+
+class TestExportDiff(unittest.TestCase):
+    """Tests the ExportDiff class"""
+
+    def get_statuses(self, previous, current):
+        diff = ExportDiff(io.StringIO(HEADER + previous), io.StringIO(HEADER + current))
+        return {(row.status, row.email) for row in diff}, diff.counts
+
+    def test_happy_path(self):
+        with get_file('01previous.csv') as prev, get_file('01current.csv') as cur:
+            rows = list(ExportDiff(prev, cur))
+
+        self.assertEqual(
+            [
+                (UNCHANGED, 'jane.doe@example.com'),
+                (NEW, 'jack.doe@example.com'),
+                (LAPSED, 'john.doe@example.com')
+            ],
+            [(row.status, row.email) for row in rows])
+        self.assertEqual('100002', rows[1].row['ak_id'])
+
+    def test_missing_email(self):
+        with get_file('02previous.csv') as prev, get_file('02current.csv') as cur:
+            diff = ExportDiff(prev, cur)
+            statuses = [row.status for row in diff]
+
+        self.assertEqual([UNCHANGED, MISSING_EMAIL], statuses)
+        self.assertEqual(1, diff.counts[MISSING_EMAIL])
+
+    def test_changed(self):
+        statuses, counts = self.get_statuses(
+            'kmarx@marxists.org,Karl,Marx\n',
+            'kmarx@marxists.org,Karl,Marks\n')
+
+        self.assertEqual({(CHANGED, 'kmarx@marxists.org')}, statuses)
+        self.assertEqual(1, counts[CHANGED])
+
+    def test_email_is_normalized(self):
+        statuses, _ = self.get_statuses(
+            'kmarx@marxists.org,Karl,Marx\n',
+            ' KMarx@Marxists.org ,Karl,Marx\n')
+
+        self.assertEqual({(CHANGED, 'kmarx@marxists.org')}, statuses)
+
+    def test_lapsed_only_has_email(self):
+        diff = ExportDiff(
+            io.StringIO(HEADER + 'KMarx@marxists.org,Karl,Marx\n'),
+            io.StringIO(HEADER))
+
+        self.assertEqual(
+            [(LAPSED, 'kmarx@marxists.org', {'email': 'KMarx@marxists.org'})],
+            [tuple(row) for row in diff])
+
+    def test_digest_ignores_whitespace_and_order(self):
+        self.assertEqual(
+            get_row_digest({'email': 'kmarx@marxists.org', 'first_name': 'Karl'}),
+            get_row_digest({' First_Name': 'Karl ', 'email': 'kmarx@marxists.org'}))
@@ -3,13 +3,14 @@
 
 from datetime import datetime
 from decimal import Decimal
+import io
 import unittest
 from unittest.mock import patch
 
 from agate import Row, Table
 from ddt import ddt, data, unpack
 
-from actionnetwork_activist_sync.field_mapper import FieldMapper
+from actionnetwork_activist_sync.field_mapper import BatchFieldMapper, FieldMapper
 
 @ddt
 class TestFieldMapper(unittest.TestCase):
@@ -85,4 +86,82 @@ class TestFieldMapper(unittest.TestCase):
         with patch('random.randint') as mock_rand:
             mock_rand.return_value = rand
             field_mapper = FieldMapper(Row([first, last], ['first_name', 'last_name']))
-            self.assertEqual(field_mapper.generate_username(), expected)
\ No newline at end of file
+            self.assertEqual(field_mapper.generate_username(), expected)
+
+@ddt
+class TestBatchFieldMapper(unittest.TestCase):
+    """Tests BatchFieldMapper matches FieldMapper"""
+
+    def get_rows(self):
+        full = {
+            'email': 'kmarx@marxists.org',
+            'first_name': 'Karl',
+            'middle_name': 'Heinrich',
+            'last_name': 'Marx',
+            'mailing_address1': '139 Tremont St',
+            'mailing_address2': 'Apt 123',
+            'mailing_city': 'Boston',
+            'mailing_state': 'MA',
+            'mailing_zip': '2111',
+            'best_phone': '',
+            'mobile_phone': '617-555-5555, 6176666666',
+            'home_phone': '6177777777',
+            'do_not_call': 'FALSE',
+            'memb_status_letter': 'M',
+            'union_member': 'Yes'
+        }
+        sparse = dict.fromkeys(full, '')
+        sparse['email'] = 'fengels@marxists.org'
+        return [full, sparse]
+
+    @data(
+        (None, {}),
+        ('aaaaaaaa', {'given_name': 'Charles', 'Phone': '6178888888'})
+    )
+    @unpack
+    def test_same_as_field_mapper(self, person_id, overrides):
+        rows = self.get_rows()
+        mapped = BatchFieldMapper.map_all(rows)
+
+        for row, batch in zip(rows, mapped):
+            single = FieldMapper(Row(row.values(), row.keys()))
+            for field_mapper in (single, batch):
+                field_mapper.person_id = person_id
+                field_mapper.overrides = overrides
+
+            self.assertEqual(single.get_actionnetwork_person(), batch.get_actionnetwork_person())
+            self.assertEqual(single.get_keycloak_user(), batch.get_keycloak_user())
+            self.assertEqual(single.is_member, batch.is_member)
+
+    def test_missing_columns(self):
+        rows = [{'email': 'kmarx@marxists.org'}]
+        single = FieldMapper(Row(['kmarx@marxists.org'], ['email']))
+
+        self.assertEqual(
+            single.get_actionnetwork_person(),
+            BatchFieldMapper.map_all(rows)[0].get_actionnetwork_person())
+
+    def test_row_without_export_header(self):
+        mapper = BatchFieldMapper(['email', 'first_name'])
+
+        person = mapper.map_row({'email': 'kmarx@marxists.org'}).get_actionnetwork_person()
+
+        self.assertEqual('kmarx@marxists.org', person['email'])
+        self.assertIsNone(person['given_name'])
+
+    def test_map_csv(self):
+        csv_file = io.StringIO('email,first_name,memb_status_letter\nkmarx@marxists.org,Karl,M\n')
+
+        mapped = BatchFieldMapper.map_csv(csv_file)
+
+        self.assertEqual(1, len(mapped))
+        self.assertEqual('Karl', mapped[0].get_first_name())
+        self.assertEqual('True', mapped[0].get_actionnetwork_person()['custom_fields']['is_member'])
+
+    def test_overrides_do_not_leak(self):
+        mapped = BatchFieldMapper.map_all(self.get_rows())[0]
+        mapped.overrides = {'Phone': '6178888888'}
+        mapped.get_actionnetwork_person()
+        mapped.overrides = {}
+
+        self.assertEqual('6175555555', mapped.get_actionnetwork_person()['custom_fields']['Phone'])
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Tests for keycloak module"""
+
+import unittest
+from unittest.mock import Mock, patch
+
+from keycloak import KeycloakAdmin
+from keycloak.exceptions import KeycloakGetError
+import requests
+
+from actionnetwork_activist_sync.field_mapper import BatchFieldMapper
+from actionnetwork_activist_sync.keycloak import KeycloakService
+from actionnetwork_activist_sync.rate_limit import RateLimiter
+
+def get_response(body):
+    """Helper to fake a JSON response"""
+    response = Mock(requests.Response)
+    response.status_code = 200
+    response.json.return_value = body
+    return response
+
+def get_user(i):
+    return {'id': str(i), 'username': f'User{i}', 'email': f'user{i}@example.com'}
+
+class TestKeycloakService(unittest.TestCase):
+    """Tests the prefetched user maps"""
+
+    def setUp(self):
+        self.admin = Mock(KeycloakAdmin)
+        self.admin.realm_name = 'test'
+        users = [get_user(i) for i in range(5)]
+        self.admin.raw_get = Mock(side_effect=[
+            get_response(users[0:2]),
+            get_response(users[2:4]),
+            get_response(users[4:5])
+        ])
+        self.service = KeycloakService(
+            self.admin, limiter=RateLimiter(1000), prefetch=True, page_size=2)
+
+    def get_mapper(self, email):
+        return BatchFieldMapper.map_all([
+            {'email': email, 'first_name': 'Karl', 'last_name': 'Marx'}])[0]
+
+    def test_users_are_paged_once(self):
+        self.assertEqual('3', self.service.get_user_by_email('User3@example.com')['id'])
+        self.assertEqual('4', self.service.get_user_by_username('user4')['id'])
+        self.assertIsNone(self.service.get_user_by_email('kmarx@marxists.org'))
+
+        self.assertEqual(
+            [(0, 2), (2, 2), (4, 2)],
+            [(call.kwargs['first'], call.kwargs['max'])
+             for call in self.admin.raw_get.call_args_list])
+        self.admin.get_users.assert_not_called()
+
+    def test_created_user_is_remembered(self):
+        self.admin.create_user.return_value = '99'
+
+        with patch('random.randint', return_value=9999):
+            self.service.create_user(self.get_mapper('kmarx@marxists.org'))
+
+        self.assertEqual('99', self.service.get_user_by_email('kmarx@marxists.org')['id'])
+        with self.assertRaises(ValueError):
+            self.service.check_username('KarlM9999')
+        self.admin.get_users.assert_not_called()
+
+    def test_failed_create_frees_username(self):
+        self.admin.create_user.side_effect = RuntimeError
+
+        with patch('random.randint', return_value=9999):
+            with self.assertRaises(RuntimeError):
+                self.service.create_user(self.get_mapper('kmarx@marxists.org'))
+
+        self.service.check_username('KarlM9999')
+        self.assertIsNone(self.service.get_user_by_email('kmarx@marxists.org'))
+
+    def test_create_skips_username_lookup(self):
+        self.admin.create_user.return_value = '99'
+
+        self.service.create_user(self.get_mapper('kmarx@marxists.org'))
+
+        self.assertFalse(self.admin.create_user.call_args.kwargs['exist_ok'])
+
+    def test_create_conflict_is_a_taken_username(self):
+        self.admin.create_user.side_effect = KeycloakGetError(
+            'User exists with same username', response_code=409)
+
+        with patch('random.randint', return_value=9999):
+            with self.assertRaises(ValueError):
+                self.service.create_user(self.get_mapper('kmarx@marxists.org'))
+
+        self.service.check_username('KarlM9999')
+
+    def test_migrated_username_is_updated(self):
+        legacy = {'id': '7', 'username': 'kmarx@marxists.org', 'email': 'kmarx@marxists.org'}
+        self.service.get_user_by_email('user0@example.com')
+        self.service._remember(legacy)
+
+        with patch('random.randint', return_value=9999):
+            self.service.update_user(self.get_mapper('kmarx@marxists.org'), legacy)
+
+        self.assertIsNone(self.service.get_user_by_username('kmarx@marxists.org'))
+        self.assertEqual('7', self.service.get_user_by_username('KarlM9999')['id'])
+        self.assertEqual('KarlM9999', self.service.get_user_by_email('kmarx@marxists.org')['username'])
+
+    def test_failed_update_restores_user(self):
+        legacy = {'id': '7', 'username': 'kmarx@marxists.org', 'email': 'kmarx@marxists.org'}
+        self.service.get_user_by_email('user0@example.com')
+        self.service._remember(legacy)
+        self.admin.update_user.side_effect = RuntimeError
+
+        with patch('random.randint', return_value=9999):
+            with self.assertRaises(RuntimeError):
+                self.service.update_user(self.get_mapper('kmarx@marxists.org'), legacy)
+
+        self.service.check_username('KarlM9999')
+        self.assertIs(legacy, self.service.get_user_by_email('kmarx@marxists.org'))
+        self.assertIs(legacy, self.service.get_user_by_username('kmarx@marxists.org'))
+
+    def test_without_prefetch_uses_api(self):
+        service = KeycloakService(self.admin, limiter=RateLimiter(1000))
+        self.admin.get_users.return_value = [get_user(1)]
+
+        self.assertEqual('1', service.get_user_by_email('user1@example.com')['id'])
+        self.admin.raw_get.assert_not_called()
+
+class TestKeycloakToken(unittest.TestCase):
+    """Tests the admin token refresh"""
+
+    def setUp(self):
+        self.now = 0
+        self.admin = Mock(KeycloakAdmin)
+        self.admin.token = {'access_token': 'token', 'expires_in': 300}
+        self.admin.get_users.return_value = []
+        self.service = KeycloakService(
+            self.admin, limiter=RateLimiter(1000), clock=lambda: self.now)
+
+    def test_token_is_kept_until_it_nearly_expires(self):
+        self.now = 200
+        self.service.get_user_by_email('kmarx@marxists.org')
+        self.admin.get_token.assert_not_called()
+
+        self.now = 280
+        self.service.get_user_by_email('kmarx@marxists.org')
+        self.admin.get_token.assert_called_once()
+
+        # The new token is good for another 300 seconds
+        self.service.get_user_by_email('kmarx@marxists.org')
+        self.admin.get_token.assert_called_once()
+
+    def test_refresh_token_is_used_when_there_is_one(self):
+        self.admin.token['refresh_token'] = 'refresh'
+        self.now = 290
+
+        self.service.get_user_by_email('kmarx@marxists.org')
+
+        self.admin.refresh_token.assert_called_once()
+        self.admin.get_token.assert_not_called()
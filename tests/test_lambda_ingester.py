@@ -2,7 +2,10 @@ import csv
 from email.message import EmailMessage
 import io
 import os
+import tempfile
+import tracemalloc
 import unittest
+from unittest.mock import patch
 import zipfile
 
 from moto import mock_aws
@@ -15,7 +18,8 @@ os.environ['EMAIL_SUBJECT'] = 'SYNC'
 os.environ['EMAIL_FROM'] = 'sync@example.com'
 
 import lambda_ingester
-from actionnetwork_activist_sync.state_model import State
+from actionnetwork_activist_sync.email_stream import StreamingEmail
+from actionnetwork_activist_sync.state_model import State, StateBatchWrite
 
 @mock_aws
 class TestIngester(unittest.TestCase):
@@ -131,6 +135,202 @@ class TestIngester(unittest.TestCase):
         State.delete_table()
 
 
+    def test_csv_written_in_batches(self):
+        csv_data = [['email', 'first_name', 'last_name']]
+        csv_data += [[f'member{i}@example.com', 'Rosa', 'Luxemburg'] for i in range(30)]
+
+        fake_zip = self.get_zipped_csv(csv_data)
+
+        email = EmailMessage()
+        email['Subject'] = os.environ['EMAIL_SUBJECT']
+        email['From'] = os.environ['EMAIL_FROM']
+        email['To'] = 'test@example.com'
+        email.add_attachment(
+            fake_zip.getvalue(), maintype='application', subtype='zip')
+
+        bucket = 'actionnetworkactivistsync'
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=bucket)
+        s3.put_object(Bucket=bucket,Key='test.email',Body=email.as_bytes())
+
+        State.create_table(billing_mode='PAY_PER_REQUEST')
+        event = lambda_ingester.lambda_handler(self.get_event(bucket), Context(5))
+        self.assertEqual(30, event['ingested_rows'])
+        self.assertEqual(2, event['write_requests'])
+        self.assertEqual(0, event['write_retries'])
+        self.assertEqual(30, State.count(lambda_ingester.get_batch()))
+        State.delete_table()
+
+    def test_repeated_emails_are_not_in_one_request(self):
+        csv_data = [['email', 'first_name', 'last_name']]
+        csv_data += [[f'member{i}@example.com', 'Rosa', 'Luxemburg'] for i in range(30)]
+        # A household sharing an email, the last row wins
+        csv_data.insert(5, ['member9@example.com', 'Karl', 'Liebknecht'])
+        csv_data.append(['member29@example.com', 'Clara', 'Zetkin'])
+
+        fake_zip = self.get_zipped_csv(csv_data)
+
+        email = EmailMessage()
+        email['Subject'] = os.environ['EMAIL_SUBJECT']
+        email['From'] = 'sync@example.com'
+        email['To'] = 'test@example.com'
+        email.add_attachment(
+            fake_zip.getvalue(), maintype='application', subtype='zip')
+
+        bucket = 'actionnetworkactivistsync'
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=bucket)
+        s3.put_object(Bucket=bucket,Key='test.email',Body=email.as_bytes())
+
+        State.create_table(billing_mode='PAY_PER_REQUEST')
+        connection = State._get_connection()
+        real_batch_write_item = connection.batch_write_item
+        batches = []
+
+        def unique_batch_write_item(put_items, delete_items):
+            # moto doesn't reject repeated keys like DynamoDB does
+            keys = [item['email']['S'] for item in put_items]
+            batches.append(keys)
+            self.assertEqual(len(keys), len(set(keys)))
+            return real_batch_write_item(put_items=put_items, delete_items=delete_items)
+
+        with patch.object(connection, 'batch_write_item', side_effect=unique_batch_write_item):
+            lambda_ingester.lambda_handler(self.get_event(bucket), Context(5))
+
+        self.assertEqual(2, len(batches))
+        batch = lambda_ingester.get_batch()
+        self.assertEqual(30, State.count(batch))
+        self.assertIn('Rosa', State.get(batch, range_key='member9@example.com').raw)
+        self.assertIn('Clara', State.get(batch, range_key='member29@example.com').raw)
+        State.delete_table()
+
+    def test_unchanged_rows_are_skipped(self):
+        csv_data = [
+            ['email', 'first_name', 'last_name'],
+            ['kmarx@marxists.org', 'Karl', 'Marx'],
+            ['fengels@marxists.org', 'Friedrich', 'Engels']
+        ]
+
+        fake_zip = self.get_zipped_csv(csv_data)
+
+        email = EmailMessage()
+        email['Subject'] = os.environ['EMAIL_SUBJECT']
+        email['From'] = 'sync@example.com'
+        email['To'] = 'test@example.com'
+        email.add_attachment(
+            fake_zip.getvalue(), maintype='application', subtype='zip')
+
+        bucket = 'actionnetworkactivistsync'
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=bucket)
+        s3.put_object(Bucket=bucket,Key='test.email',Body=email.as_bytes())
+
+        State.create_table(billing_mode='PAY_PER_REQUEST')
+
+        # Karl is the same as last week, Friedrich moved
+        prev_batch = lambda_ingester.get_previous_batch()
+        karl = {'email': 'kmarx@marxists.org', 'first_name': 'Karl', 'last_name': 'Marx'}
+        friedrich = {'email': 'fengels@marxists.org', 'first_name': 'Friedrich', 'last_name': 'Engles'}
+        for row in (karl, friedrich):
+            State(
+                prev_batch,
+                row['email'],
+                raw=row,
+                status=State.PROCESSED,
+                checksum=State.get_checksum(row),
+                person_ids=[row['first_name']]
+            ).save()
+
+        event = lambda_ingester.lambda_handler(self.get_event(bucket), Context(5))
+        self.assertEqual(2, event['ingested_rows'])
+        self.assertEqual(1, event['unchanged_rows'])
+
+        batch = lambda_ingester.get_batch()
+        self.assertEqual(
+            State.UNCHANGED,
+            State.get(batch, range_key='kmarx@marxists.org').status)
+        self.assertEqual(
+            State.UNPROCESSED,
+            State.get(batch, range_key='fengels@marxists.org').status)
+
+        # The ActionNetwork IDs carry over to the new batch
+        self.assertEqual(['Karl'], State.get(batch, range_key='kmarx@marxists.org').person_ids)
+        self.assertEqual(
+            ['Friedrich'],
+            State.get(batch, range_key='fengels@marxists.org').person_ids)
+        State.delete_table()
+
+    def test_checksum_is_stable(self):
+        self.assertEqual(
+            State.get_checksum({'email': 'kmarx@marxists.org', 'first_name': 'Karl'}),
+            State.get_checksum({'First_Name': ' Karl ', 'email': 'kmarx@marxists.org'}))
+        self.assertNotEqual(
+            State.get_checksum({'email': 'kmarx@marxists.org', 'first_name': 'Karl'}),
+            State.get_checksum({'email': 'kmarx@marxists.org', 'first_name': 'Carl'}))
+
+    @patch.object(StateBatchWrite, 'BASE_DELAY', 0)
+    def test_unprocessed_items_get_retried(self):
+        State.create_table(billing_mode='PAY_PER_REQUEST')
+        connection = State._get_connection()
+        real_batch_write_item = connection.batch_write_item
+        calls = []
+
+        def flaky_batch_write_item(put_items, delete_items):
+            calls.append(len(put_items))
+            if len(calls) == 1:
+                # DynamoDB accepted only the first item
+                real_batch_write_item(put_items=put_items[:1], delete_items=[])
+                return {'UnprocessedItems': {State.Meta.table_name: [
+                    {'PutRequest': {'Item': item}} for item in put_items[1:]
+                ]}}
+            return real_batch_write_item(put_items=put_items, delete_items=delete_items)
+
+        with patch.object(connection, 'batch_write_item', side_effect=flaky_batch_write_item):
+            with State.batch_write() as writer:
+                for i in range(3):
+                    writer.save(State('202101', f'member{i}@example.com', raw='{}'))
+
+        self.assertEqual([3, 2], calls)
+        self.assertEqual(2, writer.write_requests)
+        self.assertEqual(1, writer.retries)
+        self.assertEqual(3, State.count('202101'))
+        State.delete_table()
+
+    @patch.object(lambda_ingester, 'ZIP_SPOOL_SIZE', 64 * 1024)
+    def test_streaming_memory_is_flat(self):
+        def peak_memory(num_rows):
+            csv_data = [['email', 'first_name', 'last_name', 'mailing_address1']]
+            csv_data += [
+                [f'member{i}@example.com', f'Rosa{i}', f'Luxemburg{i}', f'{i} Tremont St']
+                for i in range(num_rows)
+            ]
+            email = EmailMessage()
+            email['Subject'] = os.environ['EMAIL_SUBJECT']
+            email['From'] = os.environ['EMAIL_FROM']
+            email.add_attachment(
+                self.get_zipped_csv(csv_data).getvalue(),
+                maintype='application', subtype='zip')
+
+            with tempfile.TemporaryFile() as email_file:
+                email_file.write(email.as_bytes())
+                email_file.seek(0)
+                del csv_data, email
+
+                tracemalloc.start()
+                msg = StreamingEmail(email_file)
+                rows = sum(1 for _ in lambda_ingester.iter_zipped_csv(msg.get_attachment()))
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+            self.assertEqual(num_rows, rows)
+            return peak
+
+        small = peak_memory(5000)
+        large = peak_memory(50000)
+
+        # 10x the rows should not need noticeably more memory
+        self.assertLess(large, small * 1.5)
+
     def test_missing_email_gets_skipped(self):
         csv_data = [
             ['email', 'first_name', 'last_name'],
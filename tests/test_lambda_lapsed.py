@@ -1,5 +1,4 @@
 import json
-import importlib
 import os
 import unittest
 from unittest.mock import Mock
@@ -27,8 +26,8 @@ class TestLapsed(unittest.TestCase):
                 'last_name': 'Marx'
         })
 
-        self.create_karl_state(State, lambda_lapsed.cur_batch, State.PROCESSED)
-        self.create_karl_state(State, lambda_lapsed.prev_batch, State.PROCESSED)
+        self.create_karl_state(State, lambda_lapsed.get_batch(), State.PROCESSED)
+        self.create_karl_state(State, lambda_lapsed.get_previous_batch(), State.PROCESSED)
 
         mock_an = Mock(ActionNetwork)
         lambda_lapsed.get_actionnetwork = lambda a: mock_an
@@ -39,6 +38,25 @@ class TestLapsed(unittest.TestCase):
         self.assertEqual(result['cur_count'], 1)
         self.assertEqual(result['prev_count'], 1)
 
+    @mock_aws
+    def test_unchanged_is_not_lapsed(self):
+        import lambda_lapsed
+        from actionnetwork_activist_sync.actionnetwork import ActionNetwork
+        from actionnetwork_activist_sync.state_model import State
+
+        State.create_table(billing_mode='PAY_PER_REQUEST')
+
+        self.create_karl_state(State, lambda_lapsed.get_batch(), State.UNCHANGED)
+        self.create_karl_state(State, lambda_lapsed.get_previous_batch(), State.PROCESSED)
+
+        mock_an = Mock(ActionNetwork)
+        lambda_lapsed.get_actionnetwork = lambda a: mock_an
+
+        result = lambda_lapsed.lambda_handler({}, Context(5))
+
+        mock_an.remove_member_by_email.assert_not_called()
+        self.assertEqual(result['removed'], 0)
+
     @mock_aws
     def test_not_in_cur_but_in_prev_gets_removed(self):
         import lambda_lapsed
@@ -47,12 +65,11 @@ class TestLapsed(unittest.TestCase):
 
         # this lets us make sure the mock gets called
         os.environ['DRY_RUN'] = '0'
-        importlib.reload(lambda_lapsed)
 
         State.create_table(billing_mode='PAY_PER_REQUEST')
 
-        self.create_friedrich_state(State, lambda_lapsed.cur_batch, State.PROCESSED)
-        self.create_karl_state(State, lambda_lapsed.prev_batch, State.PROCESSED)
+        self.create_friedrich_state(State, lambda_lapsed.get_batch(), State.PROCESSED)
+        self.create_karl_state(State, lambda_lapsed.get_previous_batch(), State.PROCESSED)
 
         mock_an = Mock(ActionNetwork)
         mock_an.remove_member_by_email = Mock()
@@ -69,6 +86,61 @@ class TestLapsed(unittest.TestCase):
 
         del os.environ['DRY_RUN']
 
+    @mock_aws
+    def test_counts_include_every_status(self):
+        import lambda_lapsed
+        from actionnetwork_activist_sync.actionnetwork import ActionNetwork
+        from actionnetwork_activist_sync.state_model import State
+
+        State.create_table(billing_mode='PAY_PER_REQUEST')
+
+        self.create_karl_state(State, lambda_lapsed.get_batch(), State.PROCESSED)
+        self.create_friedrich_state(State, lambda_lapsed.get_batch(), State.UNPROCESSED)
+        self.create_karl_state(State, lambda_lapsed.get_previous_batch(), State.PROCESSED)
+        self.create_friedrich_state(State, lambda_lapsed.get_previous_batch(), State.UNPROCESSED)
+
+        mock_an = Mock(ActionNetwork)
+        lambda_lapsed.get_actionnetwork = lambda a: mock_an
+
+        result = lambda_lapsed.lambda_handler({}, Context(5))
+
+        # Only synced items are diffed, but the counts are of the whole batch
+        self.assertEqual(result['removed'], 0)
+        self.assertEqual(result['cur_count'], 2)
+        self.assertEqual(result['prev_count'], 2)
+
+    @mock_aws
+    def test_lapsed_uses_stored_person_id(self):
+        import lambda_lapsed
+        from actionnetwork_activist_sync.actionnetwork import ActionNetwork, PersonNotFoundError
+        from actionnetwork_activist_sync.state_model import State
+
+        State.create_table(billing_mode='PAY_PER_REQUEST')
+
+        mock_an = Mock(ActionNetwork)
+        lambda_lapsed.remove_lapsed_member(mock_an, 'kmarx@marxists.org', ['aaaaaaaa'])
+
+        mock_an.remove_member_by_id.assert_called_once_with('aaaaaaaa', 'kmarx@marxists.org')
+        mock_an.remove_member_by_email.assert_not_called()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.remove_member_by_id = Mock(side_effect=PersonNotFoundError('aaaaaaaa'))
+        lambda_lapsed.remove_lapsed_member(mock_an, 'kmarx@marxists.org', ['aaaaaaaa'])
+
+        mock_an.remove_member_by_email.assert_called_once_with('kmarx@marxists.org')
+
+    @mock_aws
+    def test_diff_emails(self):
+        import lambda_lapsed
+
+        diff = lambda_lapsed.diff_emails(
+            {'kmarx@marxists.org', 'rluxemburg@marxists.org'},
+            {'kmarx@marxists.org', 'fengels@marxists.org'})
+
+        self.assertEqual({'fengels@marxists.org'}, diff.lapsed)
+        self.assertEqual({'rluxemburg@marxists.org'}, diff.new)
+        self.assertEqual({'kmarx@marxists.org'}, diff.retained)
+
     def create_karl_state(self, State, batch, status):
         state = State(
             batch,
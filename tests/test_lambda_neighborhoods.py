@@ -1,19 +1,30 @@
+import datetime
 import os
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
+from moto import mock_aws
+import requests
 from lambda_local.context import Context
 
 from actionnetwork_activist_sync.actionnetwork import ActionNetwork
 from actionnetwork_activist_sync.osdi import Person
+from actionnetwork_activist_sync.state_model import NeighborhoodMember
 import lambda_neighborhoods
 
 os.environ['ENVIRONMENT'] = 'TEST'
 os.environ['LOG_LEVEL'] = 'CRITICAL'
 os.environ['DRY_RUN'] = '0'
 
+@mock_aws
 class TestNeighborhoods(unittest.TestCase):
 
+    def setUp(self) -> None:
+        NeighborhoodMember.create_table(billing_mode='PAY_PER_REQUEST')
+
+    def tearDown(self) -> None:
+        NeighborhoodMember.delete_table()
+
     def test_no_reports(self):
         mock_an = Mock(ActionNetwork)
         mock_an.get_neighborhood_reports.return_value = []
@@ -37,7 +48,7 @@ class TestNeighborhoods(unittest.TestCase):
 
         mock_an = Mock(ActionNetwork)
         mock_an.get_neighborhood_reports.return_value = [{'name': 'Neighborhood - Missing'}]
-        mock_an.get_all_people_from_report.return_value = []
+        mock_an.iter_people_from_report.return_value = []
 
         mock_hood_an = Mock(ActionNetwork)
 
@@ -52,7 +63,7 @@ class TestNeighborhoods(unittest.TestCase):
 
         mock_an = Mock(ActionNetwork)
         mock_an.get_neighborhood_reports.return_value = [{'name': 'Neighborhood - Missing'}]
-        mock_an.get_all_people_from_report.return_value = [{
+        mock_an.iter_people_from_report.return_value = [{
             'action_network:person_id': 1,
             'given_name': 'Karl',
             'family_name': 'Marx',
@@ -97,11 +108,12 @@ class TestNeighborhoods(unittest.TestCase):
 
         mock_an = Mock(ActionNetwork)
         mock_an.get_neighborhood_reports.return_value = [{'name': 'Neighborhood - Missing'}]
-        mock_an.get_all_people_from_report.return_value = [person]
+        mock_an.iter_people_from_report.return_value = [person]
         mock_an.get_person.return_value = person
 
         mock_hood_an = Mock(ActionNetwork)
         mock_hood_an.get_person.return_value = {'error': "Couldn't find User with uuid = 000"}
+        mock_hood_an.subscribe_person.return_value = Mock(status_code=200)
 
         lambda_neighborhoods.get_actionnetwork = Mock()
         lambda_neighborhoods.get_actionnetwork.side_effect = [mock_an, mock_hood_an]
@@ -110,3 +122,91 @@ class TestNeighborhoods(unittest.TestCase):
         mock_an.get_person.assert_called_once_with(person_id=1)
         mock_hood_an.subscribe_person.assert_called_once_with(person)
         self.assertEqual((0,1), ret)
+        self.assertEqual({'1'}, NeighborhoodMember.get_person_ids('Neighborhood - Missing'))
+
+    def test_failed_subscribe_is_not_cached(self):
+        os.environ['NEIGHBORHOOD_MAP'] = '{"Neighborhood - Missing": "XXX"}'
+        os.environ['DRY_RUN'] = '0'
+
+        person = {
+            'action_network:person_id': 1,
+            'email_addresses': [{'address': 'kmarx@bostondsa.org'}]
+        }
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.get_neighborhood_reports.return_value = [{'name': 'Neighborhood - Missing'}]
+        mock_an.iter_people_from_report.return_value = [person, dict(person, **{'action_network:person_id': 2})]
+        mock_an.get_person.return_value = person
+
+        mock_hood_an = Mock(ActionNetwork)
+        mock_hood_an.get_person.return_value = {'error': 'Not found'}
+        mock_hood_an.subscribe_person.side_effect = [
+            Mock(status_code=400),
+            requests.HTTPError('429 after retries')
+        ]
+
+        lambda_neighborhoods.get_actionnetwork = Mock()
+        lambda_neighborhoods.get_actionnetwork.side_effect = [mock_an, mock_hood_an]
+
+        ret = lambda_neighborhoods.lambda_handler({}, Context(5))
+        self.assertEqual((0,0), ret)
+        self.assertEqual(2, mock_hood_an.subscribe_person.call_count)
+        self.assertEqual(set(), NeighborhoodMember.get_person_ids('Neighborhood - Missing'))
+
+    @patch.object(lambda_neighborhoods, 'WORKERS', 2)
+    def test_neighborhoods_in_parallel(self):
+        os.environ['NEIGHBORHOOD_MAP'] = '{"Neighborhood - North": "NORTH", "Neighborhood - South": "SOUTH"}'
+        os.environ['DRY_RUN'] = '0'
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.get_neighborhood_reports.return_value = [
+            {'name': 'Neighborhood - North'},
+            {'name': 'Neighborhood - South'}
+        ]
+        mock_an.iter_people_from_report.side_effect = lambda report: [
+            {'action_network:person_id': f"{report['name']}-{i}"} for i in range(3)
+        ]
+        mock_an.get_person.return_value = {'email_addresses': []}
+
+        # North already has everyone, South has nobody
+        mock_north = Mock(ActionNetwork)
+        mock_north.get_person.return_value = {'email_addresses': []}
+        mock_south = Mock(ActionNetwork)
+        mock_south.get_person.return_value = {'error': 'Not found'}
+        mock_south.subscribe_person.return_value = Mock(status_code=200)
+
+        clients = {'NORTH': mock_north, 'SOUTH': mock_south}
+        lambda_neighborhoods.get_actionnetwork = lambda a: clients.get(a, mock_an)
+
+        ret = lambda_neighborhoods.lambda_handler({}, Context(5))
+        self.assertEqual((3,3), ret)
+        self.assertEqual(3, mock_south.subscribe_person.call_count)
+        mock_north.subscribe_person.assert_not_called()
+
+    def test_known_person_skips_api(self):
+        os.environ['NEIGHBORHOOD_MAP'] = '{"Neighborhood - Missing": "XXX"}'
+
+        NeighborhoodMember.add('Neighborhood - Missing', 1)
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.get_neighborhood_reports.return_value = [{'name': 'Neighborhood - Missing'}]
+        mock_an.iter_people_from_report.return_value = [{'action_network:person_id': 1}]
+
+        mock_hood_an = Mock(ActionNetwork)
+
+        lambda_neighborhoods.get_actionnetwork = Mock()
+        lambda_neighborhoods.get_actionnetwork.side_effect = [mock_an, mock_hood_an]
+
+        ret = lambda_neighborhoods.lambda_handler({}, Context(5))
+        self.assertEqual((1,0), ret)
+        mock_hood_an.get_person.assert_not_called()
+        mock_an.get_person.assert_not_called()
+
+    def test_expired_person_is_checked_again(self):
+        os.environ['NEIGHBORHOOD_MAP'] = '{"Neighborhood - Missing": "XXX"}'
+
+        NeighborhoodMember(
+            'Neighborhood - Missing', '1',
+            expires=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)).save()
+
+        self.assertEqual(set(), NeighborhoodMember.get_person_ids('Neighborhood - Missing'))
@@ -1,7 +1,7 @@
 import os
 import json
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, create_autospec, patch
 
 from moto import mock_aws
 from lambda_local.context import Context
@@ -10,20 +10,32 @@ from tenacity import RetryError
 from keycloak import KeycloakAdmin
 
 import lambda_processor
-from actionnetwork_activist_sync.actionnetwork import ActionNetwork
+from actionnetwork_activist_sync import actionnetwork
+from actionnetwork_activist_sync.actionnetwork import ActionNetwork, PersonNotFoundError
 from actionnetwork_activist_sync.keycloak import KeycloakService
 from actionnetwork_activist_sync.osdi import Person
 from actionnetwork_activist_sync.state_model import State
+from actionnetwork_activist_sync.time_budget import TimeBudget
 
 os.environ['ENVIRONMENT'] = 'TEST'
 os.environ['LOG_LEVEL'] = 'CRITICAL'
 os.environ['DRY_RUN'] = '1'
 os.environ['ACTIONNETWORK_API_KEY'] = 'X'
 
+# The tests below replace these with mocks
+GET_ACTIONNETWORK = lambda_processor.get_actionnetwork
+GET_KEYCLOAK = lambda_processor.get_keycloak
+
+def get_context(seconds=5):
+    """A lambda_local context that counts down like the real one"""
+    return Context(seconds)._activate()
+
 @mock_aws
 class TestProcessor(unittest.TestCase):
 
     def setUp(self) -> None:
+        # Other test modules turn dry run off
+        os.environ['DRY_RUN'] = '1'
         State.create_table(billing_mode='PAY_PER_REQUEST')
 
     def tearDown(self) -> None:
@@ -45,7 +57,7 @@ class TestProcessor(unittest.TestCase):
             'ingested_rows': 1
         }
 
-        result = lambda_processor.lambda_handler(event, Context(5))
+        result = lambda_processor.lambda_handler(event, get_context())
         self.assertEqual(result['new_members'], 1)
         self.assertEqual(result['updated_members'], 0)
         self.assertFalse(result['hasMore'])
@@ -69,15 +81,14 @@ class TestProcessor(unittest.TestCase):
         mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
         lambda_processor.get_keycloak = lambda: mock_keycloak
 
-        result = lambda_processor.lambda_handler(event, Context(5))
+        result = lambda_processor.lambda_handler(event, get_context())
         self.assertEqual(result['new_members'], 0)
         self.assertEqual(result['updated_members'], 1)
         self.assertFalse(result['hasMore'])
         mock_keycloak.update_user.assert_called()
 
-    def test_has_more(self):
-        lambda_processor.BATCH_SIZE = 1
-
+    @patch.object(TimeBudget, 'next_round', side_effect=[1, 0])
+    def test_has_more(self, next_round):
         self.create_karl_state()
         self.create_friedrich_state()
 
@@ -95,12 +106,11 @@ class TestProcessor(unittest.TestCase):
         mock_keycloak = Mock(KeycloakService)
         lambda_processor.get_keycloak = lambda: mock_keycloak
 
-        result = lambda_processor.lambda_handler(event, Context(5))
+        result = lambda_processor.lambda_handler(event, get_context())
         self.assertTrue(result['hasMore'])
 
-    def test_counts_go_up(self):
-        lambda_processor.BATCH_SIZE = 1
-
+    @patch.object(TimeBudget, 'next_round', side_effect=[1, 0, 1])
+    def test_counts_go_up(self, next_round):
         self.create_karl_state()
         self.create_friedrich_state()
 
@@ -118,19 +128,336 @@ class TestProcessor(unittest.TestCase):
 
         mock_an.get_people_by_email = Mock(return_value=[self.get_friedrich_person()])
 
-        result = lambda_processor.lambda_handler(event, Context(5))
+        result = lambda_processor.lambda_handler(event, get_context())
         self.assertEqual(result['updated_members'], 1)
         self.assertTrue(result['hasMore'])
 
 
-        result2 = lambda_processor.lambda_handler(result, Context(5))
+        result2 = lambda_processor.lambda_handler(result, get_context())
         self.assertEqual(result2['updated_members'], 2)
         self.assertFalse(result2['hasMore'])
 
+    @patch.object(lambda_processor, 'WORKERS', 4)
+    @patch.object(lambda_processor, 'BATCH_SIZE', 200)
+    def test_concurrent_workers(self):
+        emails = [f'member{i}@example.com' for i in range(10)]
+        for email in emails:
+            State('202101', email, raw=json.dumps({'Email': email}), status=State.UNPROCESSED).save()
+
+        mock_an = Mock(ActionNetwork)
+        # Even rows are new, odd rows already exist
+        mock_an.get_people_by_email = Mock(
+            side_effect=lambda email: [self.get_karl_person()] if int(email[6]) % 2 else [])
+        lambda_processor.get_actionnetwork = lambda a: mock_an
+
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value=None)
+        lambda_processor.get_keycloak = lambda: mock_keycloak
+
+        event = {
+            'batch': '202101',
+            'ingested_rows': 10
+        }
+
+        result = lambda_processor.lambda_handler(event, get_context())
+        self.assertEqual(result['new_members'], 5)
+        self.assertEqual(result['updated_members'], 5)
+        self.assertFalse(result['hasMore'])
+        self.assertEqual(mock_keycloak.create_user.call_count, 10)
+        for email in emails:
+            self.assertEqual(State.PROCESSED, State.get('202101', range_key=email).status)
+
+    @patch.object(TimeBudget, 'next_round', side_effect=[1, 0, 1])
+    def test_cursor_is_passed_through(self, next_round):
+        self.create_karl_state()
+        self.create_friedrich_state()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.get_people_by_email = Mock(return_value=[])
+        lambda_processor.get_actionnetwork = lambda a: mock_an
+
+        mock_keycloak = Mock(KeycloakService)
+        lambda_processor.get_keycloak = lambda: mock_keycloak
+
+        event = {
+            'batch': '202101',
+            'ingested_rows': 2
+        }
+
+        with patch.object(State, 'count', side_effect=AssertionError('count should not be used')):
+            result = lambda_processor.lambda_handler(event, get_context())
+            self.assertTrue(result['hasMore'])
+            self.assertEqual('fengels@marxists.org', result['cursor']['email']['S'])
+
+            result = lambda_processor.lambda_handler(result, get_context())
+            self.assertFalse(result['hasMore'])
+
+        self.assertIsNone(result['cursor'])
+        self.assertEqual(2, result['new_members'])
+        self.assertEqual(2, mock_an.get_people_by_email.call_count)
+
+    @patch.object(lambda_processor, 'BATCH_SIZE', 2)
+    def test_rounds_continue_while_time_is_left(self):
+        emails = [f'member{i}@example.com' for i in range(5)]
+        for email in emails:
+            State('202101', email, raw=json.dumps({'Email': email}), status=State.UNPROCESSED).save()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.get_people_by_email = Mock(return_value=[])
+        lambda_processor.get_actionnetwork = lambda a: mock_an
+
+        mock_keycloak = Mock(KeycloakService)
+        lambda_processor.get_keycloak = lambda: mock_keycloak
+
+        result = lambda_processor.lambda_handler({'batch': '202101'}, get_context(60))
+
+        self.assertEqual(5, result['new_members'])
+        self.assertFalse(result['hasMore'])
+        for email in emails:
+            self.assertEqual(State.PROCESSED, State.get('202101', range_key=email).status)
+
+    def test_no_item_is_started_without_time_for_it(self):
+        self.create_karl_state()
+
+        mock_an = Mock(ActionNetwork)
+        lambda_processor.get_actionnetwork = lambda a: mock_an
+        mock_keycloak = Mock(KeycloakService)
+        lambda_processor.get_keycloak = lambda: mock_keycloak
+
+        context = Mock(get_remaining_time_in_millis=Mock(return_value=0))
+        result = lambda_processor.lambda_handler({'batch': '202101'}, context)
+
+        self.assertTrue(result['hasMore'])
+        self.assertIsNone(result['cursor'])
+        self.assertEqual(0, result['new_members'])
+        mock_an.get_people_by_email.assert_not_called()
+        self.assertEqual(
+            State.UNPROCESSED, State.get('202101', range_key='kmarx@marxists.org').status)
+
+    def test_stale_item_is_skipped(self):
+        stale = self.create_karl_state()
+        processed = State.get('202101', range_key='kmarx@marxists.org')
+        processed.status = State.PROCESSED
+        processed.save()
+
+        mock_an = Mock(ActionNetwork)
+        mock_keycloak = Mock(KeycloakService)
+
+        result = lambda_processor.process_item(stale, mock_an, mock_keycloak, True, Mock())
+
+        self.assertEqual((0, 0), result)
+        mock_an.get_people_by_email.assert_not_called()
+        mock_keycloak.get_user_by_email.assert_not_called()
+
+    def test_stored_person_id_skips_search(self):
+        karl = self.create_karl_state()
+        karl.person_ids = ['aaaaaaaa']
+        karl.has_overrides = False
+        karl.save()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.update_person = Mock(return_value={})
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
+
+        result = lambda_processor.process_item(karl, mock_an, mock_keycloak, False, Mock())
+
+        self.assertEqual((0, 1), result)
+        mock_an.get_people_by_email.assert_not_called()
+        self.assertEqual('aaaaaaaa', mock_an.update_person.call_args.kwargs['person_id'])
+
+    def test_stored_person_id_not_found_searches(self):
+        karl = self.create_karl_state()
+        karl.person_ids = ['gone']
+        karl.has_overrides = False
+        karl.save()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.update_person = Mock(side_effect=[PersonNotFoundError('gone'), {}])
+        mock_an.get_people_by_email = Mock(return_value=[
+            Person(identifiers=['action_network:bbbbbbbb'])])
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
+
+        result = lambda_processor.process_item(karl, mock_an, mock_keycloak, False, Mock())
+
+        self.assertEqual((0, 1), result)
+        mock_an.get_people_by_email.assert_called_once_with('kmarx@marxists.org')
+        saved = State.get('202101', range_key='kmarx@marxists.org')
+        self.assertEqual(['bbbbbbbb'], saved.person_ids)
+
+    def test_stored_person_id_not_found_creates_person(self):
+        karl = self.create_karl_state()
+        karl.person_ids = ['gone']
+        karl.has_overrides = False
+        karl.save()
+
+        # Autospec, so a stale person_id passed to create_person fails
+        mock_an = create_autospec(ActionNetwork, instance=True)
+        mock_an.update_person.side_effect = PersonNotFoundError('gone')
+        mock_an.get_people_by_email.return_value = []
+        mock_an.create_person.return_value = {'identifiers': ['action_network:cccccccc']}
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
+
+        result = lambda_processor.process_item(karl, mock_an, mock_keycloak, False, Mock())
+
+        self.assertEqual((1, 0), result)
+        mock_an.create_person.assert_called_once()
+        self.assertNotIn('person_id', mock_an.create_person.call_args.kwargs)
+        saved = State.get('202101', range_key='kmarx@marxists.org')
+        self.assertEqual(State.PROCESSED, saved.status)
+        self.assertEqual(['cccccccc'], saved.person_ids)
+
+    def test_created_person_id_is_saved(self):
+        karl = self.create_karl_state()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.get_people_by_email = Mock(return_value=[])
+        mock_an.create_person = Mock(return_value={'identifiers': ['action_network:cccccccc']})
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
+
+        result = lambda_processor.process_item(karl, mock_an, mock_keycloak, False, Mock())
+
+        self.assertEqual((1, 0), result)
+        saved = State.get('202101', range_key='kmarx@marxists.org')
+        self.assertEqual(State.PROCESSED, saved.status)
+        self.assertEqual(['cccccccc'], saved.person_ids)
+
+    def test_upsert_without_overrides(self):
+        karl = self.create_karl_state()
+        karl.person_ids = ['aaaaaaaa']
+        karl.has_overrides = False
+        karl.save()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.upsert_person = Mock(return_value=Person(identifiers=['action_network:aaaaaaaa']))
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
+
+        result = lambda_processor.process_item(
+            karl, mock_an, mock_keycloak, False, Mock(), upsert=True)
+
+        self.assertEqual((0, 1), result)
+        mock_an.upsert_person.assert_called_once()
+        mock_an.get_people_by_email.assert_not_called()
+        mock_an.update_person.assert_not_called()
+
+    def test_no_upsert_with_overrides(self):
+        karl = self.create_karl_state()
+        karl.person_ids = ['aaaaaaaa']
+        karl.has_overrides = True
+        karl.save()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.get_people_by_email = Mock(return_value=[Person(
+            identifiers=['action_network:aaaaaaaa'],
+            custom_fields={'override_given_name': 'Charles'})])
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
+
+        lambda_processor.process_item(karl, mock_an, mock_keycloak, False, Mock(), upsert=True)
+
+        mock_an.upsert_person.assert_not_called()
+        # The overrides are only known from the search
+        mock_an.get_people_by_email.assert_called_once_with('kmarx@marxists.org')
+        mock_an.update_person.assert_called_once()
+        self.assertEqual('aaaaaaaa', mock_an.update_person.call_args.kwargs['person_id'])
+        self.assertEqual('Charles', mock_an.update_person.call_args.kwargs['given_name'])
+
+    def test_unknown_overrides_are_searched(self):
+        karl = self.create_karl_state()
+        karl.person_ids = ['aaaaaaaa']
+        karl.save()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.get_people_by_email = Mock(return_value=[
+            Person(identifiers=['action_network:aaaaaaaa'])])
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
+
+        lambda_processor.process_item(karl, mock_an, mock_keycloak, False, Mock())
+
+        mock_an.get_people_by_email.assert_called_once_with('kmarx@marxists.org')
+        self.assertFalse(State.get('202101', range_key='kmarx@marxists.org').has_overrides)
+
+    def test_upsert_refreshes_overrides(self):
+        karl = self.create_karl_state()
+        karl.person_ids = ['aaaaaaaa']
+        # Last week's search found no overrides
+        karl.has_overrides = False
+        karl.save()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.upsert_person = Mock(return_value=Person(
+            identifiers=['action_network:aaaaaaaa'],
+            custom_fields={'override_Phone': '6175555555'}))
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
+
+        lambda_processor.process_item(karl, mock_an, mock_keycloak, False, Mock(), upsert=True)
+
+        saved = State.get('202101', range_key='kmarx@marxists.org')
+        self.assertTrue(saved.has_overrides)
+        self.assertFalse(lambda_processor.can_upsert(saved))
+
+    def test_update_by_id_refreshes_overrides(self):
+        karl = self.create_karl_state()
+        karl.person_ids = ['aaaaaaaa']
+        karl.has_overrides = False
+        karl.save()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.update_person = Mock(return_value={
+            'identifiers': ['action_network:aaaaaaaa'],
+            'custom_fields': {'override_Phone': '6175555555'}})
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
+
+        lambda_processor.process_item(karl, mock_an, mock_keycloak, False, Mock())
+
+        saved = State.get('202101', range_key='kmarx@marxists.org')
+        self.assertTrue(saved.has_overrides)
+        self.assertFalse(lambda_processor.can_upsert(saved))
+
+    def test_search_caches_overrides(self):
+        karl = self.create_karl_state()
+
+        mock_an = Mock(ActionNetwork)
+        mock_an.get_people_by_email = Mock(return_value=[Person(
+            identifiers=['action_network:aaaaaaaa'],
+            custom_fields={'override_Phone': '6175555555'})])
+        mock_keycloak = Mock(KeycloakService)
+        mock_keycloak.get_user_by_email = Mock(return_value={'id': 1})
+
+        lambda_processor.process_item(karl, mock_an, mock_keycloak, True, Mock(), upsert=True)
+
+        self.assertTrue(State.get('202101', range_key='kmarx@marxists.org').has_overrides)
+
+    @patch.object(actionnetwork, 'ActionNetwork')
+    @patch('keycloak.KeycloakAdmin')
+    def test_warm_invocation_reuses_clients(self, mock_admin, mock_an):
+        mock_admin.return_value.token = {'access_token': 'token', 'expires_in': 300}
+        lambda_processor.get_actionnetwork = GET_ACTIONNETWORK
+        lambda_processor.get_keycloak = GET_KEYCLOAK
+        actionnetwork._clients.clear()
+        lambda_processor._keycloak = None
+
+        for _ in range(2):
+            lambda_processor.lambda_handler({'batch': '202101'}, get_context())
+
+        # One login for the first invocation, none for the second
+        mock_admin.assert_called_once()
+        mock_admin.return_value.get_token.assert_not_called()
+        mock_admin.return_value.refresh_token.assert_not_called()
+        mock_an.assert_called_once()
+
+        actionnetwork._clients.clear()
+        lambda_processor._keycloak = None
+
     @patch('random.randint', return_value=9999)
     def test_create_new_member_username_exists_in_keycloak(self, mock_rand):
-        lambda_processor.RETRY_DELAY = 0
-
         self.create_karl_state()
 
         mock_an = Mock(ActionNetwork)
@@ -150,12 +477,10 @@ class TestProcessor(unittest.TestCase):
         }
 
         with self.assertRaises(RetryError):
-            lambda_processor.lambda_handler(event, Context(5))
+            lambda_processor.lambda_handler(event, get_context())
 
     @patch('random.randint', return_value=9999)
     def test_update_existing_member_username_matches_email(self, mock_rand):
-        lambda_processor.RETRY_DELAY = 0
-
         self.create_karl_state()
 
         event = {
@@ -175,7 +500,7 @@ class TestProcessor(unittest.TestCase):
         keycloak_service.check_username = Mock()
         lambda_processor.get_keycloak = lambda: keycloak_service
 
-        lambda_processor.lambda_handler(event, Context(5))
+        lambda_processor.lambda_handler(event, get_context())
         mock_keycloak_admin.update_user.assert_called()
         self.assertEqual(
             mock_keycloak_admin.update_user.call_args.kwargs['payload']['username'],
@@ -183,8 +508,6 @@ class TestProcessor(unittest.TestCase):
 
     @patch('random.randint', return_value=9999)
     def test_update_existing_member_username_matches_email_new_username_taken(self, mock_rand):
-        lambda_processor.RETRY_DELAY = 0
-
         self.create_karl_state()
 
         event = {
@@ -205,7 +528,7 @@ class TestProcessor(unittest.TestCase):
         lambda_processor.get_keycloak = lambda: keycloak_service
 
         with self.assertRaises(RetryError):
-            lambda_processor.lambda_handler(event, Context(5))
+            lambda_processor.lambda_handler(event, get_context())
 
     def create_karl_state(self):
         state = State(
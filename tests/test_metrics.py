@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Tests for metrics module"""
+
+import json
+import logging
+import unittest
+from unittest.mock import Mock, patch
+
+import boto3
+from moto import mock_aws
+import requests
+
+from actionnetwork_activist_sync import metrics as metrics_module
+from actionnetwork_activist_sync.logging import EMF_METADATA, get_logger
+from actionnetwork_activist_sync.metrics import Metrics, OperationStats, instrument_client
+
+def get_response(status_code):
+    """Helper to fake a response"""
+    response = Mock(requests.Response)
+    response.status_code = status_code
+    return response
+
+class TestOperationStats(unittest.TestCase):
+    """Tests the percentiles and histogram of one operation"""
+
+    def test_percentiles(self):
+        stats = OperationStats()
+        for latency in range(1, 101):
+            stats.add(latency)
+
+        self.assertEqual(50, stats.percentile(50))
+        self.assertEqual(95, stats.percentile(95))
+        self.assertEqual(99, stats.percentile(99))
+
+    def test_histogram(self):
+        stats = OperationStats()
+        for latency in (3, 10, 11, 400, 20000):
+            stats.add(latency)
+
+        self.assertEqual(
+            {'<=10': 2, '<=25': 1, '<=500': 1, '>10000': 1},
+            stats.histogram())
+
+class TestMetrics(unittest.TestCase):
+    """Tests recording and flushing calls"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.metrics = Metrics(namespace='Test', clock=lambda: self.now)
+
+    def advance(self, seconds, result=None):
+        self.now += seconds
+        return result
+
+    def test_call_records_latency_and_errors(self):
+        self.metrics.call('actionnetwork', 'GET people', self.advance, 0.2, get_response(200))
+        self.metrics.call('actionnetwork', 'GET people', self.advance, 0.4, get_response(429))
+        with self.assertRaises(ValueError):
+            self.metrics.call('actionnetwork', 'GET people', Mock(side_effect=ValueError))
+
+        stats = self.metrics.get_stats('actionnetwork', 'GET people')
+        self.assertEqual(3, stats.count)
+        self.assertEqual(2, stats.errors)
+        self.assertEqual([200, 400, 0], [round(latency) for latency in stats.latencies])
+
+    def test_timed(self):
+        with self.metrics.timed('keycloak', 'get_token'):
+            self.advance(0.05)
+        with self.assertRaises(KeyError):
+            with self.metrics.timed('keycloak', 'get_token'):
+                raise KeyError()
+
+        stats = self.metrics.get_stats('keycloak', 'get_token')
+        self.assertEqual((2, 1), (stats.count, stats.errors))
+
+    def test_documents_are_emf(self):
+        for seconds in (0.1, 0.2, 0.3):
+            self.metrics.call('keycloak', 'get_users', self.advance, seconds)
+
+        documents = self.metrics.get_documents('processor', timestamp=1000)
+
+        self.assertEqual(1, len(documents))
+        document = documents[0]
+        directive = document[EMF_METADATA]['CloudWatchMetrics'][0]
+        self.assertEqual(1000, document[EMF_METADATA]['Timestamp'])
+        self.assertEqual('Test', directive['Namespace'])
+        for dimension in directive['Dimensions'][0]:
+            self.assertIn(dimension, document)
+        for metric in directive['Metrics']:
+            self.assertIn(metric['Name'], document)
+        self.assertEqual('get_users', document['Operation'])
+        self.assertEqual(3, document['Count'])
+        self.assertEqual(600, document['Time'])
+        self.assertEqual(200, document['LatencyP50'])
+        self.assertEqual(300, document['LatencyP99'])
+
+        # Flushed calls aren't reported again
+        self.assertEqual([], self.metrics.get_documents('processor'))
+
+    def test_flush_writes_aws_key_to_json_log(self):
+        self.metrics.record('secretsmanager', 'GetSecretValue', 0.01)
+        get_logger('test_metrics')
+        handler = logging.getLogger().handlers[-1]
+        records = []
+
+        with patch.object(handler, 'emit', side_effect=records.append):
+            self.metrics.flush('processor')
+
+        line = json.loads(handler.format(records[0]))
+        self.assertIn('_aws', line)
+        self.assertNotIn(EMF_METADATA, line)
+        self.assertEqual('secretsmanager', line['Dependency'])
+
+    @mock_aws
+    def test_instrument_client(self):
+        client = instrument_client(
+            boto3.client('secretsmanager', region_name='us-east-1'), self.metrics)
+        # Instrumenting twice doesn't count calls twice
+        instrument_client(client, self.metrics)
+
+        client.create_secret(Name='an-sync', SecretString='{}')
+        client.get_secret_value(SecretId='an-sync')
+        with self.assertRaises(client.exceptions.ResourceNotFoundException):
+            client.get_secret_value(SecretId='missing')
+
+        stats = self.metrics.get_stats('secretsmanager', 'GetSecretValue')
+        self.assertEqual((2, 1), (stats.count, stats.errors))
+
+    def test_handler_flushes_when_it_raises(self):
+        @metrics_module.flush_metrics
+        def lambda_handler(event, context):
+            metrics_module.metrics.record('dynamodb', 'Query', 0.01)
+            raise ValueError()
+
+        with patch.object(metrics_module.metrics, 'flush') as flush, \
+                self.assertRaises(ValueError):
+            lambda_handler({}, None)
+
+        flush.assert_called_once()
+        metrics_module.metrics.reset()
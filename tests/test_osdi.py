@@ -30,3 +30,44 @@ class TestPerson(unittest.TestCase):
         with open(pathlib.Path(__file__).parent / 'data' / 'person.json') as handle:
             person = json.load(handle, object_hook=Person.load_json)
             self.assertDictEqual({'Phone': '6175555555'}, person.get_overrides())
+
+    def test_from_json_ignores_unknown_keys(self):
+        """Test that extra API fields don't break the constructor"""
+
+        person = Person.from_json({'given_name': 'Jane', 'browser_url': 'https://example.com'})
+        self.assertEqual('Jane', person.given_name)
+        self.assertFalse(hasattr(person, '__dict__'))
+
+    def test_defaults_are_not_shared(self):
+        """Test that each person gets its own lists and dicts"""
+
+        first = Person()
+        first.identifiers.append('action_network:1')
+        self.assertEqual([], Person().identifiers)
+
+    def test_primary_email_and_address(self):
+        """Test that the primary email and address are parsed on access"""
+
+        with open(pathlib.Path(__file__).parent / 'data' / 'person.json') as handle:
+            person = json.load(handle, object_hook=Person.load_json)
+
+        self.assertEqual('jane.doe@example.com', person.email)
+        self.assertEqual(['139 Tremont St'], person.address)
+        self.assertEqual('Boston', person.city)
+        self.assertEqual('MA', person.state)
+        self.assertEqual('02111-0000', person.postal_code)
+        self.assertEqual('Jane', person.to_dict()['given_name'])
+
+    def test_parsed_values_are_cached(self):
+        """Test that identifiers and custom fields are only scanned once"""
+
+        person = Person(
+            identifiers=['action_network:1'],
+            custom_fields={'override_Phone': '6175555555'})
+        person.get_actionnetwork_id()
+        person.get_overrides()
+        person.identifiers = []
+        person.custom_fields = {}
+
+        self.assertEqual('1', person.get_actionnetwork_id())
+        self.assertDictEqual({'Phone': '6175555555'}, person.get_overrides())
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Tests for rate_limit module"""
+
+import datetime
+import email.utils
+import unittest
+from unittest.mock import Mock
+
+import requests
+from keycloak.exceptions import KeycloakGetError
+
+from actionnetwork_activist_sync.rate_limit import RateLimiter, get_limiter, get_retry_after
+
+class FakeClock:
+    """Clock that only moves when something sleeps"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def get_response(status_code, headers=None):
+    """Helper to fake a response"""
+    response = Mock(requests.Response)
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+class TestRateLimiter(unittest.TestCase):
+    """Tests the RateLimiter class"""
+
+    def setUp(self):
+        self.fake = FakeClock()
+
+    def get_limiter(self, rate=4, **kwargs):
+        return RateLimiter(rate, sleep=self.fake.sleep, clock=self.fake.clock, **kwargs)
+
+    def test_token_bucket_caps_rate(self):
+        limiter = self.get_limiter(rate=4)
+        func = Mock(return_value=get_response(200))
+
+        for _ in range(12):
+            limiter.call(func)
+
+        # The first 4 use the burst, the other 8 need 2 seconds of refill
+        self.assertEqual(12, func.call_count)
+        self.assertAlmostEqual(2.0, self.fake.now)
+
+    def test_retry_after_is_respected(self):
+        limiter = self.get_limiter()
+        func = Mock(side_effect=[get_response(429, {'Retry-After': '3'}), get_response(200)])
+
+        response = limiter.call(func)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, func.call_count)
+        self.assertGreaterEqual(self.fake.now, 3)
+        self.assertEqual(1, limiter.throttled)
+
+    def test_aimd_concurrency(self):
+        limiter = self.get_limiter(max_concurrency=8)
+        func = Mock(side_effect=[get_response(429, {'Retry-After': '0'}), get_response(200)])
+
+        limiter.call(func)
+        self.assertLess(limiter.concurrency, 8)
+        halved = limiter.concurrency
+
+        for _ in range(20):
+            limiter.call(Mock(return_value=get_response(200)))
+        self.assertGreater(limiter.concurrency, halved)
+        self.assertLessEqual(limiter.concurrency, 8)
+
+    def test_server_error_backs_off_with_jitter(self):
+        limiter = self.get_limiter(base_delay=1)
+        func = Mock(side_effect=[get_response(503), get_response(503), get_response(200)])
+
+        limiter.call(func)
+
+        backoffs = [s for s in self.fake.sleeps if s >= 0.5]
+        self.assertEqual(2, len(backoffs))
+        self.assertTrue(0.5 <= backoffs[0] <= 1)
+        self.assertTrue(1 <= backoffs[1] <= 2)
+
+    def test_gives_up_after_max_attempts(self):
+        limiter = self.get_limiter(max_attempts=3)
+        func = Mock(return_value=get_response(429, {'Retry-After': '1'}))
+
+        response = limiter.call(func)
+
+        self.assertEqual(429, response.status_code)
+        self.assertEqual(3, func.call_count)
+
+    def test_retryable_exception(self):
+        limiter = self.get_limiter()
+        func = Mock(side_effect=[KeycloakGetError(response_code=503), ['user']])
+
+        self.assertEqual(['user'], limiter.call(func))
+        self.assertEqual(2, func.call_count)
+
+    def test_other_exception_is_raised(self):
+        limiter = self.get_limiter()
+        func = Mock(side_effect=KeycloakGetError(response_code=404))
+
+        with self.assertRaises(KeycloakGetError):
+            limiter.call(func)
+        self.assertEqual(1, func.call_count)
+        self.assertEqual(0, limiter.throttled)
+
+    def test_get_retry_after(self):
+        self.assertEqual(5, get_retry_after(get_response(429, {'Retry-After': '5'})))
+        self.assertEqual(0, get_retry_after(
+            get_response(429, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})))
+        self.assertEqual(0, get_retry_after(
+            get_response(429, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 -0000'})))
+        soon = email.utils.format_datetime(
+            datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            + datetime.timedelta(seconds=60))
+        self.assertAlmostEqual(60, get_retry_after(get_response(429, {'Retry-After': soon})), delta=2)
+        self.assertIsNone(get_retry_after(get_response(429)))
+
+    def test_limiter_is_shared_per_key(self):
+        self.assertIs(get_limiter('test-key', 4), get_limiter('test-key', 4))
+        self.assertIsNot(get_limiter('test-key', 4), get_limiter('other-key', 4))
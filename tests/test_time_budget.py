@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Tests for time_budget module"""
+
+import unittest
+from unittest.mock import Mock
+
+from actionnetwork_activist_sync.time_budget import TimeBudget
+
+class TestTimeBudget(unittest.TestCase):
+    """Tests sizing rounds to the time left"""
+
+    def setUp(self):
+        self.now = 0.0
+
+    def get_budget(self, remaining=600, **kwargs):
+        return TimeBudget(remaining, clock=lambda: self.now, **kwargs)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def run_round(self, budget, items, item_seconds):
+        self.now += items * item_seconds
+        budget.add_round(items, items * item_seconds)
+
+    def test_first_round_is_one_item_per_worker(self):
+        self.assertEqual(1, self.get_budget().next_round())
+        self.assertEqual(4, self.get_budget(workers=4).next_round())
+
+    def test_rounds_fill_the_time_left(self):
+        budget = self.get_budget(600, max_items=1000)
+        self.run_round(budget, 1, 2.0)
+
+        # 598 seconds left, 15 of them kept free
+        self.assertEqual(291, budget.next_round())
+
+    def test_rounds_are_capped(self):
+        budget = self.get_budget(600, max_items=200)
+        self.run_round(budget, 1, 0.1)
+
+        self.assertEqual(200, budget.next_round())
+
+    def test_slow_down_shrinks_rounds(self):
+        budget = self.get_budget(600, max_items=1000)
+        self.run_round(budget, 100, 0.5)
+        self.run_round(budget, 100, 2.0)
+
+        # Plans with the last round's 2 seconds, not the 1.25 second average
+        self.assertEqual(int((600 - 250 - 15) / 2.0), budget.next_round())
+
+    def test_margin_covers_slowest_item(self):
+        budget = self.get_budget(600)
+        budget.run_item(self.advance, 100)
+        budget.run_item(self.advance, 30)
+
+        self.assertEqual(100, budget.slowest)
+        self.assertEqual(200, budget.get_margin())
+
+    def test_time_is_up(self):
+        budget = self.get_budget(600)
+        self.run_round(budget, 10, 58.0)
+
+        self.assertEqual(0, budget.next_round())
+
+    def test_short_timeouts_keep_a_share_free(self):
+        budget = self.get_budget(5)
+
+        self.assertEqual(0.5, budget.get_margin())
+        self.now = 4.6
+        self.assertEqual(0, budget.next_round())
+
+    def test_from_context(self):
+        context = Mock(get_remaining_time_in_millis=Mock(return_value=30000))
+        budget = TimeBudget.from_context(context, clock=lambda: self.now)
+
+        self.assertEqual(30, budget.get_remaining())
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Tests for util module"""
+
+import json
+import os
+import unittest
+from unittest.mock import Mock, patch
+
+from actionnetwork_activist_sync import util
+from actionnetwork_activist_sync.util import SecretsProvider
+
+SECRET_ARN = 'arn:aws:secretsmanager:us-east-1:000000000000:secret:an-sync'
+
+class TestSecretsProvider(unittest.TestCase):
+    """Tests the cached secrets"""
+
+    def setUp(self):
+        self.now = 0
+        self.client = Mock()
+        self.client.get_secret_value.return_value = {
+            'SecretString': json.dumps({'EMAIL_SUBJECT': 'Export', 'EMAIL_FROM': 'a@example.com'})
+        }
+        patcher = patch.object(util, 'get_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.provider = SecretsProvider(ttl=300, clock=lambda: self.now)
+
+    @patch.dict(os.environ, {'AWS_SECRET_ARN': SECRET_ARN})
+    def test_secret_is_fetched_once(self):
+        os.environ.pop('EMAIL_SUBJECT', None)
+        os.environ.pop('EMAIL_FROM', None)
+
+        self.assertEqual('Export', self.provider.get('EMAIL_SUBJECT'))
+        self.assertEqual('a@example.com', self.provider.get('EMAIL_FROM'))
+        self.assertEqual('Export', self.provider.get('EMAIL_SUBJECT'))
+
+        self.client.get_secret_value.assert_called_once_with(SecretId=SECRET_ARN)
+
+    @patch.dict(os.environ, {'AWS_SECRET_ARN': SECRET_ARN})
+    def test_secret_expires(self):
+        os.environ.pop('EMAIL_SUBJECT', None)
+
+        self.provider.get('EMAIL_SUBJECT')
+        self.now = 301
+        self.provider.get('EMAIL_SUBJECT')
+
+        self.assertEqual(2, self.client.get_secret_value.call_count)
+
+    @patch.dict(os.environ, {'EMAIL_SUBJECT': SECRET_ARN})
+    def test_env_can_point_at_secret(self):
+        self.assertEqual('Export', self.provider.get('EMAIL_SUBJECT'))
+
+    @patch.dict(os.environ, {'EMAIL_SUBJECT': 'From env'})
+    def test_env_wins(self):
+        self.assertEqual('From env', self.provider.get('EMAIL_SUBJECT'))
+        self.client.get_secret_value.assert_not_called()
+
+    @patch.dict(os.environ, {'AWS_SECRET_ARN': SECRET_ARN})
+    def test_missing_secret(self):
+        os.environ.pop('MISSING', None)
+
+        with self.assertRaises(ValueError):
+            self.provider.get('MISSING')